@@ -1,80 +1,159 @@
 import os
 import random
-import sqlite3
-from typing import Any, Text, Dict, List
+from typing import Any, Callable, Text, Dict, List, Optional
 import logging
 
+import httpx
 from rasa_sdk import Action, Tracker, FormValidationAction, ActionExecutionRejection
 from rasa_sdk.events import SlotSet
 from rasa_sdk.executor import CollectingDispatcher
-from transformers import AutoTokenizer, AutoModelForCausalLM
+
+from .cities import CityResolver
+from .columnar import HOUSING_PARQUET_PATH, ColumnarHousingStore
+from .housing import COUNT_LIMIT, HOUSING_SORT, PAGE_SIZE, SORT_ORDERS, HousingQuery, HousingStore
+from .housing_pool import HOUSING_DB_PATH, HousingPool
+from .inference import GenerationRejected, GenerationTimeout, GenerationWorker, ModelLoader
+from .response_cache import create_response_cache
+from .streaming import DIALOGPT_STREAM_CHANNELS, DIALOGPT_STREAM_TOKEN, DIALOGPT_STREAM_URL, ReplyStream
+from .tracing import ACTIONS_METRICS_PORT, get_correlation_id, register_readiness, span, start_metrics_server
+
+DIALOGPT_MODEL = os.getenv('DIALOGPT_MODEL', '/app/models/dialogpt-ir-bot')
+DIALOGPT_HUB_MODEL = 'jegorkitskerkin/dialogpt-ir-bot'
+# 'sqlite' searches HOUSING_DB_PATH, 'columnar' keeps HOUSING_PARQUET_PATH in memory
+HOUSING_BACKEND = os.getenv('HOUSING_BACKEND', 'sqlite')
+# in the order of the HousingQuery fields
+HOUSING_FORM_SLOTS = ('housing_city', 'min_price', 'max_price', 'min_rooms', 'min_area')
 
 logger = logging.getLogger(__name__)
 
+if ACTIONS_METRICS_PORT:
+    start_metrics_server(int(ACTIONS_METRICS_PORT))
+
 
 class GenerateText(Action):
 
     def __init__(self):
-        if os.path.exists('/app/models/dialogpt-ir-bot'):
-            logger.info('Models exist')
-            self.model = AutoModelForCausalLM.from_pretrained("/app/models/dialogpt-ir-bot")
-            self.tokenizer = AutoTokenizer.from_pretrained("/app/models/dialogpt-ir-bot")
-        else:
-            logger.info('Downloading models')
-            self.model = AutoModelForCausalLM.from_pretrained("jegorkitskerkin/dialogpt-ir-bot")
-            self.tokenizer = AutoTokenizer.from_pretrained("jegorkitskerkin/dialogpt-ir-bot")
+        # the model loads in the background so the other actions are served right away
+        self.loader = ModelLoader(self.load_generator, name='dialogpt').start()
+        self.worker = GenerationWorker(self.generate_batch)
+        register_readiness('dialogpt', lambda: self.loader.ready)
+        self.cache = create_response_cache()
+        # the connector only accepts streamed pieces with the shared token
+        self.stream_url = DIALOGPT_STREAM_URL if DIALOGPT_STREAM_TOKEN else None
+        self.stream_client = httpx.AsyncClient(timeout=5) if self.stream_url else None
 
     def name(self) -> Text:
         return "action_dialogpt"
 
+    @staticmethod
+    def load_generator() -> Callable[..., List[Text]]:
+        # torch and transformers take seconds to import, so they are imported on the loader thread as well
+        from .dialogpt import DialoGPTBatchGenerator, load_dialogpt
+        from .history import create_history
+
+        with span('dialogpt_load'):
+            if os.path.exists(DIALOGPT_MODEL):
+                logger.info('Models exist')
+                model, tokenizer = load_dialogpt(DIALOGPT_MODEL)
+            else:
+                logger.info('Downloading models')
+                model, tokenizer = load_dialogpt(DIALOGPT_HUB_MODEL)
+
+        return DialoGPTBatchGenerator(model, tokenizer, history=create_history())
+
+    def generate_batch(self, texts: List[Text], **kwargs: Any) -> List[Text]:
+        return self.loader.get()(texts, **kwargs)
+
+    def open_stream(self, tracker: Tracker) -> Optional[ReplyStream]:
+        """
+        Streams the reply when streaming is configured and the user talks through a channel that can show it.
+        """
+        if self.stream_client is None or tracker.get_latest_input_channel() not in DIALOGPT_STREAM_CHANNELS:
+            return None
+
+        return ReplyStream(self.stream_client, self.stream_url, tracker.sender_id)
+
     async def run(
             self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]
     ) -> List[Dict[Text, Any]]:
-        new_user_input_ids = self.tokenizer.encode(tracker.latest_message['text'] + self.tokenizer.eos_token,
-                                                   return_tensors='pt')
-
-        chat_history_ids = self.model.generate(
-            new_user_input_ids,
-            max_length=1000,
-            pad_token_id=self.tokenizer.eos_token_id,
-            min_length=24,
-            num_return_sequences=1,
-            no_repeat_ngram_size=2,
-            do_sample=True,
-            # top_k=50,
-            top_p=0.85,
-            # temperature=0.6,
-            device='cpu'
-        )
-
-        generated_text = self.tokenizer.decode(chat_history_ids[:, new_user_input_ids.shape[-1]:][0],
-                                               skip_special_tokens=True)
-        generated_text = generated_text.strip()
-
-        dispatcher.utter_message(text=generated_text)
+        correlation_id = get_correlation_id(tracker)
+        text = tracker.latest_message['text']
+
+        # recurring small talk is answered from a pool of earlier replies, pre-generated pools work while loading;
+        # a reply that continues a conversation is only meant for its sender, so it is neither served nor stored
+        cacheable = self.cache is not None and not (self.loader.ready
+                                                    and self.loader.get().has_history(tracker.sender_id))
+        cached_text = self.cache.get(text) if cacheable else None
+        if cached_text is not None:
+            # the model still sees the exchange as part of the conversation
+            if self.loader.ready:
+                self.loader.get().remember(tracker.sender_id, [text, cached_text])
+
+            dispatcher.utter_message(text=cached_text)
+            return []
+
+        if self.loader.failed:
+            logger.error(f'DialoGPT reply for {correlation_id} skipped, the model failed to load: '
+                         f'{self.loader.error!r}')
+            dispatcher.utter_message(text='Sorry, I cannot chat right now, but I can still help you find a home.')
+            return []
+
+        if not self.loader.ready:
+            dispatcher.utter_message(text='I am still waking up, give me a moment and try again.')
+            return []
+
+        stream = self.open_stream(tracker)
+
+        try:
+            with span('dialogpt_generate', correlation_id):
+                # generation runs on the worker thread, other actions keep being served meanwhile
+                generated_text = await self.worker.generate(text, on_text=stream.push if stream else None,
+                                                            sender_id=tracker.sender_id)
+        except (GenerationRejected, GenerationTimeout) as e:
+            logger.warning(f'DialoGPT reply for {correlation_id} dropped: {e}')
+            generated_text = 'Sorry, I am a bit busy right now. Could you say that again?'
+        else:
+            if cacheable:
+                self.cache.add(text, generated_text)
+        finally:
+            if stream is not None:
+                await stream.close()
+
+        if stream is None:
+            dispatcher.utter_message(text=generated_text)
+        else:
+            # the final message carries the complete reply and replaces the streamed pieces
+            dispatcher.utter_message(json_message={'text': generated_text, 'message_id': stream.message_id,
+                                                   'final': True})
 
         return []
 
 
+def open_housing_pool() -> HousingPool:
+    if HOUSING_BACKEND == 'columnar':
+        # one in-memory store serves every thread
+        store = ColumnarHousingStore.open(HOUSING_PARQUET_PATH)
+        return HousingPool(lambda: store)
+
+    logger.info(f'Searching housing in {HOUSING_DB_PATH}')
+
+    return HousingPool.open(HOUSING_DB_PATH)
+
+
 class GetHousing(Action):
+    # opened once, for GetHousing and ShowMoreHousing
+    shared_pool: Optional[HousingPool] = None
 
     def __init__(self, conn=None) -> None:
-        def dict_factory(cursor, row):
-            d = {}
-            for idx, col in enumerate(cursor.description):
-                d[col[0]] = row[idx]
-            return d
-
-        if conn is None:
-            self.conn = sqlite3.connect('/app/actions/data/housing.db')
-            logger.info('connected to db')
-        else:
-            self.conn = conn
+        if conn is not None:
+            self.pool = HousingPool(lambda: HousingStore(conn), threads=1)
+            return
 
-        self.conn.row_factory = dict_factory
+        if GetHousing.shared_pool is None:
+            GetHousing.shared_pool = open_housing_pool()
+            register_readiness('housing', GetHousing.shared_pool.healthy)
 
-    def __del__(self) -> None:
-        self.conn.close()
+        self.pool = GetHousing.shared_pool
 
     def name(self) -> Text:
         return "action_get_housing"
@@ -82,37 +161,47 @@ class GetHousing(Action):
     async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[
         Dict[Text, Any]]:
 
-        city = tracker.get_slot('housing_city')
-        max_price = tracker.get_slot('max_price')
-        min_price = tracker.get_slot('min_price')
-        min_rooms = tracker.get_slot('min_rooms')
-        min_area = tracker.get_slot('min_area')
+        cursor = tracker.get_slot('housing_cursor')
+        sort = tracker.get_slot('housing_sort')
+        if sort not in SORT_ORDERS:
+            sort = HOUSING_SORT
 
-        cur = self.conn.cursor()
+        if tracker.get_slot('housing_city') is not None:
+            query = HousingQuery(*(tracker.get_slot(slot) for slot in HOUSING_FORM_SLOTS))
+        elif cursor:
+            # asked for another sort order, the last search is run again from the top
+            query = HousingQuery(*cursor['query'])
+        else:
+            dispatcher.utter_message(text='Tell me what kind of housing you are looking for first.')
+            return []
 
-        cur.execute("SELECT * FROM housing WHERE city = ? AND price >= ? AND price <= ? AND rooms >= ? AND area >= ?",
-                    (city, min_price, max_price, min_rooms, min_area))
+        with span('housing_query', get_correlation_id(tracker)):
+            total, rows, after = await self.pool.search(query, sort)
 
-        rows = cur.fetchall()
-        cur.close()
+        reset = [SlotSet(slot, None) for slot in HOUSING_FORM_SLOTS]
 
-        if len(rows) == 0:
+        if total == 0:
             dispatcher.utter_message(text='Sorry! No results found! Please try again.')
 
-            return [
-                SlotSet('max_price', None),
-                SlotSet('min_price', None),
-                SlotSet('housing_city', None),
-                SlotSet('min_rooms', None),
-                SlotSet('min_area', None)
-            ]
+            return reset + [SlotSet('housing_cursor', None)]
 
+        found = f'{total}+' if total >= COUNT_LIMIT else total
         dispatcher.utter_message(text=
-                                 f'Found {len(rows)} properties' if len(rows) <= 10
-                                 else f'Found {len(rows)} properties, showing first 10'
+                                 f'Found {found} properties' if after is None
+                                 else f'Found {found} properties, showing first {PAGE_SIZE}. '
+                                      f'Say "show more" to see the next ones.'
                                  )
 
-        for row in rows[:10]:
+        self.utter_listings(dispatcher, rows)
+
+        # the search and the keyset of its last listing, for "show more" and for sorting it differently
+        cursor = {'query': list(query), 'sort': sort, 'after': after, 'shown': len(rows), 'total': total}
+
+        return reset + [SlotSet('housing_cursor', cursor)]
+
+    @staticmethod
+    def utter_listings(dispatcher: CollectingDispatcher, rows: List[Any]) -> None:
+        for row in rows:
             msg = f"""\
             Price: € {row['price']}
             Area: {row['area']} m2
@@ -127,22 +216,56 @@ class GetHousing(Action):
                 'link': row['link'],
             }
 
+            if row['image']:
+                data['image'] = row['image']
+
             dispatcher.utter_message(json_message=data)
 
-        return [
-            SlotSet('max_price', None),
-            SlotSet('min_price', None),
-            SlotSet('housing_city', None),
-            SlotSet('min_rooms', None),
-            SlotSet('min_area', None)
-        ]
+
+class ShowMoreHousing(GetHousing):
+
+    def name(self) -> Text:
+        return "action_show_more_housing"
+
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[
+        Dict[Text, Any]]:
+
+        cursor = tracker.get_slot('housing_cursor')
+
+        rows, after = [], None
+        if cursor and cursor['after'] is not None:
+            with span('housing_query', get_correlation_id(tracker)):
+                _, rows, after = await self.pool.search(HousingQuery(*cursor['query']), cursor['sort'],
+                                                        cursor['after'])
+
+        if not rows:
+            dispatcher.utter_message(text='That was everything I found. Ask me to find housing for a new search.')
+            return []
+
+        shown = cursor['shown'] + len(rows)
+        total = cursor['total']
+        found = f'{total}+' if total >= COUNT_LIMIT else total
+        dispatcher.utter_message(text=f'Properties {cursor["shown"] + 1} to {shown} of {found}')
+
+        self.utter_listings(dispatcher, rows)
+
+        return [SlotSet('housing_cursor', dict(cursor, after=after, shown=shown))]
 
 
 class ValidateHousingForm(FormValidationAction):
+    # built on first use from the cities in the database
+    cities: Optional[CityResolver] = None
 
     def name(self) -> Text:
         return "validate_housing_form"
 
+    @classmethod
+    def city_resolver(cls) -> CityResolver:
+        if cls.cities is None:
+            cls.cities = CityResolver.open(HOUSING_DB_PATH)
+
+        return cls.cities
+
     async def required_slots(
             self,
             slots_mapped_in_domain: List[Text],
@@ -219,26 +342,11 @@ class ValidateHousingForm(FormValidationAction):
         if slot_value is None:
             return {'housing_city': None}
 
-        def cap_each(string):
-            list_of_words = string.split(" ")
-
-            for word in list_of_words:
-                list_of_words[list_of_words.index(word)] = word.capitalize()
-
-            return " ".join(list_of_words)
-
-        # TODO: get cities from database
-        cities_list = ['Amsterdam', 'Rotterdam', 'Eindhoven', 'Utrecht', 'Haarlem', 'Groningen',
-                       'Leiden', 'Breda', 'Maastricht', 'Amstelveen', 'Arnhem', 'Almere', 'Delft',
-                       'Tilburg', 'Hilversum', 'Zwolle', 'Enschede', 'Amersfoort', 'Zaandam',
-                       'Heerlen', 'Dordrecht', 'Apeldoorn', 'Bussum', 'Nijmegen', 'Roermond',
-                       'Deventer', 'Leeuwarden', 'Alkmaar']
-
-        _city = cap_each(str(slot_value))
-        if _city in cities_list:
-            return {'housing_city': _city}
+        city = self.city_resolver().resolve(str(slot_value))
+        if city is not None:
+            return {'housing_city': city}
         else:
-            dispatcher.utter_message(text=f"City should be one of the following: {', '.join(cities_list)}")
+            dispatcher.utter_message(text=self.city_resolver().message)
             return {'housing_city': None}
 
     def validate_min_price(self, slot_value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain) -> Dict[Text, Any]:
@@ -0,0 +1,154 @@
+"""
+Resolves what the user typed to one of the cities in the ``housing`` table.
+"""
+import logging
+import re
+import sqlite3
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Text, Tuple
+
+from .housing import connect_readonly
+
+CITIES_QUERY = 'SELECT city FROM housing WHERE city IS NOT NULL GROUP BY city ORDER BY COUNT(*) DESC, city'
+
+# names the same city goes by; every name resolves to whichever of them the scraper stored
+CITY_ALIASES = (
+    ('Den Haag', 'The Hague', "'s-Gravenhage", 'Hague'),
+    ("'s-Hertogenbosch", 'Den Bosch', 'Hertogenbosch', 'Bois-le-Duc'),
+    ('Nijmegen', 'Nimwegen'),
+    ('Vlissingen', 'Flushing'),
+)
+
+# one typo is allowed per started group of this many letters: one in "Brda", two in "Eindhovven"
+LETTERS_PER_EDIT = 6
+MIN_TRIGRAM_SIMILARITY = 0.3
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(name: Text) -> Text:
+    """
+    "'s-Hertogenbosch", "s hertogenbosch" and "S-HERTOGENBOSCH" are the same name.
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r'[^\w\s]', ' ', name.lower()).split())
+
+
+def trigrams(name: Text) -> Set[Text]:
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: Text, b: Text, limit: int) -> int:
+    """
+    Levenshtein distance of ``a`` and ``b``, or ``limit + 1`` once it is known to exceed ``limit``.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+
+        if min(current) > limit:
+            return limit + 1
+
+        previous = current
+
+    return previous[-1]
+
+
+class CityResolver:
+    """
+    City lookup built once from the cities in ``housing.db`` and rebuilt when another connection changes the
+    database.
+
+    An exact name or alias is a dictionary lookup on its normalized form. Otherwise the names sharing trigrams with
+    the input are candidates, and the closest one within a few edits is taken.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+        self.cities: List[Text] = []
+        self.message = ''
+        self._names: Dict[Text, Text] = {}
+        self._trigrams: Dict[Text, Set[Text]] = {}
+        self._trigram_counts: Dict[Text, int] = {}
+        self._data_version = None
+
+        self.refresh()
+
+    @classmethod
+    def open(cls, path: Text) -> 'CityResolver':
+        return cls(connect_readonly(path))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def refresh(self) -> None:
+        try:
+            # changes whenever another connection commits, e.g. the scraper
+            data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+            if data_version == self._data_version:
+                return
+
+            self.load([row[0] for row in self.conn.execute(CITIES_QUERY)])
+            self._data_version = data_version
+        except sqlite3.Error as e:
+            logger.warning(f'Could not load the cities: {e!r}')
+
+    def load(self, cities: List[Text]) -> None:
+        names = {normalize(city): city for city in cities}
+
+        for aliases in CITY_ALIASES:
+            city = next((names[normalize(alias)] for alias in aliases if normalize(alias) in names), None)
+
+            if city is not None:
+                for alias in aliases:
+                    names.setdefault(normalize(alias), city)
+
+        index = defaultdict(set)
+        for name in names:
+            for trigram in trigrams(name):
+                index[trigram].add(name)
+
+        self.cities = cities
+        self.message = f"City should be one of the following: {', '.join(cities)}"
+        self._names, self._trigrams = names, dict(index)
+        self._trigram_counts = {name: len(trigrams(name)) for name in names}
+
+    def resolve(self, text: Text) -> Optional[Text]:
+        self.refresh()
+
+        name = normalize(text)
+        city = self._names.get(name)
+
+        if city is not None or not name:
+            return city
+
+        grams = trigrams(name)
+        shared: Dict[Text, int] = defaultdict(int)
+        for trigram in grams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+
+        limit = 1 + (len(name) - 1) // LETTERS_PER_EDIT
+        best: Optional[Tuple[int, float, Text]] = None
+
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + self._trigram_counts[candidate] - count)
+            if similarity < MIN_TRIGRAM_SIMILARITY:
+                continue
+
+            distance = edit_distance(name, candidate, limit)
+            if distance <= limit and (best is None or (distance, -similarity) < best[:2]):
+                best = (distance, -similarity, candidate)
+
+        return self._names[best[2]] if best is not None else None
@@ -0,0 +1,285 @@
+"""
+In-memory columnar alternative to ``HousingStore``.
+
+The listings are loaded once into NumPy columns, partitioned by city and sorted in every sort order. A search is a
+``searchsorted`` on the leading sort column plus vectorized masks on the others, so no SQL runs and only the listings
+of the returned page become Python objects. The source file is reloaded when it changes.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Text
+
+import numpy as np
+
+from .housing import COUNT_LIMIT, HOUSING_SORT, LISTING_COLUMNS, PAGE_SIZE, SORT_ORDERS, HousingQuery, SearchResult
+
+# /app/actions/data/dutch_housing.parquet in the actions container, published there by the scraper
+HOUSING_PARQUET_PATH = os.getenv('HOUSING_PARQUET_PATH', os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                                      'data', 'dutch_housing.parquet'))
+HOUSING_RELOAD_INTERVAL = float(os.getenv('HOUSING_RELOAD_INTERVAL', '5'))
+
+NUMERIC_COLUMNS = ('price', 'area', 'rooms')
+# masks are computed on growing chunks until a page is filled, so a broad search does not scan the whole city
+SCAN_CHUNK = 1024
+
+logger = logging.getLogger(__name__)
+
+
+def load_parquet(path: Text) -> Dict[Text, Sequence[Any]]:
+    """
+    Reads the scraped listings; a row's id is its position plus one, the rowid it got in ``housing.db``.
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    columns = {name: table.column(name).to_numpy() if name in NUMERIC_COLUMNS else table.column(name).to_pylist()
+               for name in LISTING_COLUMNS + ('city',) if name in table.schema.names}
+    columns['id'] = np.arange(1, table.num_rows + 1)
+
+    return columns
+
+
+def load_sqlite(path: Text) -> Dict[Text, Sequence[Any]]:
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+    try:
+        cur = conn.execute(f'SELECT rowid, city, {", ".join(LISTING_COLUMNS)} FROM housing ORDER BY rowid')
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    return {name: [row[i] for row in rows] for i, name in enumerate(('id', 'city') + LISTING_COLUMNS)}
+
+
+def drop_incomplete(columns: Dict[Text, Sequence[Any]]) -> Dict[Text, Sequence[Any]]:
+    """
+    Leaves out the listings without a price, area or rooms, which no search matches, like ``NULL >= ?`` in SQL.
+    """
+    # None and NaN, the parquet stand-in for NULL, both become NaN
+    complete = np.logical_and.reduce([~np.isnan(np.asarray(columns[name], dtype=np.float64))
+                                      for name in NUMERIC_COLUMNS])
+    if complete.all():
+        return columns
+
+    rows = np.flatnonzero(complete)
+
+    return {name: values[rows] if isinstance(values, np.ndarray) else [values[row] for row in rows]
+            for name, values in columns.items()}
+
+
+class SortedPartition(NamedTuple):
+    # sort key plus id, negated for descending orders so that every key ascends
+    keys: np.ndarray
+    # contiguous copy of the first key field, searching a field of ``keys`` would copy it every time
+    lead: np.ndarray
+    price: np.ndarray
+    rooms: np.ndarray
+    area: np.ndarray
+    # positions of the listings in the store's columns
+    rows: np.ndarray
+
+
+def partition(columns: Dict[Text, Sequence[Any]]) -> Dict[Text, Dict[Text, SortedPartition]]:
+    """
+    Splits the listings by city and sorts every city in each of the ``SORT_ORDERS``.
+    """
+    numeric = {name: np.asarray(columns[name], dtype=np.int64) for name in NUMERIC_COLUMNS + ('id',)}
+    codes_by_city: Dict[Text, int] = {}
+    codes = np.fromiter((codes_by_city.setdefault(city or '', len(codes_by_city)) for city in columns['city']),
+                        dtype=np.int64, count=len(columns['city']))
+    cities = list(codes_by_city)
+
+    partitions: Dict[Text, Dict[Text, SortedPartition]] = {city: {} for city in cities if city}
+
+    for sort, (key, descending) in SORT_ORDERS.items():
+        sign = -1 if descending else 1
+        fields = key + ('id',)
+
+        # one sort by city and then the sort key, each city is a slice of it
+        order = np.lexsort([sign * numeric[field] for field in reversed(fields)] + [codes])
+        starts = np.searchsorted(codes[order], np.arange(len(cities) + 1))
+
+        for code, city in enumerate(cities):
+            if not city:
+                continue
+
+            rows = order[starts[code]:starts[code + 1]]
+
+            keys = np.empty(len(rows), dtype=[(field, np.int64) for field in fields])
+            for field in fields:
+                keys[field] = sign * numeric[field][rows]
+
+            partitions[city][sort] = SortedPartition(keys, keys[key[0]].copy(), numeric['price'][rows],
+                                                     numeric['rooms'][rows], numeric['area'][rows], rows)
+
+    return partitions
+
+
+class ColumnarHousingStore:
+    """
+    Listing search with the results of ``HousingStore``, including its ``after`` keysets, answered from memory.
+    """
+
+    def __init__(self, load_fn, path: Text, reload_interval: float = HOUSING_RELOAD_INTERVAL):
+        self.load_fn = load_fn
+        self.path = path
+        self.reload_interval = reload_interval
+
+        self._reload_lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._version = self.file_version()
+        self.load()
+
+    @classmethod
+    def open(cls, path: Text = HOUSING_PARQUET_PATH, **kwargs: Any) -> 'ColumnarHousingStore':
+        return cls(load_parquet, path, **kwargs)
+
+    @classmethod
+    def from_sqlite(cls, path: Text, **kwargs: Any) -> 'ColumnarHousingStore':
+        return cls(load_sqlite, path, **kwargs)
+
+    def close(self) -> None:
+        pass
+
+    def check(self) -> bool:
+        # the listings are in memory, a reload that fails keeps serving the previous ones
+        return True
+
+    def file_version(self) -> Any:
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> None:
+        start = time.perf_counter()
+        columns = drop_incomplete(self.load_fn(self.path))
+
+        partitions = partition(columns)
+
+        size = len(columns['id'])
+        arrays = {}
+        for name in LISTING_COLUMNS + ('id',):
+            # the image column is only there once enrich_images.py has run
+            values = columns.get(name, [None] * size)
+            arrays[name] = np.asarray(values, dtype=np.int64 if name in NUMERIC_COLUMNS + ('id',) else object)
+
+        # swapped in one assignment, searches running meanwhile keep the data they started with
+        self.snapshot = partitions, arrays
+
+        logger.info(f'Loaded {size} listings in {len(partitions)} cities from {self.path} '
+                    f'in {time.perf_counter() - start:.2f}s')
+
+    def maybe_reload(self) -> None:
+        if time.monotonic() - self._checked_at < self.reload_interval or not self._reload_lock.acquire(blocking=False):
+            return
+
+        try:
+            self._checked_at = time.monotonic()
+            version = self.file_version()
+
+            if version != self._version:
+                self.load()
+                self._version = version
+        except Exception as e:
+            # e.g. a file that is still being written, it is picked up on the next check
+            logger.warning(f'Could not reload {self.path}: {e!r}')
+        finally:
+            self._reload_lock.release()
+
+    def search(self, query: HousingQuery, sort: Text = HOUSING_SORT, after: Optional[Sequence[Any]] = None,
+               limit: int = PAGE_SIZE) -> SearchResult:
+        self.maybe_reload()
+
+        query = query.numeric()
+        partitions, columns = self.snapshot
+        partitions = partitions.get(query.city)
+
+        # like NULL in SQL, a missing bound matches nothing
+        if partitions is None or None in query:
+            return SearchResult(0 if after is None else None, [])
+
+        bounds = {
+            'price': (query.min_price, query.max_price),
+            'rooms': (query.min_rooms, np.inf),
+            'area': (query.min_area, np.inf),
+        }
+
+        total = None
+        if after is None:
+            cheapest = partitions['cheapest']
+            lo, hi = self.lead_range(cheapest, 'cheapest', bounds)
+            total = len(self.scan(cheapest, bounds, lo, hi, COUNT_LIMIT))
+
+            if not total:
+                return SearchResult(total, [])
+
+        part = partitions[sort]
+        lo, hi = self.lead_range(part, sort, bounds)
+
+        if after is not None:
+            key, descending = SORT_ORDERS[sort]
+            sign = -1 if descending else 1
+            keyset = np.array(tuple(sign * value for value in after), dtype=part.keys.dtype)
+            lo = max(lo, int(np.searchsorted(part.keys, keyset, side='right')))
+
+        positions = self.scan(part, bounds, lo, hi, limit + 1)
+        listings = self.listings(columns, part.rows[positions[:limit]])
+
+        if len(positions) <= limit:
+            return SearchResult(total, listings)
+
+        key, _ = SORT_ORDERS[sort]
+        last = listings[-1]
+
+        return SearchResult(total, listings, [last[column] for column in key] + [last['id']])
+
+    @staticmethod
+    def lead_range(part: SortedPartition, sort: Text, bounds: Dict[Text, Any]) -> Sequence[int]:
+        """
+        The slice of the partition within the bounds on its leading sort column.
+        """
+        key, descending = SORT_ORDERS[sort]
+        low, high = bounds[key[0]]
+
+        if descending:
+            low, high = -high, -low
+
+        # integer bounds, a float would make NumPy cast the whole column before searching it
+        lo = int(np.searchsorted(part.lead, math.ceil(low), side='left')) if low > -np.inf else 0
+        hi = int(np.searchsorted(part.lead, math.floor(high), side='right')) if high < np.inf else len(part.lead)
+
+        return lo, hi
+
+    @classmethod
+    def scan(cls, part: SortedPartition, bounds: Dict[Text, Any], lo: int, hi: int, count: int) -> np.ndarray:
+        """
+        Positions of the first ``count`` matches between ``lo`` and ``hi``.
+        """
+        found: List[np.ndarray] = []
+        matched, chunk = 0, SCAN_CHUNK
+
+        while lo < hi and matched < count:
+            end = min(hi, lo + chunk)
+            positions = lo + np.flatnonzero(cls.matches(part, bounds, lo, end))
+            found.append(positions)
+            matched += len(positions)
+            lo, chunk = end, chunk * 2
+
+        return np.concatenate(found)[:count] if found else np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def matches(part: SortedPartition, bounds: Dict[Text, Any], lo: int, hi: int) -> np.ndarray:
+        price, rooms, area = part.price[lo:hi], part.rooms[lo:hi], part.area[lo:hi]
+        (min_price, max_price), (min_rooms, _), (min_area, _) = bounds['price'], bounds['rooms'], bounds['area']
+
+        return (price >= min_price) & (price <= max_price) & (rooms >= min_rooms) & (area >= min_area)
+
+    @staticmethod
+    def listings(columns: Dict[Text, np.ndarray], rows: np.ndarray) -> List[Dict[Text, Any]]:
+        names = LISTING_COLUMNS + ('id',)
+        values = [columns[name][rows].tolist() for name in names]
+
+        return [dict(zip(names, row)) for row in zip(*values)]
@@ -0,0 +1,375 @@
+import importlib.util
+import json
+import logging
+import os
+import struct
+import threading
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+from .history import ConversationHistory, Prompt
+
+try:
+    from transformers.pytorch_utils import Conv1D
+except ImportError:
+    from transformers.modeling_utils import Conv1D
+
+# generate continues from cached keys/values over several new tokens since the cache classes exist
+CACHE_REUSE = importlib.util.find_spec('transformers.cache_utils') is not None
+
+try:
+    from transformers.modeling_utils import no_init_weights
+except ImportError:
+    try:
+        from transformers.initialization import no_init_weights
+    except ImportError:
+        no_init_weights = nullcontext
+
+DIALOGPT_MODE = os.getenv('DIALOGPT_MODE', 'fp32')
+DIALOGPT_QUANTIZED_PATH = os.getenv('DIALOGPT_QUANTIZED_PATH')
+DIALOGPT_THREADS = int(os.getenv('DIALOGPT_THREADS', '0'))
+DIALOGPT_MAX_NEW_TOKENS = int(os.getenv('DIALOGPT_MAX_NEW_TOKENS', '64'))
+DIALOGPT_MMAP = os.getenv('DIALOGPT_MMAP', '1') == '1'
+
+QUANTIZED_WEIGHTS = 'quantized.pt'
+SAFETENSORS_WEIGHTS = 'model.safetensors'
+
+SAFETENSORS_DTYPES = {
+    'F64': np.float64, 'F32': np.float32, 'F16': np.float16,
+    'I64': np.int64, 'I32': np.int32, 'I16': np.int16, 'I8': np.int8, 'U8': np.uint8, 'BOOL': np.bool_,
+}
+
+GENERATE_KWARGS = dict(
+    # replies are short chit-chat, an uncapped 1000 token budget only adds worst case latency
+    max_new_tokens=DIALOGPT_MAX_NEW_TOKENS,
+    min_length=24,
+    num_return_sequences=1,
+    no_repeat_ngram_size=2,
+    do_sample=True,
+    # top_k=50,
+    top_p=0.85,
+    # temperature=0.6,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def conv1d_to_linear(model: Any) -> Any:
+    """
+    Replaces GPT-2 style ``Conv1D`` layers by equivalent ``nn.Linear`` ones so dynamic quantization covers them.
+    """
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+
+                setattr(parent, name, linear)
+
+    return model
+
+
+def quantize(model: Any) -> Any:
+    """
+    Dynamic int8 quantization of all linear layers, weights are stored as int8 and activations stay float.
+    """
+    model = conv1d_to_linear(model)
+    model.eval()
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def save_quantized(model: Any, tokenizer: Any, path: Text) -> None:
+    """
+    Stores an already quantized model as its int8 state dict next to its config and tokenizer.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    model.config.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    torch.save(model.state_dict(), os.path.join(path, QUANTIZED_WEIGHTS))
+
+
+def load_quantized(path: Text) -> Tuple[Any, Any]:
+    model = quantize(AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(path)))
+    model.load_state_dict(torch.load(os.path.join(path, QUANTIZED_WEIGHTS)))
+
+    return model, AutoTokenizer.from_pretrained(path)
+
+
+def mmap_safetensors(path: Text) -> Dict[Text, Any]:
+    """
+    Maps the tensors of a safetensors file into memory without reading them.
+
+    The mapping is copy-on-write, so the pages come from the page cache and are shared by every process that maps
+    the same file for as long as nobody writes to them.
+    """
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+
+    header.pop('__metadata__', None)
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=8 + header_size)
+
+    tensors = {}
+    for name, info in header.items():
+        if info['dtype'] not in SAFETENSORS_DTYPES:
+            raise ValueError(f'Cannot memory-map {name} of dtype {info["dtype"]}')
+
+        start, end = info['data_offsets']
+        array = data[start:end].view(SAFETENSORS_DTYPES[info['dtype']]).reshape(info['shape'])
+        tensors[name] = torch.from_numpy(array)
+
+    return tensors
+
+
+def find_safetensors(name_or_path: Text) -> Optional[Text]:
+    """
+    Returns the safetensors weights of a local model directory or a hub model, if it has any.
+    """
+    if os.path.isdir(name_or_path):
+        path = os.path.join(name_or_path, SAFETENSORS_WEIGHTS)
+        return path if os.path.exists(path) else None
+
+    from huggingface_hub import hf_hub_download
+
+    try:
+        return hf_hub_download(name_or_path, SAFETENSORS_WEIGHTS)
+    except Exception as e:
+        logger.info(f'No {SAFETENSORS_WEIGHTS} for {name_or_path}: {e!r}')
+        return None
+
+
+def load_mmap(name_or_path: Text, weights_path: Text) -> Any:
+    """
+    Builds the model with memory-mapped weights instead of reading them into private memory.
+    """
+    with no_init_weights():
+        model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(name_or_path))
+
+    parameters = dict(model.named_parameters())
+    loaded = set()
+
+    for name, tensor in mmap_safetensors(weights_path).items():
+        # base model checkpoints name their weights without the head's prefix
+        if name not in parameters and f'{model.base_model_prefix}.{name}' in parameters:
+            name = f'{model.base_model_prefix}.{name}'
+
+        if name not in parameters:
+            continue
+
+        module_name, _, attr = name.rpartition('.')
+        module = model.get_submodule(module_name)
+        module._parameters[attr] = torch.nn.Parameter(tensor.to(parameters[name].dtype), requires_grad=False)
+        loaded.add(name)
+
+    # tied weights such as GPT-2's lm_head are stored once and have to point at the mapped tensor again
+    model.tie_weights()
+
+    missing = set(dict(model.named_parameters())) - loaded
+    if missing:
+        raise ValueError(f'{weights_path} lacks weights for {", ".join(sorted(missing))}')
+
+    model.eval()
+
+    return model
+
+
+def load_dialogpt(name_or_path: Text, mode: Text = DIALOGPT_MODE,
+                  quantized_path: Optional[Text] = DIALOGPT_QUANTIZED_PATH) -> Tuple[Any, Any]:
+    """
+    Loads DialoGPT for CPU inference.
+
+    ``fp32`` keeps the original weights, memory-mapped from ``model.safetensors`` when the model has one and
+    ``DIALOGPT_MMAP`` is on. ``int8`` quantizes the linear layers dynamically; with ``quantized_path`` the quantized
+    weights are loaded from there, or written there on first use so later starts skip the fp32 load.
+    """
+    if DIALOGPT_THREADS:
+        torch.set_num_threads(DIALOGPT_THREADS)
+
+    if mode == 'int8':
+        if quantized_path and os.path.exists(os.path.join(quantized_path, QUANTIZED_WEIGHTS)):
+            logger.info(f'Loading quantized DialoGPT from {quantized_path}')
+            return load_quantized(quantized_path)
+
+        model = quantize(AutoModelForCausalLM.from_pretrained(name_or_path))
+        tokenizer = AutoTokenizer.from_pretrained(name_or_path)
+
+        if quantized_path:
+            save_quantized(model, tokenizer, quantized_path)
+
+        return model, tokenizer
+    elif mode == 'fp32':
+        weights_path = find_safetensors(name_or_path) if DIALOGPT_MMAP else None
+
+        if weights_path is not None:
+            model = load_mmap(name_or_path, weights_path)
+        else:
+            model = AutoModelForCausalLM.from_pretrained(name_or_path)
+            model.eval()
+
+        return model, AutoTokenizer.from_pretrained(name_or_path)
+    else:
+        raise ValueError(f'Unknown DialoGPT mode: {mode}')
+
+
+class TokenStreamer:
+    """
+    ``generate`` streamer that decodes the tokens of each batch row as they are produced and passes the newly
+    decoded text to that row's callback.
+    """
+
+    def __init__(self, tokenizer: Any, callbacks: Sequence[Optional[Callable[[Text], None]]]):
+        self.tokenizer = tokenizer
+        self.callbacks = callbacks
+
+        self.tokens: List[List[int]] = [[] for _ in callbacks]
+        self.emitted = [0] * len(callbacks)
+        self.finished = [callback is None for callback in callbacks]
+        self.prompt_seen = False
+
+    def put(self, value: Any) -> None:
+        # the first call carries the prompt, every later one the next token of each row
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+
+        for i, row in enumerate(value.reshape(len(self.callbacks), -1).tolist()):
+            if self.finished[i]:
+                continue
+
+            for token in row:
+                if token == self.tokenizer.eos_token_id:
+                    self.finished[i] = True
+                    break
+
+                self.tokens[i].append(token)
+
+            self._emit(i)
+
+    def end(self) -> None:
+        pass
+
+    def _emit(self, i: int) -> None:
+        text = self.tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+
+        # a multi-byte character split over tokens decodes to a replacement character until it is complete
+        if text.endswith('\ufffd') or len(text) <= self.emitted[i]:
+            return
+
+        delta = text[self.emitted[i]:]
+        self.emitted[i] = len(text)
+        self.callbacks[i](delta)
+
+
+def cache_length(past: Any) -> int:
+    """
+    The number of tokens the cached keys/values cover.
+    """
+    if hasattr(past, 'get_seq_length'):
+        return past.get_seq_length()
+
+    return past[0][0].shape[-2]
+
+
+class DialoGPTBatchGenerator:
+    """
+    Generates replies for several user messages in one left-padded ``generate`` call.
+
+    With a ``history`` the replies continue each sender's conversation. A request whose sender's keys/values are
+    cached and that is generated alone only runs the model over the tokens added since the last reply.
+    """
+
+    def __init__(self, model: Any, tokenizer: Any, history: Optional[ConversationHistory] = None,
+                 **generate_kwargs: Any):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.history = history
+        self.generate_kwargs = dict(GENERATE_KWARGS, **generate_kwargs)
+
+        # decoder-only models continue from the right, so prompts are padded on the left
+        self.tokenizer.padding_side = 'left'
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        # replies from the response cache are tokenized on the event loop while the worker tokenizes prompts
+        self._tokenizer_lock = threading.Lock()
+
+    def encode(self, texts: List[Text]) -> List[List[int]]:
+        """
+        Token ids of each text as a turn, ending with the end of sequence token.
+        """
+        with self._tokenizer_lock:
+            return self.tokenizer([text + self.tokenizer.eos_token for text in texts])['input_ids']
+
+    def remember(self, sender_id: Text, texts: List[Text]) -> None:
+        """
+        Adds turns that were answered without generating to the sender's conversation.
+        """
+        if self.history is not None:
+            self.history.add_turns(sender_id, self.encode(texts))
+
+    def has_history(self, sender_id: Text) -> bool:
+        """
+        Whether replies to the sender depend on an earlier conversation.
+        """
+        return self.history is not None and self.history.has_turns(sender_id)
+
+    def __call__(self, texts: List[Text], on_text: Optional[Sequence[Optional[Callable[[Text], None]]]] = None,
+                 sender_ids: Optional[Sequence[Optional[Text]]] = None) -> List[Text]:
+        """
+        Generates one reply per text. ``on_text`` optionally holds a callback per text that receives the reply
+        piece by piece while it is generated, ``sender_ids`` the sender of each text.
+        """
+        input_ids = self.encode(texts)
+
+        if self.history is not None and sender_ids is not None:
+            prompts = [self.history.prompt(sender_id, ids) for sender_id, ids in zip(sender_ids, input_ids)]
+        else:
+            prompts = [Prompt(None, [ids], None, 0) for ids in input_ids]
+
+        kwargs = dict(self.generate_kwargs)
+        if on_text is not None and any(on_text):
+            kwargs['streamer'] = TokenStreamer(self.tokenizer, on_text)
+
+        # the keys/values of a batch row are padded like its prompt, only a single row's are worth keeping
+        keep_past = len(prompts) == 1 and prompts[0].sender_id is not None and CACHE_REUSE
+        if keep_past:
+            kwargs['return_dict_in_generate'] = True
+            if prompts[0].past is not None:
+                kwargs['past_key_values'] = prompts[0].past
+
+        sequences = [prompt.input_ids for prompt in prompts]
+        prompt_length = max(len(ids) for ids in sequences)
+        pad_id = self.tokenizer.pad_token_id
+
+        input_tensor = torch.tensor([[pad_id] * (prompt_length - len(ids)) + ids for ids in sequences])
+        attention_mask = torch.tensor([[0] * (prompt_length - len(ids)) + [1] * len(ids) for ids in sequences])
+
+        with torch.inference_mode():
+            output = self.model.generate(
+                input_tensor,
+                attention_mask=attention_mask,
+                pad_token_id=self.tokenizer.eos_token_id,
+                **kwargs
+            )
+
+        output_ids = output.sequences if keep_past else output
+
+        if self.history is not None:
+            for prompt, ids in zip(prompts, output_ids):
+                reply_ids = ids[prompt_length:].tolist()
+                eos = reply_ids.index(self.tokenizer.eos_token_id) if self.tokenizer.eos_token_id in reply_ids else None
+                reply_ids = reply_ids[:eos] + [self.tokenizer.eos_token_id]
+
+                past = output.past_key_values if keep_past else None
+                self.history.add_reply(prompt, reply_ids, past, cache_length(past) if past is not None else 0)
+
+        return [self.tokenizer.decode(ids[prompt_length:], skip_special_tokens=True).strip() for ids in output_ids]
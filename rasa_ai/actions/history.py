@@ -0,0 +1,164 @@
+"""
+Recent turns of every DialoGPT conversation, kept as token ids so they are never tokenized again.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, List, NamedTuple, Optional, Text
+
+DIALOGPT_HISTORY_TURNS = int(os.getenv('DIALOGPT_HISTORY_TURNS', '6'))
+DIALOGPT_HISTORY_TOKENS = int(os.getenv('DIALOGPT_HISTORY_TOKENS', '256'))
+DIALOGPT_HISTORY_SENDERS = int(os.getenv('DIALOGPT_HISTORY_SENDERS', '1024'))
+# keys/values take tens of megabytes per conversation, so they are only kept for the most recent ones
+DIALOGPT_HISTORY_CACHED = int(os.getenv('DIALOGPT_HISTORY_CACHED', '4'))
+
+
+class Conversation:
+    def __init__(self):
+        # user messages and replies, each ending with the end of sequence token
+        self.turns: List[List[int]] = []
+        # the model's keys/values for the first ``past_length`` tokens of the turns
+        self.past: Any = None
+        self.past_length = 0
+
+
+class Prompt(NamedTuple):
+    sender_id: Optional[Text]
+    turns: List[List[int]]
+    past: Any
+    past_length: int
+
+    @property
+    def input_ids(self) -> List[int]:
+        return [token for turn in self.turns for token in turn]
+
+
+def trim(turns: List[List[int]], max_turns: int, max_tokens: int) -> List[List[int]]:
+    """
+    The turns if they are within both limits. Otherwise the newest turns within half the limits, the latest one cut
+    from the left if it alone is over ``max_tokens``.
+
+    Positions are absolute, so any cut invalidates the cached keys/values; cutting to half of the limits lets the
+    next turns reuse them instead of recomputing the whole context every turn once it is full.
+    """
+    if len(turns) <= max_turns and sum(len(turn) for turn in turns) <= max_tokens:
+        return turns
+
+    kept = [turns[-1][-max_tokens:]]
+    size = len(kept[0])
+
+    for turn in reversed(turns[:-1]):
+        if len(kept) >= max(1, max_turns // 2) or size + len(turn) > max_tokens // 2:
+            break
+
+        kept.insert(0, turn)
+        size += len(turn)
+
+    return kept
+
+
+class ConversationHistory:
+    """
+    LRU cache of the conversations of up to ``max_senders`` senders.
+
+    A prompt is the sender's last turns plus the new message, at most ``max_turns`` turns and ``max_tokens`` tokens.
+    The keys/values the model computed for a conversation are kept for the ``max_cached`` most recent senders, so
+    their next reply only runs the model over the tokens added since.
+    """
+
+    def __init__(self, max_turns: int = DIALOGPT_HISTORY_TURNS, max_tokens: int = DIALOGPT_HISTORY_TOKENS,
+                 max_senders: int = DIALOGPT_HISTORY_SENDERS, max_cached: int = DIALOGPT_HISTORY_CACHED):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_senders = max_senders
+        self.max_cached = max_cached
+
+        self._conversations: 'OrderedDict[Text, Conversation]' = OrderedDict()
+        self._cached: 'OrderedDict[Text, None]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def has_turns(self, sender_id: Text) -> bool:
+        conversation = self._conversations.get(sender_id)
+        return conversation is not None and bool(conversation.turns)
+
+    def prompt(self, sender_id: Optional[Text], input_ids: List[int]) -> Prompt:
+        """
+        The prompt to reply to ``input_ids`` with. Its keys/values are handed over to the caller, who passes them
+        back with ``add_reply``.
+        """
+        if sender_id is None:
+            return Prompt(None, trim([input_ids], 1, self.max_tokens), None, 0)
+
+        with self._lock:
+            conversation = self._conversation(sender_id)
+
+            untrimmed = conversation.turns + [input_ids]
+            turns = trim(untrimmed, self.max_turns, self.max_tokens)
+            past, past_length = conversation.past, conversation.past_length
+            self._drop_past(sender_id)
+
+        # the cached keys/values only hold for the prompt if nothing was cut from its start
+        if turns is not untrimmed:
+            past, past_length = None, 0
+
+        return Prompt(sender_id, turns, past, past_length)
+
+    def add_reply(self, prompt: Prompt, reply_ids: List[int], past: Any = None, past_length: int = 0) -> None:
+        """
+        Stores the prompt's turns followed by the reply, and the keys/values for the first ``past_length`` tokens.
+        """
+        if prompt.sender_id is None:
+            return
+
+        with self._lock:
+            conversation = self._conversation(prompt.sender_id)
+            conversation.turns = prompt.turns + [reply_ids]
+
+            if past is not None and self.max_cached > 0:
+                conversation.past, conversation.past_length = past, past_length
+                self._cached[prompt.sender_id] = None
+
+                while len(self._cached) > self.max_cached:
+                    self._drop_past(next(iter(self._cached)))
+
+    def add_turns(self, sender_id: Text, turns: List[List[int]]) -> None:
+        """
+        Appends turns that were not generated, e.g. a reply from the response cache; cached keys/values stay valid.
+        """
+        with self._lock:
+            conversation = self._conversation(sender_id)
+            untrimmed = conversation.turns + turns
+            conversation.turns = trim(untrimmed, self.max_turns, self.max_tokens)
+
+            if conversation.turns is not untrimmed:
+                self._drop_past(sender_id)
+
+    def _conversation(self, sender_id: Text) -> Conversation:
+        conversation = self._conversations.get(sender_id)
+
+        if conversation is None:
+            conversation = self._conversations[sender_id] = Conversation()
+
+            while len(self._conversations) > self.max_senders:
+                evicted, _ = self._conversations.popitem(last=False)
+                self._cached.pop(evicted, None)
+        else:
+            self._conversations.move_to_end(sender_id)
+
+        return conversation
+
+    def _drop_past(self, sender_id: Text) -> None:
+        conversation = self._conversations.get(sender_id)
+
+        if conversation is not None:
+            conversation.past, conversation.past_length = None, 0
+
+        self._cached.pop(sender_id, None)
+
+
+def create_history() -> Optional[ConversationHistory]:
+    # a single turn is the latest message alone, as before conversations were kept
+    return ConversationHistory() if DIALOGPT_HISTORY_TURNS > 1 else None
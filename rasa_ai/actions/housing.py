@@ -0,0 +1,172 @@
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Text, Tuple
+
+HOUSING_SORT = os.getenv('HOUSING_SORT', 'cheapest')
+
+PAGE_SIZE = 10
+# counting stops here, so a broad search costs no more than a narrow one
+COUNT_LIMIT = 1000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHED_STATEMENTS = 64
+
+LISTING_COLUMNS = ('title', 'link', 'price', 'area', 'rooms', 'interior', 'location', 'image')
+
+# every sort order has an index whose columns after city are its sort key, so a page is read straight off the index
+# in order and the next page is a seek to the last listing's key; rooms, area and price are checked from the index
+# without visiting the table and the rowid stored in every entry breaks ties
+SORT_ORDERS: Dict[Text, Tuple[Tuple[Text, ...], bool]] = {
+    # name: (sort key, descending)
+    'cheapest': (('price', 'rooms', 'area'), False),
+    'largest': (('area', 'rooms', 'price'), True),
+    'most_rooms': (('rooms', 'area', 'price'), True),
+}
+# built with the database by scraper/schema.py, the action server never writes to it
+SORT_INDEXES = {
+    'cheapest': 'ix_housing_search',
+    'largest': 'ix_housing_area',
+    'most_rooms': 'ix_housing_rooms',
+}
+
+# conditions after city, in the order of the HousingQuery fields
+SEARCH_BOUNDS = (('price', '>='), ('price', '<='), ('rooms', '>='), ('area', '>='))
+
+
+def search_filter(unindexed: Set[Tuple[Text, Text]] = frozenset()) -> Text:
+    """
+    The search conditions; a unary plus keeps the planner from using the ``unindexed`` bounds as an index range.
+    """
+    bounds = [f'{"+" if (column, op) in unindexed else ""}{column} {op} ?' for column, op in SEARCH_BOUNDS]
+    return ' AND '.join(['city = ?'] + bounds)
+
+
+SEARCH_FILTER = search_filter()
+COUNT_QUERY = f'SELECT COUNT(*) FROM (SELECT 1 FROM housing WHERE {SEARCH_FILTER} LIMIT {COUNT_LIMIT})'
+SELECT_LISTINGS = f'SELECT {", ".join(LISTING_COLUMNS)}, rowid AS id FROM housing'
+
+
+def page_query(sort: Text, seek: bool) -> Text:
+    """
+    The first page of a sort order, or with ``seek`` the page after a keyset of the sort key values and rowid.
+    """
+    key, descending = SORT_ORDERS[sort]
+    columns = key + ('rowid',)
+    direction = ' DESC' if descending else ''
+
+    unindexed = set()
+    if key[0] != 'price':
+        # the price range of ix_housing_search would have to sort every match to return e.g. the largest ones
+        unindexed.update((('price', '>='), ('price', '<=')))
+    if seek:
+        # the keyset, not the form's bound on the same column, is where the range starts
+        unindexed.add((key[0], '<=' if descending else '>='))
+
+    where = search_filter(unindexed)
+    if seek:
+        where += f' AND ({", ".join(columns)}) {"<" if descending else ">"} ({", ".join("?" * len(columns))})'
+
+    order = ', '.join(column + direction for column in columns)
+
+    return f'{SELECT_LISTINGS} WHERE {where} ORDER BY {order} LIMIT ?'
+
+
+# (first page, next page) per sort order
+PAGE_QUERIES = {sort: (page_query(sort, False), page_query(sort, True)) for sort in SORT_ORDERS}
+
+logger = logging.getLogger(__name__)
+
+
+class HousingQuery(NamedTuple):
+    city: Optional[Text]
+    min_price: Any
+    max_price: Any
+    min_rooms: Any
+    min_area: Any
+
+    def numeric(self) -> 'HousingQuery':
+        """
+        The bounds as numbers; slot values can arrive as strings, which a bound with its index disabled by a unary
+        plus would compare as text.
+        """
+        return self._replace(**{field: None if value is None else float(value)
+                                for field, value in self._asdict().items() if field != 'city'})
+
+
+class SearchResult(NamedTuple):
+    # number of matches, at most COUNT_LIMIT; only counted for the first page
+    total: Optional[int]
+    listings: List[Any]
+    # keyset to pass as ``after`` for the next page, None on the last one
+    after: Optional[List[Any]] = None
+
+
+def connect_readonly(path: Text, check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Opens a read-only connection that reads the database through a memory map.
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, cached_statements=CACHED_STATEMENTS,
+                           check_same_thread=check_same_thread)
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute('PRAGMA query_only=1')
+
+    return conn
+
+
+class HousingStore:
+    """
+    Listing search over the ``housing`` table.
+
+    Only the number of matches (up to ``COUNT_LIMIT``) and one page of listings are read, both from the sort order's
+    index. Following pages seek past the ``after`` keyset of the previous one instead of skipping rows with OFFSET,
+    so the last page of a broad search is as cheap as the first.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.conn.row_factory = sqlite3.Row
+
+    @classmethod
+    def open(cls, path: Text, check_same_thread: bool = True) -> 'HousingStore':
+        return cls(connect_readonly(path, check_same_thread=check_same_thread))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def check(self) -> bool:
+        self.conn.execute('SELECT 1 FROM housing LIMIT 1').fetchall()
+        return True
+
+    def search(self, query: HousingQuery, sort: Text = HOUSING_SORT, after: Optional[Sequence[Any]] = None,
+               limit: int = PAGE_SIZE) -> SearchResult:
+        params = tuple(query.numeric())
+        first, following = PAGE_QUERIES[sort]
+
+        cur = self.conn.cursor()
+
+        try:
+            total = None
+            if after is None:
+                cur.execute(COUNT_QUERY, params)
+                total = cur.fetchone()[0]
+
+                if not total:
+                    return SearchResult(total, [])
+
+            # one listing more than the page tells whether there is a next one
+            if after is None:
+                cur.execute(first, params + (limit + 1,))
+            else:
+                cur.execute(following, params + tuple(after) + (limit + 1,))
+            listings = cur.fetchall()
+        finally:
+            cur.close()
+
+        if len(listings) <= limit:
+            return SearchResult(total, listings)
+
+        listings = listings[:limit]
+        key, _ = SORT_ORDERS[sort]
+        last = listings[-1]
+
+        return SearchResult(total, listings, [last[column] for column in key] + [last['id']])
@@ -0,0 +1,85 @@
+"""
+Thread pool for housing searches, so a query never blocks the event loop the other actions run on.
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Text
+
+from .housing import HousingStore, SearchResult
+
+# /app/actions/data/housing.db in the actions container
+HOUSING_DB_PATH = os.getenv('HOUSING_DB_PATH', os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data',
+                                                            'housing.db'))
+HOUSING_DB_THREADS = int(os.getenv('HOUSING_DB_THREADS', '4'))
+HOUSING_HEALTH_TIMEOUT = float(os.getenv('HOUSING_HEALTH_TIMEOUT', '2'))
+
+logger = logging.getLogger(__name__)
+
+
+class HousingPool:
+    """
+    Runs searches on ``threads`` worker threads, each with its own store from ``open_store``.
+
+    With ``open`` every thread reads ``housing.db`` through its own read-only connection, so searches run in parallel
+    instead of queueing on one shared connection.
+    """
+
+    def __init__(self, open_store: Callable[[], Any], threads: int = HOUSING_DB_THREADS):
+        self.open_store = open_store
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='housing')
+
+        self._local = threading.local()
+        self._stores: List[Any] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: Text = HOUSING_DB_PATH, threads: int = HOUSING_DB_THREADS) -> 'HousingPool':
+        # connections are used on their own thread only, but closed from whichever thread closes the pool
+        return cls(lambda: HousingStore.open(path, check_same_thread=False), threads)
+
+    def store(self) -> Any:
+        """
+        The store of the calling worker thread, opened on first use.
+        """
+        store = getattr(self._local, 'store', None)
+
+        if store is None:
+            store = self._local.store = self.open_store()
+
+            with self._lock:
+                self._stores.append(store)
+
+        return store
+
+    async def search(self, *args: Any, **kwargs: Any) -> SearchResult:
+        """
+        ``search`` of the stores, see ``HousingStore.search``.
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(self._search, *args, **kwargs)
+        )
+
+    def _search(self, *args: Any, **kwargs: Any) -> SearchResult:
+        return self.store().search(*args, **kwargs)
+
+    def healthy(self, timeout: float = HOUSING_HEALTH_TIMEOUT) -> bool:
+        """
+        Whether a worker thread can read the listings within ``timeout`` seconds; used as a readiness check.
+        """
+        try:
+            return bool(self.executor.submit(lambda: self.store().check()).result(timeout))
+        except Exception as e:
+            logger.warning(f'Housing health check failed: {e!r}')
+            return False
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+        with self._lock:
+            for store in self._stores:
+                store.close()
+            self._stores.clear()
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+
+DIALOGPT_BATCH_SIZE = int(os.getenv('DIALOGPT_BATCH_SIZE', '8'))
+DIALOGPT_BATCH_WINDOW = float(os.getenv('DIALOGPT_BATCH_WINDOW', '0.05'))
+DIALOGPT_QUEUE_SIZE = int(os.getenv('DIALOGPT_QUEUE_SIZE', '32'))
+DIALOGPT_TIMEOUT = float(os.getenv('DIALOGPT_TIMEOUT', '30'))
+# a failed load is retried after DIALOGPT_LOAD_BACKOFF seconds, doubling with every further attempt
+DIALOGPT_LOAD_RETRIES = int(os.getenv('DIALOGPT_LOAD_RETRIES', '3'))
+DIALOGPT_LOAD_BACKOFF = float(os.getenv('DIALOGPT_LOAD_BACKOFF', '5'))
+
+logger = logging.getLogger(__name__)
+
+# text, future, deadline, stream callback and sender of a queued request
+Request = Tuple[Text, asyncio.Future, float, Optional[Callable], Optional[Text]]
+
+
+class GenerationRejected(Exception):
+    """Raised when the generation queue is full and a request is shed."""
+
+
+class GenerationTimeout(Exception):
+    """Raised when a reply is not generated within the timeout."""
+
+
+class ModelLoadError(Exception):
+    """Raised when the model could not be loaded."""
+
+
+class ModelLoader:
+    """
+    Loads a model on a background thread, so the action server accepts requests while the weights are read.
+
+    A failed load, e.g. a download that timed out, is retried up to ``retries`` times with exponential backoff;
+    after that the loader is ``failed`` and ``error`` holds the last exception.
+    """
+
+    def __init__(self, load_fn: Callable[[], Any], name: Text = 'model', retries: int = DIALOGPT_LOAD_RETRIES,
+                 backoff: float = DIALOGPT_LOAD_BACKOFF):
+        self.load_fn = load_fn
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.load_seconds: Optional[float] = None
+
+        self._loaded = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'{name}-loader', daemon=True)
+
+    def start(self) -> 'ModelLoader':
+        self._thread.start()
+        return self
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded.is_set() and self.error is None
+
+    @property
+    def failed(self) -> bool:
+        return self._loaded.is_set() and self.error is not None
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Blocks until the model is loaded and returns it.
+        """
+        if not self._loaded.wait(timeout):
+            raise ModelLoadError(f'{self.name} is still loading')
+
+        if self.error is not None:
+            raise ModelLoadError(f'{self.name} failed to load: {self.error!r}') from self.error
+
+        return self.value
+
+    def _run(self) -> None:
+        start = time.perf_counter()
+
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.value = self.load_fn()
+                except Exception as e:
+                    self.error = e
+
+                    if attempt == self.retries:
+                        logger.exception(f'Loading {self.name} failed, giving up after {attempt + 1} attempts')
+                        return
+
+                    delay = self.backoff * 2 ** attempt
+                    logger.exception(f'Loading {self.name} failed, retrying in {delay:.0f}s')
+                    time.sleep(delay)
+                else:
+                    self.error = None
+                    self.load_seconds = time.perf_counter() - start
+                    logger.info(f'Loaded {self.name} in {self.load_seconds:.1f}s')
+                    return
+        finally:
+            self._loaded.set()
+
+
+class GenerationWorker:
+    """
+    Inference thread with a bounded request queue.
+
+    Requests arriving within ``batch_window`` seconds of each other are generated together (up to
+    ``max_batch_size``), callers await the result on their event loop, and requests beyond ``max_queue_size``
+    are rejected instead of queueing up behind a slow model. Batches with streaming requests are passed their
+    callbacks as ``batch_fn(texts, on_text=callbacks)``, batches with requests of known senders their
+    ``sender_ids``.
+    """
+
+    def __init__(self, batch_fn: Callable[..., List[Text]], max_batch_size: int = DIALOGPT_BATCH_SIZE,
+                 batch_window: float = DIALOGPT_BATCH_WINDOW, max_queue_size: int = DIALOGPT_QUEUE_SIZE,
+                 timeout: float = DIALOGPT_TIMEOUT):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+
+        self.batch_sizes: List[int] = []
+
+        self._queue: 'queue.Queue[Request]' = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name='dialogpt-worker', daemon=True)
+        self._thread.start()
+
+    async def generate(self, text: Text, on_text: Optional[Callable[[Text], None]] = None,
+                       sender_id: Optional[Text] = None) -> Text:
+        """
+        Generates a reply to ``text``. ``on_text`` is called on the caller's event loop with each newly generated
+        piece of the reply, ``sender_id`` lets the reply continue the sender's conversation.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        stream = None
+        if on_text is not None:
+            def stream(delta: Text) -> None:
+                loop.call_soon_threadsafe(_stream_to, future, on_text, delta)
+
+        try:
+            self._queue.put_nowait((text, future, time.monotonic() + self.timeout, stream, sender_id))
+        except queue.Full:
+            raise GenerationRejected(f'{self._queue.maxsize} generation requests already queued')
+
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise GenerationTimeout(f'No reply generated within {self.timeout}s')
+
+    def _next_batch(self) -> List[Request]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # requests whose caller already gave up are not worth generating
+        now = time.monotonic()
+        return [item for item in batch if item[2] > now and not item[1].done()]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            self.batch_sizes.append(len(batch))
+            texts = [text for text, _, _, _, _ in batch]
+            callbacks = [stream for _, _, _, stream, _ in batch]
+            sender_ids = [sender_id for _, _, _, _, sender_id in batch]
+
+            kwargs: Dict[Text, Any] = {}
+            if any(callbacks):
+                kwargs['on_text'] = callbacks
+            if any(sender_id is not None for sender_id in sender_ids):
+                kwargs['sender_ids'] = sender_ids
+
+            try:
+                replies = self.batch_fn(texts, **kwargs)
+            except Exception as e:
+                logger.exception('DialoGPT generation failed')
+                for _, future, _, _, _ in batch:
+                    future.get_loop().call_soon_threadsafe(_set_exception, future, e)
+                continue
+
+            for (_, future, _, _, _), reply in zip(batch, replies):
+                future.get_loop().call_soon_threadsafe(_set_result, future, reply)
+
+
+def _stream_to(future: asyncio.Future, on_text: Callable[[Text], None], delta: Text) -> None:
+    # a caller that timed out has already answered, the rest of its reply goes nowhere
+    if not future.done():
+        on_text(delta)
+
+
+def _set_result(future: asyncio.Future, result: Any) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exception: BaseException) -> None:
+    if not future.done():
+        future.set_exception(exception)
@@ -0,0 +1,160 @@
+"""
+Cache of DialoGPT replies for recurring small talk.
+
+Pools can be pre-generated offline for the most frequent inputs:
+
+    python -m actions.response_cache --inputs smalltalk.txt --output /app/actions/data/responses.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Text
+
+DIALOGPT_CACHE_SIZE = int(os.getenv('DIALOGPT_CACHE_SIZE', '0'))
+DIALOGPT_CACHE_POOL = int(os.getenv('DIALOGPT_CACHE_POOL', '5'))
+DIALOGPT_CACHE_PATH = os.getenv('DIALOGPT_CACHE_PATH')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: Text) -> Text:
+    """
+    "Hi!!", "hi" and " HI " are the same input as far as DialoGPT's reply is concerned.
+    """
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+
+class ResponseCache:
+    """
+    LRU cache holding a pool of up to ``pool_size`` sampled replies per normalized input.
+
+    An input is served from the cache once its pool is full, with a reply picked at random so answers keep varying;
+    until then every generated reply is added to the pool. Pools loaded from a file are served as they are.
+    """
+
+    def __init__(self, maxsize: int = 1024, pool_size: int = DIALOGPT_CACHE_POOL,
+                 rng: Optional[random.Random] = None):
+        self.maxsize = maxsize
+        self.pool_size = pool_size
+        self.rng = rng if rng is not None else random.Random()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._pools: 'OrderedDict[Text, List[Text]]' = OrderedDict()
+        self._preloaded: Set[Text] = set()
+
+    def __len__(self) -> int:
+        return len(self._pools)
+
+    def get(self, text: Text) -> Optional[Text]:
+        key = normalize(text)
+        pool = self._pools.get(key)
+
+        if pool is None or (len(pool) < self.pool_size and key not in self._preloaded):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._pools.move_to_end(key)
+
+        return self.rng.choice(pool)
+
+    def add(self, text: Text, reply: Text) -> None:
+        key = normalize(text)
+        pool = self._pools.setdefault(key, [])
+
+        if reply and reply not in pool and len(pool) < self.pool_size:
+            pool.append(reply)
+
+        self._pools.move_to_end(key)
+
+        while len(self._pools) > self.maxsize:
+            evicted, _ = self._pools.popitem(last=False)
+            self._preloaded.discard(evicted)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def load(self, path: Text) -> None:
+        """
+        Adds the pools of a file written by ``save``; the file lists the most frequent inputs first.
+        """
+        with open(path) as f:
+            pools: Dict[Text, List[Text]] = json.load(f)
+
+        # inserted least frequent first, so the most frequent inputs are the last to be evicted
+        for text, replies in reversed(list(pools.items())):
+            for reply in replies:
+                self.add(text, reply)
+
+            if normalize(text) in self._pools:
+                self._preloaded.add(normalize(text))
+
+    def save(self, path: Text) -> None:
+        with open(path, 'w') as f:
+            json.dump(OrderedDict(reversed(self._pools.items())), f, indent=2, ensure_ascii=False)
+
+
+def create_response_cache(maxsize: int = DIALOGPT_CACHE_SIZE,
+                          path: Optional[Text] = DIALOGPT_CACHE_PATH) -> Optional[ResponseCache]:
+    """
+    Returns the configured cache, or ``None`` when caching is turned off.
+    """
+    if maxsize <= 0:
+        return None
+
+    cache = ResponseCache(maxsize)
+
+    if path and os.path.exists(path):
+        cache.load(path)
+        logger.info(f'Loaded {len(cache)} pre-generated reply pools from {path}')
+
+    return cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-generate DialoGPT reply pools for frequent inputs')
+    parser.add_argument('--inputs', required=True, help='text file with one input per line, most frequent first')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--model', default='/app/models/dialogpt-ir-bot')
+    parser.add_argument('--top', type=int, default=200, help='number of inputs to pre-generate')
+    parser.add_argument('--pool-size', type=int, default=DIALOGPT_CACHE_POOL)
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from .dialogpt import DialoGPTBatchGenerator, load_dialogpt
+
+    with open(args.inputs) as f:
+        inputs = list(OrderedDict.fromkeys(normalize(line) for line in f if normalize(line)))[:args.top]
+
+    generator = DialoGPTBatchGenerator(*load_dialogpt(args.model))
+    pools: Dict[Text, List[Text]] = OrderedDict((text, []) for text in inputs)
+
+    # duplicate samples leave a pool short, those inputs are sampled again
+    for _ in range(3):
+        pending = [text for text, pool in pools.items() for _ in range(args.pool_size - len(pool))]
+
+        for start in range(0, len(pending), args.batch_size):
+            batch = pending[start:start + args.batch_size]
+
+            for text, reply in zip(batch, generator(batch)):
+                if reply and reply not in pools[text] and len(pools[text]) < args.pool_size:
+                    pools[text].append(reply)
+
+    with open(args.output, 'w') as f:
+        json.dump(pools, f, indent=2, ensure_ascii=False)
+
+    logger.info(f'Wrote reply pools for {len(pools)} inputs to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
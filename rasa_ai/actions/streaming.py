@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import Optional, Text
+
+import httpx
+
+# stream route of the socket.io connector, e.g. http://rasa:5005/webhooks/custom_socketio/stream
+DIALOGPT_STREAM_URL = os.getenv('DIALOGPT_STREAM_URL')
+# shared with the connector's stream_token, nothing is streamed without it
+DIALOGPT_STREAM_TOKEN = os.getenv('DIALOGPT_STREAM_TOKEN')
+DIALOGPT_STREAM_CHANNELS = ('custom_socketio',)
+
+logger = logging.getLogger(__name__)
+
+
+class ReplyStream:
+    """
+    Pushes a reply to the connector while it is generated, as partial messages sharing one ``message_id``.
+
+    Text arriving while a push is in flight is sent together with the next one, so a slow connector gets fewer,
+    larger pieces instead of a backlog of single tokens. Streaming is best effort: after a failed push the rest of
+    the reply only arrives with the final message. Once closed, pushes are ignored, so no piece follows the final
+    message.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: Text, session_id: Text, message_id: Optional[Text] = None,
+                 token: Optional[Text] = DIALOGPT_STREAM_TOKEN):
+        self.client = client
+        self.url = url
+        self.headers = {'Authorization': f'Bearer {token}'} if token else {}
+        self.session_id = session_id
+        self.message_id = message_id or uuid.uuid4().hex
+
+        self.pushed = 0
+        self._buffer = []
+        self._flushing: Optional[asyncio.Future] = None
+        self._failed = False
+        self._closed = False
+
+    def push(self, text: Text) -> None:
+        if self._failed or self._closed:
+            return
+
+        self._buffer.append(text)
+
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self._flush())
+
+    async def _flush(self) -> None:
+        while self._buffer and not self._failed:
+            text = ''.join(self._buffer)
+            self._buffer = []
+
+            try:
+                response = await self.client.post(self.url, headers=self.headers, json={
+                    'session_id': self.session_id, 'message_id': self.message_id, 'text': text,
+                })
+                response.raise_for_status()
+                self.pushed += 1
+            except httpx.HTTPError as e:
+                logger.warning(f'Streaming reply {self.message_id} failed, sending it in one piece: {e!r}')
+                self._failed = True
+
+    async def close(self) -> None:
+        """
+        Waits until all pushed text has reached the connector, so the final message cannot overtake it.
+        """
+        self._closed = True
+
+        if self._flushing is not None:
+            await self._flushing
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Text, Tuple
+
+ACTIONS_METRICS_PORT = os.getenv('ACTIONS_METRICS_PORT')
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger(__name__)
+
+
+class StageHistogram:
+    """
+    Prometheus-style histogram of action stage latencies, labelled by stage.
+    """
+
+    def __init__(self, name: Text, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self.values: Dict[Text, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage: Text, value: float) -> None:
+        with self.lock:
+            values = self.values.setdefault(stage, [0] * (len(self.buckets) + 2))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+
+            values[-2] += value
+            values[-1] += 1
+
+    def count(self, stage: Text) -> int:
+        return int(self.values.get(stage, [0])[-1])
+
+    def render(self) -> Text:
+        lines = [f'# TYPE {self.name} histogram']
+
+        for stage, values in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+
+            lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {values[-2]}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {values[-1]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+STAGE_LATENCY = StageHistogram('actions_stage_seconds')
+
+# components that load in the background report here whether they are ready
+READINESS_CHECKS: Dict[Text, Callable[[], bool]] = {}
+
+
+def register_readiness(name: Text, check: Callable[[], bool]) -> None:
+    READINESS_CHECKS[name] = check
+
+
+def readiness() -> Dict[Text, bool]:
+    return {name: bool(check()) for name, check in READINESS_CHECKS.items()}
+
+
+def get_correlation_id(tracker: Any) -> Optional[Text]:
+    """
+    Returns the correlation id the orchestrator attached to the latest user message, if any.
+    """
+    events = getattr(tracker, 'events', None)
+
+    if not isinstance(events, list):
+        return None
+
+    for event in reversed(events):
+        if event.get('event') == 'user':
+            return (event.get('metadata') or {}).get('correlation_id')
+
+    return None
+
+
+@contextmanager
+def span(stage: Text, correlation_id: Optional[Text] = None) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_LATENCY.observe(stage, duration)
+        logger.debug(f'Turn {correlation_id}: {stage}={duration * 1000:.1f}ms')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.respond(200, 'text/plain; version=0.0.4', STAGE_LATENCY.render().encode())
+        elif self.path == '/ready':
+            components = readiness()
+            self.respond(200 if all(components.values()) else 503, 'application/json',
+                         json.dumps(components).encode())
+        else:
+            self.send_error(404)
+
+    def respond(self, status: int, content_type: Text, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """
+    Serves ``/metrics`` and ``/ready`` next to the action server, which offers no way to add routes of its own.
+    """
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Serving action metrics on port {port}')
+
+    return server
@@ -1,4 +1,8 @@
+import hmac
+import inspect
 import logging
+import os
+import time
 import uuid
 from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Text
 
@@ -14,8 +18,21 @@ from sanic.request import Request
 from sanic.response import HTTPResponse
 from socketio import AsyncServer
 
+from actions.tracing import StageHistogram
+
+from .pubsub import create_client_manager
+
 logger = logging.getLogger(__name__)
 
+# the same histogram as the action server's stages
+STAGE_LATENCY = StageHistogram("rasa_stage_seconds")
+
+
+async def _maybe_await(result: Any) -> None:
+    # room helpers are coroutines only in newer python-socketio releases
+    if inspect.isawaitable(result):
+        await result
+
 
 class SocketBlueprint(Blueprint):
     def __init__(
@@ -35,15 +52,63 @@ class SocketIOOutput(OutputChannel):
     def name(cls) -> Text:
         return "custom_socketio"
 
-    def __init__(self, sio: AsyncServer, bot_message_evt: Text) -> None:
+    def __init__(
+        self,
+        sio: AsyncServer,
+        bot_message_evt: Text,
+        session_id_in_payload: bool = False,
+        batch_message_evt: Optional[Text] = None,
+    ) -> None:
         self.sio = sio
         self.bot_message_evt = bot_message_evt
+        self.session_id_in_payload = session_id_in_payload
+        self.batch_message_evt = batch_message_evt
+
+        # messages of the current turn per recipient, sent by ``flush`` in batched mode
+        self.pending: Dict[Text, List[Dict[Text, Any]]] = {}
 
     async def _send_message(self, socket_id: Text, response: Any) -> None:
         """Sends a message to the recipient using the bot event."""
 
+        if self.batch_message_evt is not None:
+            self.pending.setdefault(socket_id, []).append(response)
+            return
+
+        if self.session_id_in_payload:
+            # lets a client that multiplexes many sessions route the message
+            response = {**response, "session_id": socket_id}
+
         await self.sio.emit(self.bot_message_evt, response, room=socket_id)
 
+    async def flush(self) -> None:
+        """Sends the messages collected in batched mode, one batch event per
+        recipient holding all of them in order."""
+
+        pending, self.pending = self.pending, {}
+
+        for socket_id, messages in pending.items():
+            batch: Dict[Text, Any] = {"messages": messages}
+
+            if self.session_id_in_payload:
+                batch["session_id"] = socket_id
+
+            await self.sio.emit(self.batch_message_evt, batch, room=socket_id)
+
+    async def send_partial_message(
+        self, recipient_id: Text, message_id: Text, text: Text
+    ) -> None:
+        """Sends the next piece of a reply that is still being generated.
+
+        The complete reply follows as a message with the same ``message_id``
+        and ``final`` set. Pieces are never batched, they are only worth
+        sending right away."""
+
+        message = {"text": text, "message_id": message_id, "partial": True}
+        if self.session_id_in_payload:
+            message["session_id"] = recipient_id
+
+        await self.sio.emit(self.bot_message_evt, message, room=recipient_id)
+
     async def send_text_message(
         self, recipient_id: Text, text: Text, **kwargs: Any
     ) -> None:
@@ -109,7 +174,7 @@ class SocketIOOutput(OutputChannel):
         """Sends custom json to the output"""
 
         # FIXES BUG
-        await self.sio.emit(self.bot_message_evt, json_message, room=recipient_id)
+        await self._send_message(recipient_id, json_message)
 
     async def send_attachment(
         self, recipient_id: Text, attachment: Dict[Text, Any], **kwargs: Any
@@ -136,6 +201,11 @@ class SocketIOInput(InputChannel):
             credentials.get("socketio_path", "/socket.io"),
             credentials.get("jwt_key"),
             credentials.get("jwt_method", "HS256"),
+            credentials.get("session_id_in_payload", False),
+            credentials.get("batch_messages", False),
+            credentials.get("batch_message_evt", "bot_uttered_batch"),
+            credentials.get("client_manager"),
+            credentials.get("stream_token", os.environ.get("DIALOGPT_STREAM_TOKEN")),
         )
 
     def __init__(
@@ -147,13 +217,35 @@ class SocketIOInput(InputChannel):
         socketio_path: Optional[Text] = "/socket.io",
         jwt_key: Optional[Text] = None,
         jwt_method: Optional[Text] = "HS256",
+        session_id_in_payload: bool = False,
+        batch_messages: bool = False,
+        batch_message_evt: Text = "bot_uttered_batch",
+        client_manager: Optional[Dict[Text, Any]] = None,
+        stream_token: Optional[Text] = None,
     ):
-        """Creates a ``SocketIOInput`` object."""
+        """Creates a ``SocketIOInput`` object.
+
+        With ``batch_messages`` all bot messages answering one user message
+        are sent as a single ``batch_message_evt`` event once it is handled.
+
+        ``client_manager`` configures a pub/sub backend shared by all Sanic
+        workers and Rasa instances, see ``create_client_manager``. Messages
+        emitted by any of them then reach the user's socket wherever it is
+        connected.
+
+        ``stream_token`` is the secret the action server sends as a bearer
+        token with the partial replies it posts to ``/stream``; the route is
+        only served when it is set."""
         self.bot_message_evt = bot_message_evt
+        self.batch_messages = batch_messages
+        self.batch_message_evt = batch_message_evt
         self.session_persistence = session_persistence
+        self.session_id_in_payload = session_id_in_payload
         self.user_message_evt = user_message_evt
         self.namespace = namespace
         self.socketio_path = socketio_path
+        self.client_manager = client_manager
+        self.stream_token = stream_token
         self.sio = None
 
         self.jwt_key = jwt_key
@@ -161,6 +253,15 @@ class SocketIOInput(InputChannel):
 
     def get_output_channel(self) -> Optional["OutputChannel"]:
         """Creates socket.io output channel object."""
+        if self.sio is None and self.client_manager:
+            # a process without the sockets emits through the shared backend
+            self.sio = AsyncServer(
+                async_mode="sanic",
+                client_manager=create_client_manager(
+                    self.client_manager, write_only=True
+                ),
+            )
+
         if self.sio is None:
             rasa.shared.utils.io.raise_warning(
                 "SocketIO output channel cannot be recreated. "
@@ -170,14 +271,20 @@ class SocketIOInput(InputChannel):
                 "scenarios."
             )
             return
-        return SocketIOOutput(self.sio, self.bot_message_evt)
+        return SocketIOOutput(
+            self.sio, self.bot_message_evt, self.session_id_in_payload
+        )
 
     def blueprint(
         self, on_new_message: Callable[[UserMessage], Awaitable[Any]]
     ) -> Blueprint:
         # Workaround so that socketio works with requests from other origins.
         # https://github.com/miguelgrinberg/python-socketio/issues/205#issuecomment-493769183
-        sio = AsyncServer(async_mode="sanic", cors_allowed_origins=[])
+        sio = AsyncServer(
+            async_mode="sanic",
+            cors_allowed_origins=[],
+            client_manager=create_client_manager(self.client_manager),
+        )
         socketio_webhook = SocketBlueprint(
             sio, self.socketio_path, "socketio_webhook", __name__
         )
@@ -189,6 +296,37 @@ class SocketIOInput(InputChannel):
         async def health(_: Request) -> HTTPResponse:
             return response.json({"status": "ok"})
 
+        @socketio_webhook.route("/metrics", methods=["GET"])
+        async def metrics(_: Request) -> HTTPResponse:
+            return response.text(STAGE_LATENCY.render())
+
+        async def stream(request: Request) -> HTTPResponse:
+            # the action server pushes replies here while it generates them
+            authorization = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(
+                authorization.encode(), f"Bearer {self.stream_token}".encode()
+            ):
+                return response.json({"error": "unauthorized"}, status=401)
+
+            data = request.json or {}
+            if not data.get("session_id") or not data.get("message_id"):
+                return response.json(
+                    {"error": "session_id and message_id are required"}, status=400
+                )
+
+            output_channel = SocketIOOutput(
+                sio, self.bot_message_evt, self.session_id_in_payload
+            )
+            await output_channel.send_partial_message(
+                data["session_id"], data["message_id"], data.get("text", "")
+            )
+
+            return response.json({"status": "ok"})
+
+        if self.stream_token:
+            # anyone reaching Rasa's port could otherwise post messages into any session
+            socketio_webhook.add_route(stream, "/stream", methods=["POST"])
+
         @sio.on("connect", namespace=self.namespace)
         async def connect(
             sid: Text, environ: Dict, auth: Optional[Dict]
@@ -218,13 +356,26 @@ class SocketIOInput(InputChannel):
             if "session_id" not in data or data["session_id"] is None:
                 data["session_id"] = uuid.uuid4().hex
             if self.session_persistence:
-                sio.enter_room(sid, data["session_id"])
+                await _maybe_await(sio.enter_room(sid, data["session_id"]))
             await sio.emit("session_confirm", data["session_id"], room=sid)
             logger.debug(f"User {sid} connected to socketIO endpoint.")
 
+        @sio.on("session_end", namespace=self.namespace)
+        async def session_end(sid: Text, data: Optional[Dict]) -> None:
+            # a multiplexing client leaves the room of a finished session so
+            # rooms do not pile up on its long-lived socket
+            if self.session_persistence and data and data.get("session_id"):
+                await _maybe_await(sio.leave_room(sid, data["session_id"]))
+            logger.debug(f"Session ended on socket {sid}.")
+
         @sio.on(self.user_message_evt, namespace=self.namespace)
         async def handle_message(sid: Text, data: Dict) -> None:
-            output_channel = SocketIOOutput(sio, self.bot_message_evt)
+            output_channel = SocketIOOutput(
+                sio,
+                self.bot_message_evt,
+                self.session_id_in_payload,
+                self.batch_message_evt if self.batch_messages else None,
+            )
 
             if self.session_persistence:
                 if not data.get("session_id"):
@@ -240,9 +391,30 @@ class SocketIOInput(InputChannel):
             else:
                 sender_id = sid
 
+            # the orchestrator's correlation id is passed on to the actions as metadata
+            correlation_id = data.get("correlation_id")
+            metadata = {"correlation_id": correlation_id} if correlation_id else None
+
             message = UserMessage(
-                data["message"], output_channel, sender_id, input_channel=self.name()
+                data["message"],
+                output_channel,
+                sender_id,
+                input_channel=self.name(),
+                metadata=metadata,
             )
-            await on_new_message(message)
+
+            start = time.perf_counter()
+            try:
+                await on_new_message(message)
+            finally:
+                # failed messages are timed as well
+                duration = time.perf_counter() - start
+                STAGE_LATENCY.observe("handle_message", duration)
+                logger.debug(
+                    f"Handled message {correlation_id} of {sender_id} in {duration * 1000:.1f}ms"
+                )
+
+                # whatever was uttered before a failure still reaches the user
+                await output_channel.flush()
 
         return socketio_webhook
@@ -0,0 +1,93 @@
+import asyncio
+import importlib
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Text, Type
+
+import socketio
+
+try:
+    from socketio.async_pubsub_manager import AsyncPubSubManager
+except ImportError:
+    from socketio.asyncio_pubsub_manager import AsyncPubSubManager
+
+
+class LocalPubSubManager(AsyncPubSubManager):
+    """Pub/sub client manager over in-process queues.
+
+    Servers of one process that use the same channel reach each other's
+    clients, which stands in for Redis or RabbitMQ in tests and on a single
+    worker. Messages are JSON encoded like on a real backend."""
+
+    name = "localpubsub"
+
+    # listening managers per channel
+    channels: Dict[Text, List["LocalPubSubManager"]] = {}
+
+    def __init__(
+        self,
+        channel: Text = "socketio",
+        write_only: bool = False,
+        logger: Any = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.queue: Optional[asyncio.Queue] = None
+
+    def initialize(self) -> None:
+        if not self.write_only:
+            # created here rather than in __init__, on the loop the server runs on
+            self.queue = asyncio.Queue()
+            self.channels.setdefault(self.channel, []).append(self)
+
+        super().initialize()
+
+    async def _publish(self, data: Dict[Text, Any]) -> None:
+        message = json.dumps(data)
+
+        for manager in self.channels.get(self.channel, []):
+            manager.queue.put_nowait(message)
+
+    async def _listen(self) -> AsyncIterator[Text]:
+        while True:
+            yield await self.queue.get()
+
+    def close(self) -> None:
+        """Stops receiving the channel's messages."""
+        listeners = self.channels.get(self.channel, [])
+        if self in listeners:
+            listeners.remove(self)
+
+
+# client managers by the ``type`` of the ``client_manager`` credentials, any other
+# type is the dotted path of an ``AsyncManager`` subclass
+CLIENT_MANAGERS: Dict[Text, Type[socketio.AsyncManager]] = {
+    "redis": socketio.AsyncRedisManager,
+    "amqp": socketio.AsyncAioPikaManager,
+    "local": LocalPubSubManager,
+}
+
+
+def client_manager_class(manager_type: Text) -> Type[socketio.AsyncManager]:
+    if manager_type in CLIENT_MANAGERS:
+        return CLIENT_MANAGERS[manager_type]
+
+    module_name, _, class_name = manager_type.rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_client_manager(
+    options: Optional[Dict[Text, Any]], write_only: bool = False
+) -> Optional[socketio.AsyncManager]:
+    """Creates the client manager configured by ``options``, e.g.
+    ``{"type": "redis", "url": "redis://redis:6379/0"}``; the other options are
+    passed to the manager. ``None`` without options, the server then keeps its
+    clients to itself.
+
+    A ``write_only`` manager only emits, for processes without the clients."""
+    if not options:
+        return None
+
+    options = dict(options)
+    manager_class = client_manager_class(options.pop("type", "redis"))
+
+    return manager_class(write_only=write_only, **options)
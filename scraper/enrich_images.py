@@ -0,0 +1,128 @@
+"""
+Batch stage that resolves the cover image of every listing once, at ingest time, and stores it
+in the ``image`` column of the ``housing`` table so the orchestrator does not scrape at request time. Like the
+scraper, it then publishes the database and its parquet export to the action server.
+
+Usage, from the repository root:
+    python -m scraper.enrich_images [--db scraper/housing.db] [--live rasa_ai/actions/data/housing.db] [--no-publish]
+                                    [--parquet scraper/dutch_housing.parquet] [--workers 4] [--refresh]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Iterable, List, Optional, Tuple
+
+import requests
+from tqdm import tqdm
+
+from scraper.scrape import LIVE_DB_PATH, LIVE_PARQUET_PATH, export_parquet, publish
+from server.listing_page import extract_image
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# images are committed in batches of this many listings, so an interrupted run keeps what it fetched
+STORE_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_image_column(conn: sqlite3.Connection) -> None:
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(housing)')]
+
+    if 'image' not in columns:
+        conn.execute('ALTER TABLE housing ADD COLUMN image TEXT')
+        conn.commit()
+
+
+def pending_links(conn: sqlite3.Connection, refresh: bool = False) -> List[str]:
+    query = 'SELECT DISTINCT link FROM housing' if refresh else 'SELECT DISTINCT link FROM housing WHERE image IS NULL'
+
+    return [row[0] for row in conn.execute(query)]
+
+
+def fetch_image(session: requests.Session, link: str, timeout: float = 10) -> Tuple[str, Optional[str]]:
+    try:
+        r = session.get(link, timeout=timeout)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        logger.warning(f'Failed to fetch {link}: {e!r}')
+        return link, None
+
+    return link, extract_image(r.text)
+
+
+def store_images(conn: sqlite3.Connection, images: Iterable[Tuple[str, Optional[str]]],
+                 batch_size: int = STORE_BATCH_SIZE) -> int:
+    """
+    Stores the images while they are fetched, one transaction per ``batch_size`` of them.
+    """
+    stored, rows = 0, []
+
+    for link, image in images:
+        if image is not None:
+            rows.append((image, link))
+
+        if len(rows) >= batch_size:
+            stored += _update_images(conn, rows)
+            rows = []
+
+    return stored + _update_images(conn, rows)
+
+
+def _update_images(conn: sqlite3.Connection, rows: List[Tuple[str, str]]) -> int:
+    with conn:
+        conn.executemany('UPDATE housing SET image = ? WHERE link = ?', rows)
+
+    return len(rows)
+
+
+def enrich(db_path: str, workers: int = 4, refresh: bool = False, live_path: Optional[str] = None,
+           parquet_path: Optional[str] = None, session: Optional[requests.Session] = None) -> int:
+    conn = sqlite3.connect(db_path)
+
+    try:
+        ensure_image_column(conn)
+        links = pending_links(conn, refresh=refresh)
+
+        # a session of the caller stays open for them
+        with nullcontext(session) if session is not None else requests.Session() as session:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(lambda link: fetch_image(session, link), links)
+                stored = store_images(conn, tqdm(results, total=len(links), desc='Fetching images'))
+
+        if parquet_path is not None:
+            export_parquet(conn, parquet_path)
+    finally:
+        conn.close()
+
+    if live_path is not None:
+        publish(db_path, live_path)
+
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store listing cover images in housing.db')
+    parser.add_argument('--db', default=os.path.join(BASE_PATH, 'housing.db'))
+    parser.add_argument('--live', default=LIVE_DB_PATH, help='database of the action server to publish to')
+    parser.add_argument('--no-publish', action='store_true', help='only update --db')
+    parser.add_argument('--parquet', default=None,
+                        help=f'also export the listings to this parquet file, {LIVE_PARQUET_PATH} when publishing')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--refresh', action='store_true', help='re-fetch listings that already have an image')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    parquet_path = args.parquet if args.parquet is not None or args.no_publish else LIVE_PARQUET_PATH
+
+    stored = enrich(args.db, workers=args.workers, refresh=args.refresh,
+                    live_path=None if args.no_publish else args.live, parquet_path=parquet_path)
+    logger.info(f'Stored {stored} images in {args.db}')
+
+
+if __name__ == '__main__':
+    main()
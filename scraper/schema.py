@@ -0,0 +1,87 @@
+"""
+Tables and indexes of ``housing.db``. They are built here, by the scraper, so the action server only ever reads the
+database.
+
+Usage:
+    python -m scraper.schema --db rasa_ai/actions/data/housing.db
+"""
+import argparse
+import logging
+import sqlite3
+
+LISTING_FIELDS = ('title', 'link', 'price', 'location', 'area', 'rooms', 'interior', 'city')
+
+
+PAGES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    city TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    next_url TEXT,
+    links TEXT
+)
+'''
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """
+    Creates the tables of a new database and turns a database written by the notebook into one upserts can go to:
+    duplicate links are removed, the link gets a unique index and every listing a ``last_seen`` time.
+    """
+    conn.execute(f'CREATE TABLE IF NOT EXISTS housing ({", ".join(LISTING_FIELDS)}, image TEXT, last_seen REAL)')
+    conn.execute(PAGES_SCHEMA)
+
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(housing)')]
+    for column, type_ in (('image', 'TEXT'), ('last_seen', 'REAL')):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE housing ADD COLUMN {column} {type_}')
+
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ux_housing_link'").fetchone() is None:
+        conn.execute('DELETE FROM housing WHERE rowid NOT IN (SELECT MIN(rowid) FROM housing GROUP BY link)')
+        conn.execute('CREATE UNIQUE INDEX ux_housing_link ON housing (link)')
+
+    conn.commit()
+
+
+# one index per sort order of rasa_ai/actions/housing.py, the city followed by the order's sort key, so a search page
+# is read straight off the index
+SEARCH_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS ix_housing_search ON housing (city, price, rooms, area)',
+    'CREATE INDEX IF NOT EXISTS ix_housing_area ON housing (city, area, rooms, price)',
+    'CREATE INDEX IF NOT EXISTS ix_housing_rooms ON housing (city, rooms, area, price)',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def build_indexes(conn: sqlite3.Connection) -> None:
+    """
+    Creates the search indexes and refreshes the statistics the query planner picks them by.
+    """
+    for index in SEARCH_INDEXES:
+        conn.execute(index)
+
+    conn.execute('ANALYZE')
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the search indexes of housing.db')
+    parser.add_argument('--db', required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    conn = sqlite3.connect(args.db)
+
+    try:
+        build_indexes(conn)
+    finally:
+        conn.close()
+
+    logger.info(f'Built the search indexes of {args.db}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""
+Incremental crawl of the Pararius listings into ``housing.db``, the script version of ``scrape.ipynb``.
+
+Cities and their pages are crawled one after another, with a minimum interval between requests to the same host. All
+cities are on the one host, so crawling them in parallel would only have the requests wait for each other. Every page
+is requested conditionally with the ``ETag``/``Last-Modified`` of the previous run, so an unchanged page costs a
+``304`` and no parsing. Listings are upserted by link; the listings of a city no longer on the site are
+deleted once all its pages were crawled. The database is then published to the action server's copy in one
+transaction, so searches see either the old or the new listings.
+
+Usage, from the repository root:
+    python -m scraper.scrape [--db scraper/housing.db] [--live rasa_ai/actions/data/housing.db] [--cities Delft Leiden]
+                             [--interval 15] [--parquet scraper/dutch_housing.parquet]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from tqdm import tqdm
+
+from scraper.schema import LISTING_FIELDS, build_indexes, ensure_schema
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# the copy the action server searches
+LIVE_DB_PATH = os.path.join(os.path.dirname(BASE_PATH), 'rasa_ai', 'actions', 'data', 'housing.db')
+# the listings the action server's columnar backend loads
+LIVE_PARQUET_PATH = os.path.join(os.path.dirname(LIVE_DB_PATH), 'dutch_housing.parquet')
+
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+SITE_URL = 'https://www.pararius.com'
+# listing links are stored like the notebook stored them, they are the key the upserts match on
+LISTING_URL = 'https://pararius.com'
+
+CITIES = (
+    'Alkmaar', 'Almere', 'Amersfoort', 'Amstelveen', 'Amsterdam', 'Apeldoorn', 'Arnhem', 'Breda', 'Bussum', 'Delft',
+    'Den Bosch', 'Den Haag', 'Deventer', 'Dordrecht', 'Eindhoven', 'Enschede', 'Groningen', 'Haarlem', 'Heerlen',
+    'Hilversum', 'Leeuwarden', 'Leiden', 'Maastricht', 'Nijmegen', 'Roermond', 'Rotterdam', 'Tilburg', 'Utrecht',
+    'Zaandam', 'Zwolle',
+)
+
+LISTING_CLASS = 'search-list__item--listing'
+TITLE_CLASS = 'listing-search-item__link--title'
+PRICE_CLASS = 'listing-search-item__price'
+LOCATION_CLASS = 'listing-search-item__location'
+ROOMS_CLASS = 'illustrated-features__item--number-of-rooms'
+AREA_CLASS = 'illustrated-features__item--surface-area'
+INTERIOR_CLASS = 'illustrated-features__item--interior'
+NEXT_CLASS = 'pagination__link--next'
+
+PRICE_PATTERN = re.compile(r'€(\d+)')
+NUMBER_PATTERN = re.compile(r'\d+')
+SPACES_PATTERN = re.compile(r'\s{2,}')
+# the strainer sees the whole class attribute, so the classes are matched as words of it
+STRAINER_PATTERN = re.compile(rf'(?:^|\s)(?:{LISTING_CLASS}|{NEXT_CLASS})(?:\s|$)')
+
+UPSERT_LISTING = f'''
+INSERT INTO housing ({", ".join(LISTING_FIELDS)}, last_seen)
+VALUES ({", ".join(f":{field}" for field in LISTING_FIELDS)}, :last_seen)
+ON CONFLICT (link) DO UPDATE SET {", ".join(f"{field} = excluded.{field}" for field in LISTING_FIELDS)},
+    last_seen = excluded.last_seen
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPage(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    next_url: Optional[str]
+    # links of the listings stored from the page, still on the site while it answers 304
+    links: List[str]
+
+
+class CityCrawl(NamedTuple):
+    city: str
+    listings: List[Dict[str, Any]]
+    seen: Set[str]
+    pages: Dict[str, CachedPage]
+    # whether every page was fetched, only then are the city's other listings gone from the site
+    complete: bool
+
+
+class HostRateLimiter:
+    """
+    Spaces the requests to each host ``interval`` seconds apart.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next: Dict[str, float] = {}
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc
+
+        now = time.monotonic()
+        at = max(now, self._next.get(host, now))
+        self._next[host] = at + self.interval
+
+        if at > now:
+            time.sleep(at - now)
+
+
+def city_url(city: str) -> str:
+    return f'{SITE_URL}/apartments/{city.lower().replace(" ", "-")}'
+
+
+def _number(item: Any, class_: str, pattern: re.Pattern = NUMBER_PATTERN) -> Optional[int]:
+    element = item.find(class_=class_)
+    match = pattern.search(element.get_text().replace(',', '')) if element is not None else None
+
+    return int(match.group(1 if pattern.groups else 0)) if match is not None else None
+
+
+def parse_listing(item: Any, city: str) -> Optional[Dict[str, Any]]:
+    """
+    One listing of a search page, or None for listings without a title or a price.
+    """
+    title = item.find(class_=TITLE_CLASS)
+    price = _number(item, PRICE_CLASS, PRICE_PATTERN)
+
+    if title is None or price is None:
+        return None
+
+    location = item.find(class_=LOCATION_CLASS)
+    interior = item.find(class_=INTERIOR_CLASS)
+
+    return {
+        'title': title.get_text(),
+        'link': LISTING_URL + title['href'],
+        'price': price,
+        'location': SPACES_PATTERN.sub('', location.get_text()) if location is not None else None,
+        'area': _number(item, AREA_CLASS),
+        'rooms': _number(item, ROOMS_CLASS),
+        'interior': interior.get_text() if interior is not None else None,
+        'city': city,
+    }
+
+
+def parse_page(html: str, city: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    The listings of a search page and the URL of the next page, if any.
+
+    Only the listings and the pagination are parsed, the rest of the page is skipped by the tokenizer.
+    """
+    soup = BeautifulSoup(html, features=PARSER, parse_only=SoupStrainer(class_=STRAINER_PATTERN))
+
+    listings = []
+    seen = set()
+    for item in soup.find_all('li', class_=LISTING_CLASS):
+        listing = parse_listing(item, city)
+
+        # a promoted listing can show up on every page
+        if listing is not None and listing['link'] not in seen:
+            seen.add(listing['link'])
+            listings.append(listing)
+
+    next_link = soup.find('a', class_=NEXT_CLASS)
+    next_url = urljoin(SITE_URL, next_link['href']) if next_link is not None and next_link.get('href') else None
+
+    return listings, next_url
+
+
+def fetch(session: requests.Session, limiter: HostRateLimiter, url: str, cached: Optional[CachedPage],
+          timeout: float = 30) -> requests.Response:
+    headers = {}
+    if cached is not None and cached.etag:
+        headers['If-None-Match'] = cached.etag
+    if cached is not None and cached.last_modified:
+        headers['If-Modified-Since'] = cached.last_modified
+
+    limiter.wait(url)
+    r = session.get(url, headers=headers, timeout=timeout)
+    r.raise_for_status()
+
+    return r
+
+
+def crawl_city(session: requests.Session, limiter: HostRateLimiter, cache: Dict[str, CachedPage],
+               city: str) -> CityCrawl:
+    listings: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    pages: Dict[str, CachedPage] = {}
+
+    url: Optional[str] = city_url(city)
+
+    while url is not None and url not in pages:
+        cached = cache.get(url)
+
+        try:
+            r = fetch(session, limiter, url, cached)
+        except requests.RequestException as e:
+            logger.warning(f'Failed to fetch {url}: {e!r}')
+            return CityCrawl(city, listings, seen, pages, complete=False)
+
+        if r.status_code == 304 and cached is not None:
+            page = cached
+        else:
+            page_listings, next_url = parse_page(r.text, city)
+            page = CachedPage(r.headers.get('ETag'), r.headers.get('Last-Modified'), next_url,
+                              [listing['link'] for listing in page_listings])
+            listings.extend(listing for listing in page_listings if listing['link'] not in seen)
+
+        seen.update(page.links)
+        pages[url] = page
+        url = page.next_url
+
+    return CityCrawl(city, listings, seen, pages, complete=True)
+
+
+def load_pages(conn: sqlite3.Connection) -> Dict[str, CachedPage]:
+    rows = conn.execute('SELECT url, etag, last_modified, next_url, links FROM pages')
+
+    return {url: CachedPage(etag, last_modified, next_url, json.loads(links))
+            for url, etag, last_modified, next_url, links in rows}
+
+
+def store_city(conn: sqlite3.Connection, crawl: CityCrawl, started: float) -> Dict[str, int]:
+    """
+    Upserts the crawled listings of a city and, if the crawl is complete, deletes the ones that were not seen.
+    """
+    city, counts = crawl.city, {'inserted': 0, 'updated': 0, 'deleted': 0}
+    existing = {row[0] for row in conn.execute('SELECT link FROM housing WHERE city = ?', (city,))}
+
+    with conn:
+        conn.executemany(UPSERT_LISTING, ({**listing, 'last_seen': started} for listing in crawl.listings))
+        # listings of pages that answered 304
+        conn.executemany('UPDATE housing SET last_seen = ? WHERE link = ?', ((started, link) for link in crawl.seen))
+
+        conn.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)', (
+            (url, city, page.etag, page.last_modified, page.next_url, json.dumps(page.links))
+            for url, page in crawl.pages.items()
+        ))
+
+        if crawl.complete:
+            counts['deleted'] = conn.execute(
+                'DELETE FROM housing WHERE city = ? AND (last_seen IS NULL OR last_seen < ?)', (city, started)
+            ).rowcount
+            conn.execute(f'DELETE FROM pages WHERE city = ? AND url NOT IN ({", ".join("?" * len(crawl.pages))})',
+                         (city, *crawl.pages))
+
+    links = {listing['link'] for listing in crawl.listings}
+    counts['inserted'] = len(links - existing)
+    counts['updated'] = len(links & existing)
+
+    return counts
+
+
+def publish(db_path: str, live_path: str) -> None:
+    """
+    Copies the database over the action server's in one write transaction. Connections open on it keep reading the
+    previous listings until their next query, which sees the new ones.
+    """
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(live_path)
+
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def export_parquet(conn: sqlite3.Connection, parquet_path: str) -> None:
+    import pandas as pd
+
+    df = pd.read_sql('SELECT title, link, price, location, area, rooms, interior, city, image FROM housing '
+                     'ORDER BY rowid', conn)
+
+    # replaced in one rename, the columnar backend never reads a half-written file
+    tmp_path = f'{parquet_path}.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, parquet_path)
+
+
+def scrape(db_path: str, cities: Sequence[str] = CITIES, interval: float = 15,
+           live_path: Optional[str] = None, parquet_path: Optional[str] = None,
+           session: Optional[requests.Session] = None) -> Dict[str, int]:
+    started = time.time()
+    totals = {'inserted': 0, 'updated': 0, 'deleted': 0}
+
+    conn = sqlite3.connect(db_path)
+
+    try:
+        ensure_schema(conn)
+        cache = load_pages(conn)
+        limiter = HostRateLimiter(interval)
+
+        # a session of the caller stays open for them
+        with nullcontext(session) if session is not None else requests.Session() as session:
+            for city in tqdm(cities, desc='Scraping cities'):
+                crawl = crawl_city(session, limiter, cache, city)
+                counts = store_city(conn, crawl, started)
+                logger.info(f'{crawl.city}: {len(crawl.pages)} pages, {counts}'
+                            + ('' if crawl.complete else ', incomplete'))
+
+                for key, count in counts.items():
+                    totals[key] += count
+
+        build_indexes(conn)
+
+        if parquet_path is not None:
+            export_parquet(conn, parquet_path)
+    finally:
+        conn.close()
+
+    if live_path is not None:
+        publish(db_path, live_path)
+
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape the Pararius listings into housing.db')
+    parser.add_argument('--db', default=os.path.join(BASE_PATH, 'housing.db'))
+    parser.add_argument('--live', default=LIVE_DB_PATH, help='database of the action server to publish to')
+    parser.add_argument('--no-publish', action='store_true', help='only update --db')
+    parser.add_argument('--parquet', default=None,
+                        help=f'also export the listings to this parquet file, {LIVE_PARQUET_PATH} when publishing')
+    parser.add_argument('--cities', nargs='+', default=CITIES)
+    parser.add_argument('--interval', type=float, default=15, help='seconds between two requests to the same host')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    parquet_path = args.parquet if args.parquet is not None or args.no_publish else LIVE_PARQUET_PATH
+
+    totals = scrape(args.db, cities=args.cities, interval=args.interval,
+                    live_path=None if args.no_publish else args.live, parquet_path=parquet_path)
+    logger.info(f'Scraped into {args.db}: {totals}')
+
+
+if __name__ == '__main__':
+    main()
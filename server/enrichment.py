@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+import httpx
+
+from server.cache import TTLCache
+from server.listing_page import IMAGE_CLASS, VIEWPORT_CLASS, extract_image
+
+IMAGE_FETCH_CONCURRENCY = int(os.getenv('IMAGE_FETCH_CONCURRENCY', '8'))
+IMAGE_FETCH_TIMEOUT = float(os.getenv('IMAGE_FETCH_TIMEOUT', '5'))
+IMAGE_CACHE_SIZE = int(os.getenv('IMAGE_CACHE_SIZE', '4096'))
+IMAGE_CACHE_TTL = float(os.getenv('IMAGE_CACHE_TTL', '86400'))
+IMAGE_NEGATIVE_TTL = float(os.getenv('IMAGE_NEGATIVE_TTL', '300'))
+
+logger = logging.getLogger(__name__)
+
+
+def _viewport_complete(html: str) -> bool:
+    start = html.find(VIEWPORT_CLASS)
+    if start == -1:
+        return False
+
+    image = html.find(IMAGE_CLASS, start)
+    if image == -1:
+        return False
+
+    return html.find('>', image) != -1
+
+
+class ImageEnricher:
+    """
+    Resolves listing links to their cover image without blocking the event loop.
+
+    Pages are fetched through one pooled client, at most ``max_concurrency`` at a time, and the
+    download stops as soon as the carousel image has been received. Results (including pages
+    without an image) are kept in a TTL+LRU cache, and concurrent lookups of one link share a fetch.
+    Failed fetches, e.g. the 404 of a removed listing, are cached as no image for ``negative_ttl``
+    seconds, so the page is not requested again with every search that shows it.
+    """
+
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, max_concurrency: int = IMAGE_FETCH_CONCURRENCY,
+                 cache: Optional[TTLCache] = None, negative_ttl: float = IMAGE_NEGATIVE_TTL):
+        self.client = client
+        self.cache = cache if cache is not None else TTLCache(maxsize=IMAGE_CACHE_SIZE, ttl=IMAGE_CACHE_TTL)
+        self.negative_ttl = negative_ttl
+
+        self._max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=IMAGE_FETCH_TIMEOUT,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self._max_concurrency,
+                                    max_keepalive_connections=self._max_concurrency),
+            )
+
+        return self.client
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get_image(self, link: str) -> Optional[str]:
+        cached = self.cache.get(link, default=self)
+        if cached is not self:
+            return cached
+
+        pending = self._pending.get(link)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_event_loop().create_future()
+        self._pending[link] = future
+
+        try:
+            image = await self._fetch(link)
+        except httpx.HTTPError as e:
+            logger.warning(f'Failed to fetch listing image from {link}: {e!r}')
+            image = None
+
+            if self.negative_ttl > 0:
+                self.cache.set(link, image, ttl=self.negative_ttl)
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            self.cache.set(link, image)
+        finally:
+            del self._pending[link]
+
+        future.set_result(image)
+
+        return image
+
+    async def _fetch(self, link: str) -> Optional[str]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async with self._semaphore:
+            async with self._get_client().stream('GET', link) as r:
+                r.raise_for_status()
+
+                html = ''
+                async for chunk in r.aiter_text():
+                    html += chunk
+
+                    if _viewport_complete(html):
+                        break
+
+        return extract_image(html)
@@ -0,0 +1,24 @@
+"""
+Parsing of Pararius listing pages, shared by the orchestrator and ``scraper/enrich_images.py``.
+"""
+from typing import Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+VIEWPORT_CLASS = 'carrousel__viewport'
+IMAGE_CLASS = 'picture__image'
+
+
+def extract_image(html: str) -> Optional[str]:
+    """
+    Returns the first listing picture inside the carousel viewport, parsing only that element.
+    """
+    soup = BeautifulSoup(html, features='html.parser', parse_only=SoupStrainer(class_=VIEWPORT_CLASS))
+    ad_viewport = soup.find(class_=VIEWPORT_CLASS)
+
+    if ad_viewport is None:
+        return None
+
+    image = ad_viewport.find(class_=IMAGE_CLASS)
+
+    return image.get('src') if image is not None else None
@@ -1,18 +1,36 @@
 #from fastapi.logger import logger
+import asyncio
 import os
-from typing import List
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional
 import logging
 
-import requests
+import httpx
 import socketio
-from bs4 import BeautifulSoup
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from mtranslate import translate
 from pydantic import BaseModel
-from starlette.responses import FileResponse
-
-RASA_URL = f'http://{os.getenv("RASA_HOST", "localhost")}:5005/'
+from starlette.responses import FileResponse, PlainTextResponse
+
+from server.enrichment import ImageEnricher
+from server.metrics import REGISTRY, Gauge
+from server.tracing import Trace
+from server.translation import TRANSLATION_DOMAIN_PATH, TranslationService, load_domain_responses
+from server.upstream import RASA_UPSTREAM, RasaChannelPool, RasaRestClient, SocketIOUpstream, Upstream
+
+RASA_URL = f'http://{os.getenv("RASA_HOST", "localhost")}:{os.getenv("RASA_PORT", "5005")}/'
+MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', '10000'))
+# seconds a session outlives its websocket, so a reconnecting browser resumes it; 0 ends it with the websocket
+SESSION_RESUME_TIMEOUT = float(os.getenv('SESSION_RESUME_TIMEOUT', '60'))
+# bot messages kept for a disconnected browser, the oldest are dropped beyond it
+SESSION_BUFFER_SIZE = int(os.getenv('SESSION_BUFFER_SIZE', '64'))
+
+# "Try Again Later" close code, sent when the connection cap is reached
+WS_SERVER_BUSY = 1013
+# sent to a websocket whose session was resumed on a newer one
+WS_SESSION_RESUMED = 4000
 
 logger = logging.getLogger(__name__)
 
@@ -20,81 +38,376 @@ logger = logging.getLogger(__name__)
 class Message(BaseModel):
     text: str
     sender: str
+    lang: str = 'en'
+
+
+class ChatResponse(BaseModel):
+    sender: str
+    messages: List[dict]
+
+
+image_enricher = ImageEnricher()
+translation_service = TranslationService()
+rasa_pool = RasaChannelPool(RASA_URL)
+rasa_rest = RasaRestClient(RASA_URL)
+
+REGISTRY.register(Gauge('translation_cache_hit_ratio', 'Share of translation lookups answered from the cache',
+                        lambda: translation_service.cache.hit_ratio))
 
 
 class Connection:
-    def __init__(self, websocket: WebSocket, socketio: socketio.AsyncClient):
-        self.websocket = websocket
-        self.socketio = socketio
+    """
+    A browser's session: its upstream Rasa session and the websocket it is currently connected through, if any.
+
+    Bot messages arriving while the browser is away are kept in a ring buffer of ``buffer_size`` and sent when it
+    resumes the session with its ``token``.
+    """
+    __slots__ = ('websocket', 'upstream', 'enricher', 'translation', 'lang', 'trace', 'token', 'buffer',
+                 '_last_reply', '_sent_at')
+
+    def __init__(self, websocket: WebSocket, upstream: Upstream,
+                 enricher: Optional[ImageEnricher] = None, translation: Optional[TranslationService] = None,
+                 token: Optional[str] = None, buffer_size: int = SESSION_BUFFER_SIZE):
+        self.websocket: Optional[WebSocket] = websocket
+        self.upstream = upstream
+        self.token = token
+        self.buffer: 'deque[dict]' = deque(maxlen=buffer_size)
+        self.enricher = enricher if enricher is not None else image_enricher
+        self.translation = translation if translation is not None else translation_service
         self.lang = 'en'
 
-        self.socketio.on('bot_uttered', self.bot_uttered)
+        self.trace: Optional[Trace] = None
+
+        # socket.io runs event handlers as concurrent tasks, so replies are chained to keep their order
+        self._last_reply: Optional[asyncio.Future] = None
+        self._sent_at: Optional[float] = None
 
     async def connect(self) -> bool:
         await self.websocket.accept()
-        await self.websocket.send_json({'status': 'Connected'})
+        await self.websocket.send_json(self.status())
 
         try:
-            await self.socketio.connect(RASA_URL)
-        except socketio.exceptions.ConnectionError:
+            await self.upstream.open(self.bot_uttered, self.bot_uttered_batch)
+        except (socketio.exceptions.ConnectionError, socketio.exceptions.TimeoutError):
             await self.websocket.close()
             return False
 
         return True
 
+    def status(self, resumed: bool = False) -> dict:
+        status = {'status': 'Connected'}
+
+        if self.token is not None:
+            status['session'] = self.token
+        if resumed:
+            status['resumed'] = True
+
+        return status
+
+    async def resume(self, websocket: WebSocket) -> None:
+        """
+        Attaches a reconnected browser, which first receives the bot messages it missed.
+        """
+        previous_websocket, self.websocket = self.websocket, None
+
+        if previous_websocket is not None:
+            # the session moved to a new connection before the old one was noticed to be gone
+            try:
+                await previous_websocket.close(code=WS_SESSION_RESUMED)
+            except (RuntimeError, OSError):
+                pass
+
+        await websocket.accept()
+        await websocket.send_json(self.status(resumed=True))
+
+        # messages that are still being built are queued behind the ones already buffered
+        previous_reply = self._last_reply
+        reply = asyncio.get_event_loop().create_future()
+        self._last_reply = reply
+
+        try:
+            if previous_reply is not None:
+                await previous_reply
+
+            self.websocket = websocket
+            while self.buffer:
+                await self.deliver(self.buffer.popleft())
+        finally:
+            reply.set_result(None)
+
+    def detach(self) -> None:
+        self.websocket = None
+        self.finish_turn()
+
+    async def deliver(self, data: dict) -> bool:
+        """
+        Sends a message to the browser, or buffers it while the browser is away; ``True`` if it was sent.
+        """
+        websocket = self.websocket
+
+        if websocket is not None:
+            try:
+                await websocket.send_json(data)
+                return True
+            except (WebSocketDisconnect, RuntimeError, OSError):
+                # the browser went away during the turn, the message waits for it to come back
+                pass
+
+        if len(self.buffer) == self.buffer.maxlen:
+            logger.warning(f'Buffer of session {self.token} is full, dropping its oldest bot message')
+
+        self.buffer.append(data)
+
+        return False
+
+    def start_turn(self) -> Trace:
+        """
+        Starts timing a new user turn. A turn is finished once its batch of replies was delivered; replies sent one
+        by one have no end marker, so the turn is finished here, timed until its last delivered reply.
+        """
+        self.finish_turn()
+        self.trace = Trace()
+
+        return self.trace
+
+    def finish_turn(self) -> None:
+        if self.trace is not None:
+            self.trace.finish()
+            self.trace = None
+
+    async def send(self, text: str) -> None:
+        trace = self.trace
+
+        if trace is None:
+            await self.upstream.send(text)
+            return
+
+        with trace.span('upstream_send'):
+            await self.upstream.send(text, trace.correlation_id)
+
+        self._sent_at = time.perf_counter()
+
     async def bot_uttered(self, data):
-        response_data = {}
+        self.record_rasa()
+
+        if data.get('partial') and self.lang != 'en':
+            # a piece of a streamed reply cannot be translated on its own, the final message brings the whole reply
+            return
+
+        await self.send_in_order(self.build_response(data), self.trace)
+
+    async def bot_uttered_batch(self, messages: List[dict]):
+        """
+        All messages of a turn: they are translated and enriched concurrently and reach the browser in one frame.
+        """
+        self.record_rasa()
+
+        if self.lang != 'en':
+            messages = [data for data in messages if not data.get('partial')]
+
+        trace = self.trace
+
+        if messages:
+            await self.send_in_order(self.build_batch(messages), trace)
+
+        # the batch holds all replies of the turn
+        if trace is not None and trace is self.trace:
+            self.finish_turn()
+
+    def record_rasa(self) -> None:
+        trace = self.trace
+
+        if trace is not None and self._sent_at is not None:
+            # time from handing the message to Rasa until its first reply: NLU, policies and actions
+            trace.record('rasa', time.perf_counter() - self._sent_at)
+            self._sent_at = None
+
+    async def send_in_order(self, response: Awaitable[dict], trace: Optional[Trace] = None) -> None:
+        previous_reply = self._last_reply
+        reply = asyncio.get_event_loop().create_future()
+        self._last_reply = reply
+
+        try:
+            response_data = await response
+
+            if previous_reply is not None:
+                await previous_reply
+
+            if await self.deliver(response_data) and trace is not None:
+                trace.mark_delivered()
+        finally:
+            reply.set_result(None)
+
+    async def build_batch(self, messages: List[dict]) -> dict:
+        return {'messages': list(await asyncio.gather(*(self.build_response(data) for data in messages)))}
+
+    async def build_response(self, data) -> dict:
+        if data.get('partial'):
+            return {'text': data['text'], 'message_id': data['message_id'], 'partial': True}
 
-        if 'text' in data:
-            if self.lang != 'en':
-                text = translate(data['text'], self.lang, 'en')
-            else:
-                text = data['text']
+        return await build_response(data, self.lang, self.translation, self.enricher, self.trace)
 
-            response_data['text'] = text
 
-        if 'title' in data:
-            if self.lang != 'en':
-                text = translate(data['title'], self.lang, 'en')
-            else:
-                text = data['title']
+async def build_response(data: dict, lang: str, translation: TranslationService, enricher: ImageEnricher,
+                         trace: Optional[Trace] = None) -> dict:
+    """
+    Translates a bot message from English into ``lang`` and attaches the listing image, if any.
+    """
+    response_data = {}
+    trace = trace if trace is not None else Trace()
 
-            response_data['title'] = text
+    # title and text of one utterance are translated in a single round trip
+    keys = [key for key in ('text', 'title') if key in data]
 
-        if 'link' in data:
-            response_data['link'] = data['link']
+    with trace.span('translate_bot'):
+        translations = await translation.translate_many([data[key] for key in keys], 'en', lang)
 
-            r = requests.get(data['link'])
+    response_data.update(zip(keys, translations))
 
-            soup = BeautifulSoup(r.text, features='html.parser')
-            ad_viewport = soup.find(class_='carrousel__viewport')
+    # the final message of a streamed reply replaces the pieces sent under the same id
+    for key in ('message_id', 'final'):
+        if key in data:
+            response_data[key] = data[key]
 
-            if ad_viewport is not None:
-                response_data['image'] = ad_viewport.find(class_='picture__image')['src']
+    if 'link' in data:
+        response_data['link'] = data['link']
 
-        await self.websocket.send_json(response_data)
+        # listings enriched at ingest time carry their image, only the rest are fetched live
+        with trace.span('enrich'):
+            image = data.get('image') or await enricher.get_image(data['link'])
+
+        if image is not None:
+            response_data['image'] = image
+
+    return response_data
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.connections: List[Connection] = []
+    """
+    Registry of live connections keyed by a generated connection id, capped at ``max_connections``.
+
+    The connection id is the session token given to the browser. A connection outlives its websocket by
+    ``resume_timeout`` seconds, keeping its upstream session and Rasa tracker, so that a browser reconnecting with
+    the token continues where it left off.
+    """
+
+    def __init__(self, max_connections: int = MAX_CONNECTIONS, resume_timeout: float = SESSION_RESUME_TIMEOUT):
+        self.max_connections = max_connections
+        self.resume_timeout = resume_timeout
+        self.connections: Dict[str, Connection] = {}
+        self.rejected = 0
+        self.resumed = 0
+
+        self._expiry: Dict[str, asyncio.TimerHandle] = {}
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    @property
+    def detached(self) -> int:
+        return len(self._expiry)
+
+    @property
+    def full(self) -> bool:
+        return len(self.connections) >= self.max_connections
+
+    async def add_connection(self, websocket: WebSocket, create_upstream: Callable[[], Upstream]) -> Optional[str]:
+        """
+        Registers a new connection and returns its id, or ``None`` when the server is at capacity. The upstream is
+        only created for an accepted connection, so refusing one under load costs nothing.
+        """
+        if self.full:
+            self.rejected += 1
+            return None
+
+        connection_id = uuid.uuid4().hex
+        self.connections[connection_id] = Connection(websocket=websocket, upstream=create_upstream(),
+                                                     token=connection_id)
+
+        return connection_id
+
+    async def resume(self, connection_id: str, websocket: WebSocket) -> bool:
+        """
+        Moves a session to a reconnected browser's websocket, ``False`` if it has expired or never existed.
+        """
+        connection = self.connections.get(connection_id)
+
+        if connection is None:
+            return False
+
+        expiry = self._expiry.pop(connection_id, None)
+        if expiry is not None:
+            expiry.cancel()
+
+        self.resumed += 1
+
+        try:
+            await connection.resume(websocket)
+        except BaseException:
+            # the browser went away again while resuming, the session waits for it once more
+            connection.detach()
+            self._expire_later(connection_id, max(self.resume_timeout, 0))
+            raise
+
+        return True
+
+    async def detach(self, connection_id: str, websocket: WebSocket) -> None:
+        """
+        Called when ``websocket`` closes: the session waits ``resume_timeout`` seconds for the browser to return.
+        """
+        connection = self.connections.get(connection_id)
+
+        # a session resumed on another websocket stays with it
+        if connection is None or connection.websocket is not websocket:
+            return
+
+        if self.resume_timeout <= 0:
+            await self.remove_connection(connection_id)
+            return
 
-    async def add_connection(self, websocket: WebSocket, socketio: socketio.AsyncClient) -> int:
-        new_connection = Connection(websocket=websocket, socketio=socketio)
-        self.connections.append(new_connection)
+        connection.detach()
+        self._expire_later(connection_id, self.resume_timeout)
 
-        return len(self.connections) - 1
+    def _expire_later(self, connection_id: str, delay: float) -> None:
+        self._expiry[connection_id] = asyncio.get_event_loop().call_later(
+            delay, lambda: asyncio.ensure_future(self.remove_connection(connection_id))
+        )
 
-    def set_language(self, connection_id: int, lang: str):
+    async def remove_connection(self, connection_id: str) -> None:
+        expiry = self._expiry.pop(connection_id, None)
+        if expiry is not None:
+            expiry.cancel()
+
+        connection = self.connections.pop(connection_id, None)
+
+        if connection is not None:
+            connection.finish_turn()
+            await connection.upstream.close()
+
+    def get(self, connection_id: str) -> Connection:
+        return self.connections[connection_id]
+
+    def set_language(self, connection_id: str, lang: str):
         self.connections[connection_id].lang = lang
 
-    async def connect(self, connection_id: int) -> bool:
+    async def connect(self, connection_id: str) -> bool:
         return await self.connections[connection_id].connect()
 
 
 app = FastAPI()
 connection_manager = ConnectionManager()
 
+REGISTRY.register(Gauge('orchestrator_connections_active', 'Open websocket connections',
+                        lambda: len(connection_manager)))
+REGISTRY.register(Gauge('orchestrator_connections_max', 'Connection cap of this orchestrator',
+                        lambda: connection_manager.max_connections))
+REGISTRY.register(Gauge('orchestrator_connections_rejected', 'Connections refused because the cap was reached',
+                        lambda: connection_manager.rejected))
+REGISTRY.register(Gauge('orchestrator_sessions_detached', 'Sessions waiting for their browser to reconnect',
+                        lambda: connection_manager.detached))
+REGISTRY.register(Gauge('orchestrator_sessions_resumed', 'Sessions resumed by a reconnecting browser',
+                        lambda: connection_manager.resumed))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],
@@ -104,31 +417,123 @@ app.add_middleware(
 )
 
 
+@app.on_event('startup')
+async def warm_translation_cache():
+    if os.path.exists(TRANSLATION_DOMAIN_PATH):
+        asyncio.ensure_future(translation_service.warm(load_domain_responses(TRANSLATION_DOMAIN_PATH)))
+    else:
+        logger.warning(f'{TRANSLATION_DOMAIN_PATH} not found, translation cache is not warmed')
+
+
+@app.on_event('shutdown')
+async def close_clients():
+    await image_enricher.close()
+    await rasa_pool.close()
+    await rasa_rest.close()
+    translation_service.close()
+
+
 @app.get('/')
 def main_page():
     return FileResponse(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'index.html'))
 
 
+@app.get('/metrics')
+def metrics():
+    return PlainTextResponse(REGISTRY.render())
+
+
+async def chat_turn(message: Message) -> ChatResponse:
+    trace = Trace()
+
+    with trace.span('translate_user'):
+        text = await translation_service.translate(message.text, message.lang, 'en')
+
+    try:
+        with trace.span('rasa'):
+            bot_messages = await rasa_rest.send(message.sender, text)
+    except httpx.HTTPError as e:
+        logger.error(f'Rasa REST request failed: {e!r}')
+        raise HTTPException(status_code=502, detail='Rasa is unavailable')
+
+    responses = await asyncio.gather(*(build_response(data, message.lang, translation_service, image_enricher,
+                                                      trace) for data in bot_messages))
+    trace.finish()
+
+    return ChatResponse(sender=message.sender, messages=list(responses))
+
+
+@app.post('/chat', response_model=ChatResponse)
+async def chat(message: Message):
+    return await chat_turn(message)
+
+
+@app.post('/chat/batch', response_model=List[ChatResponse])
+async def chat_batch(messages: List[Message]):
+    # turns of one sender depend on each other and run in order, different senders run concurrently
+    by_sender: Dict[str, List[int]] = OrderedDict()
+    for i, message in enumerate(messages):
+        by_sender.setdefault(message.sender, []).append(i)
+
+    responses: List[Optional[ChatResponse]] = [None] * len(messages)
+
+    async def run_sender(indices: List[int]):
+        for i in indices:
+            responses[i] = await chat_turn(messages[i])
+
+    await asyncio.gather(*(run_sender(indices) for indices in by_sender.values()))
+
+    return responses
+
+
+def create_upstream() -> Upstream:
+    if RASA_UPSTREAM == 'pool':
+        return rasa_pool.session()
+    else:
+        return SocketIOUpstream(RASA_URL)
+
+
 @app.websocket('/ws')
 async def websocket(websocket: WebSocket):
-    connection_id = await connection_manager.add_connection(websocket, socketio.AsyncClient())
-    connected = await connection_manager.connect(connection_id)
+    # a browser reconnecting with its session token continues its conversation
+    token = websocket.query_params.get('session')
+    resumed = token is not None and await connection_manager.resume(token, websocket)
 
-    if connected:
-        try:
-            while True:
-                data = await connection_manager.connections[connection_id].websocket.receive_json()
-                connection_manager.set_language(connection_id, data['lang'])
+    connection_id = token if resumed else await connection_manager.add_connection(websocket, create_upstream)
 
-                if data['lang'] != 'en':
-                    text = translate(data['message'], 'en', data['lang'])
-                else:
-                    text = data['message']
+    if connection_id is None:
+        logger.warning('Connection limit reached, refusing websocket')
+        await websocket.accept()
+        await websocket.send_json({'status': 'Server busy'})
+        await websocket.close(code=WS_SERVER_BUSY)
+        return
 
-                await connection_manager.connections[connection_id].socketio.emit("user_uttered",
-                                                                                  data={'message': text})
+    connected = False
 
-        except WebSocketDisconnect:
-            await connection_manager.connections[connection_id].socketio.disconnect()            
-    else:
-        logger.error('Failed to establish connection!')
+    try:
+        connected = resumed or await connection_manager.connect(connection_id)
+
+        if connected:
+            connection = connection_manager.get(connection_id)
+
+            while True:
+                data = await websocket.receive_json()
+                connection.lang = data['lang']
+
+                trace = connection.start_turn()
+
+                with trace.span('translate_user'):
+                    text = await translation_service.translate(data['message'], data['lang'], 'en')
+
+                await connection.send(text)
+        else:
+            logger.error('Failed to establish connection!')
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        logger.exception(f'Connection {connection_id} failed')
+    finally:
+        if connected:
+            await connection_manager.detach(connection_id, websocket)
+        else:
+            await connection_manager.remove_connection(connection_id)
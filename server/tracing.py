@@ -0,0 +1,54 @@
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from server.metrics import REGISTRY, Histogram
+
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'orchestrator_stage_seconds', 'Time spent in each stage of a chat turn', labelnames=('stage',)
+))
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """
+    Stage timings of one chat turn. The correlation id travels with the user message to Rasa and the actions.
+    """
+    __slots__ = ('correlation_id', 'start', 'stages', 'delivered')
+
+    def __init__(self, correlation_id: Optional[str] = None):
+        self.correlation_id = correlation_id or uuid.uuid4().hex
+        self.start = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        # when the latest reply of the turn reached the user
+        self.delivered: Optional[float] = None
+
+    def record(self, stage: str, duration: float) -> None:
+        self.stages.append((stage, duration))
+        STAGE_LATENCY.observe(duration, stage)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def mark_delivered(self) -> None:
+        self.delivered = time.perf_counter()
+
+    def finish(self) -> None:
+        # the turn ends with its last reply, not whenever it is finished, e.g. by the user's next message
+        end = self.delivered if self.delivered is not None else time.perf_counter()
+        self.record('turn', end - self.start)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            breakdown = ', '.join(f'{stage}={duration * 1000:.1f}ms' for stage, duration in self.stages)
+            logger.debug(f'Turn {self.correlation_id}: {breakdown}')
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import yaml
+from mtranslate import translate
+
+from server.cache import TTLCache
+from server.metrics import REGISTRY, Counter, Histogram
+
+TRANSLATOR_BACKEND = os.getenv('TRANSLATOR_BACKEND', 'mtranslate')
+TRANSLATION_FIXTURES_PATH = os.getenv('TRANSLATION_FIXTURES_PATH')
+TRANSLATION_WORKERS = int(os.getenv('TRANSLATION_WORKERS', '8'))
+TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', '16384'))
+TRANSLATION_CACHE_TTL = float(os.getenv('TRANSLATION_CACHE_TTL', '86400'))
+TRANSLATION_LANGUAGES = [lang for lang in os.getenv('TRANSLATION_LANGUAGES', 'nl,bg,ru').split(',') if lang]
+TRANSLATION_DOMAIN_PATH = os.getenv(
+    'TRANSLATION_DOMAIN_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'rasa_ai', 'domain.yml')
+)
+
+# joins the texts of one batch so they are translated by mtranslate in a single round trip
+BATCH_SEPARATOR = '\n|||\n'
+MAX_BATCH_CHARS = 1500
+
+TRANSLATION_LATENCY = REGISTRY.register(Histogram(
+    'translation_latency_seconds', 'Latency of translation round trips made on cache misses'
+))
+TRANSLATION_LOOKUPS = REGISTRY.register(Counter(
+    'translation_cache_lookups_total', 'Translation cache lookups', labelnames=('result',)
+))
+
+logger = logging.getLogger(__name__)
+
+
+def load_domain_responses(domain_path: str = TRANSLATION_DOMAIN_PATH) -> List[str]:
+    """
+    Returns every text response of a Rasa domain, split the way the socket.io channel sends them.
+    """
+    with open(domain_path) as f:
+        domain = yaml.safe_load(f)
+
+    texts = []
+    for variations in (domain.get('responses') or {}).values():
+        for response in variations:
+            if 'text' in response:
+                texts.extend(part for part in response['text'].strip().split('\n\n') if part)
+
+    return list(dict.fromkeys(texts))
+
+
+class Translator:
+    """
+    Translation backend. ``blocking`` backends are called from a thread pool by ``TranslationService``.
+    """
+    blocking = True
+
+    def translate(self, text: str, src: str, dst: str) -> str:
+        raise NotImplementedError
+
+    def translate_batch(self, texts: List[str], src: str, dst: str) -> List[str]:
+        return [self.translate(text, src, dst) for text in texts]
+
+
+class MTranslateTranslator(Translator):
+    """
+    Google Translate through mtranslate, one HTTP round trip per batch.
+    """
+
+    def translate(self, text: str, src: str, dst: str) -> str:
+        return translate(text, dst, src)
+
+    def translate_batch(self, texts: List[str], src: str, dst: str) -> List[str]:
+        if len(texts) == 1:
+            return [self.translate(texts[0], src, dst)]
+
+        joined = self.translate(BATCH_SEPARATOR.join(texts), src, dst)
+        translations = [part.strip() for part in joined.split(BATCH_SEPARATOR.strip())]
+
+        if len(translations) != len(texts):
+            # the separator did not survive translation, fall back to one round trip per text
+            translations = super().translate_batch(texts, src, dst)
+
+        return translations
+
+
+class IdentityTranslator(Translator):
+    """
+    Returns every text unchanged, for measuring the orchestrator without a translation backend.
+    """
+    blocking = False
+
+    def translate(self, text: str, src: str, dst: str) -> str:
+        return text
+
+
+class DictionaryTranslator(Translator):
+    """
+    Looks translations up in a local table of ``{"<src>-<dst>": {text: translation}}``.
+    Texts missing from the table are returned unchanged.
+    """
+    blocking = False
+
+    def __init__(self, translations: Optional[Dict[str, Dict[str, str]]] = None):
+        self.translations = translations or {}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'DictionaryTranslator':
+        with open(path) as f:
+            return cls(yaml.safe_load(f))
+
+    def translate(self, text: str, src: str, dst: str) -> str:
+        return self.translations.get(f'{src}-{dst}', {}).get(text, text)
+
+
+def create_translator(backend: str = TRANSLATOR_BACKEND,
+                      fixtures_path: Optional[str] = TRANSLATION_FIXTURES_PATH) -> Translator:
+    if backend == 'mtranslate':
+        return MTranslateTranslator()
+    elif backend == 'identity':
+        return IdentityTranslator()
+    elif backend == 'dictionary':
+        return DictionaryTranslator.from_file(fixtures_path) if fixtures_path else DictionaryTranslator()
+    else:
+        raise ValueError(f'Unknown translator backend: {backend}')
+
+
+class TranslationService:
+    """
+    Caching, non-blocking front for a ``Translator`` backend.
+
+    Translations are cached by (text, src, dst); misses of blocking backends run on a thread pool and
+    the misses of one call are handed to the backend in as few batches as possible.
+    """
+
+    def __init__(self, translator: Optional[Translator] = None, cache: Optional[TTLCache] = None,
+                 max_workers: int = TRANSLATION_WORKERS):
+        self.translator = translator if translator is not None else create_translator()
+        self.cache = cache if cache is not None else TTLCache(maxsize=TRANSLATION_CACHE_SIZE,
+                                                              ttl=TRANSLATION_CACHE_TTL)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='translate')
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    async def translate(self, text: str, src: str, dst: str) -> str:
+        return (await self.translate_many([text], src, dst))[0]
+
+    async def translate_many(self, texts: List[str], src: str, dst: str) -> List[str]:
+        if src == dst:
+            return list(texts)
+
+        results: List[Optional[str]] = []
+        misses = {}
+
+        for text in texts:
+            cached = self.cache.get((text, src, dst))
+            TRANSLATION_LOOKUPS.inc('miss' if cached is None else 'hit')
+
+            results.append(cached)
+            if cached is None:
+                misses.setdefault(text, []).append(len(results) - 1)
+
+        if misses:
+            translated = await asyncio.gather(*(self._translate_batch(batch, src, dst)
+                                                for batch in self._batches(list(misses))))
+
+            for batch in translated:
+                for text, translation in batch:
+                    self.cache.set((text, src, dst), translation)
+
+                    for i in misses[text]:
+                        results[i] = translation
+
+        return results
+
+    async def warm(self, texts: Iterable[str], languages: Iterable[str] = TRANSLATION_LANGUAGES,
+                   src: str = 'en') -> None:
+        texts = list(texts)
+
+        for lang in languages:
+            try:
+                await self.translate_many(texts, src, lang)
+            except Exception as e:
+                logger.warning(f'Failed to warm translation cache for {lang}: {e!r}')
+
+    @staticmethod
+    def _batches(texts: List[str]) -> Iterable[List[str]]:
+        batch, size = [], 0
+
+        for text in texts:
+            if batch and size + len(text) > MAX_BATCH_CHARS:
+                yield batch
+                batch, size = [], 0
+
+            batch.append(text)
+            size += len(text) + len(BATCH_SEPARATOR)
+
+        if batch:
+            yield batch
+
+    async def _translate_batch(self, texts: List[str], src: str, dst: str) -> List[Tuple[str, str]]:
+        start = time.perf_counter()
+
+        if self.translator.blocking:
+            translations = await asyncio.get_event_loop().run_in_executor(
+                self.executor, self.translator.translate_batch, texts, src, dst
+            )
+        else:
+            translations = self.translator.translate_batch(texts, src, dst)
+
+        TRANSLATION_LATENCY.observe(time.perf_counter() - start)
+
+        return list(zip(texts, translations))
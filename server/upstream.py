@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import socketio
+
+RASA_UPSTREAM = os.getenv('RASA_UPSTREAM', 'connection')
+RASA_POOL_SIZE = int(os.getenv('RASA_POOL_SIZE', '4'))
+RASA_SESSION_TIMEOUT = float(os.getenv('RASA_SESSION_TIMEOUT', '10'))
+RASA_REST_TIMEOUT = float(os.getenv('RASA_REST_TIMEOUT', '60'))
+RASA_REST_CONNECTIONS = int(os.getenv('RASA_REST_CONNECTIONS', '32'))
+# "websocket" for Rasa with several Sanic workers: long polling needs every request of a socket on the same worker
+RASA_TRANSPORTS = [transport for transport in os.getenv('RASA_TRANSPORTS', '').split(',') if transport] or None
+
+BotMessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+BotBatchHandler = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+logger = logging.getLogger(__name__)
+
+
+def user_message(text: str, session_id: str, correlation_id: Optional[str] = None) -> Dict[str, Any]:
+    message = {'message': text, 'session_id': session_id}
+
+    if correlation_id is not None:
+        message['correlation_id'] = correlation_id
+
+    return message
+
+
+def one_by_one(on_message: BotMessageHandler) -> BotBatchHandler:
+    """
+    Batch handler passing the messages of a batch to ``on_message`` in order.
+    """
+    async def on_batch(messages: List[Dict[str, Any]]) -> None:
+        for message in messages:
+            await on_message(message)
+
+    return on_batch
+
+
+class Upstream:
+    """
+    One user session on the Rasa socket.io channel.
+
+    The channel runs with ``session_persistence`` so messages are tracked by ``session_id`` rather than by
+    socket, and it tags every bot message with the session it belongs to. With ``batch_messages`` it sends the
+    messages of a turn together as one ``bot_uttered_batch`` event, passed to ``on_batch``.
+    """
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.session_id = session_id or uuid.uuid4().hex
+
+    async def open(self, on_message: BotMessageHandler, on_batch: Optional[BotBatchHandler] = None) -> None:
+        """
+        Starts the session, raises ``socketio.exceptions.ConnectionError`` if Rasa cannot be reached.
+        """
+        raise NotImplementedError
+
+    async def send(self, text: str, correlation_id: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        raise NotImplementedError
+
+
+class SocketIOUpstream(Upstream):
+    """
+    Session with a socket.io client of its own.
+    """
+
+    def __init__(self, url: str, client: Optional[socketio.AsyncClient] = None, session_id: Optional[str] = None):
+        super().__init__(session_id)
+        self.url = url
+        self.client = client if client is not None else socketio.AsyncClient()
+
+    async def open(self, on_message: BotMessageHandler, on_batch: Optional[BotBatchHandler] = None) -> None:
+        on_batch = on_batch if on_batch is not None else one_by_one(on_message)
+
+        async def batch(data: Dict[str, Any]) -> None:
+            await on_batch(data['messages'])
+
+        self.client.on('bot_uttered', on_message)
+        self.client.on('bot_uttered_batch', batch)
+
+        await self.client.connect(self.url, transports=RASA_TRANSPORTS)
+        await self.client.call('session_request', {'session_id': self.session_id}, timeout=RASA_SESSION_TIMEOUT)
+
+    async def send(self, text: str, correlation_id: Optional[str] = None) -> None:
+        await self.client.emit('user_uttered', user_message(text, self.session_id, correlation_id))
+
+    async def close(self) -> None:
+        if self.client.connected:
+            await self.client.disconnect()
+
+
+class RasaChannelPool:
+    """
+    Small set of persistent socket.io connections to Rasa shared by all sessions of the orchestrator.
+
+    Each session is pinned to the least loaded connection, joins its room there through ``session_request``
+    and bot messages are routed back to the session's handler by their ``session_id``.
+    """
+
+    def __init__(self, url: str, size: int = RASA_POOL_SIZE,
+                 client_factory: Callable[[], socketio.AsyncClient] = socketio.AsyncClient):
+        self.url = url
+        self.size = size
+        self.client_factory = client_factory
+
+        self.clients: List[Optional[socketio.AsyncClient]] = [None] * size
+        self.handlers: Dict[str, BotMessageHandler] = {}
+        self.batch_handlers: Dict[str, BotBatchHandler] = {}
+        self.assignments: Dict[str, int] = {}
+
+        self._loads = [0] * size
+        self._locks: Optional[List[asyncio.Lock]] = None
+
+    def session(self, session_id: Optional[str] = None) -> 'PooledUpstream':
+        return PooledUpstream(self, session_id)
+
+    async def _get_client(self, index: int) -> socketio.AsyncClient:
+        if self._locks is None:
+            self._locks = [asyncio.Lock() for _ in range(self.size)]
+
+        async with self._locks[index]:
+            client = self.clients[index]
+
+            if client is None:
+                client = self.client_factory()
+                client.on('bot_uttered', self._dispatch)
+                client.on('bot_uttered_batch', self._dispatch_batch)
+                client.on('connect', self._rejoin_handler(index))
+
+                await client.connect(self.url, transports=RASA_TRANSPORTS)
+                self.clients[index] = client
+
+            return client
+
+    async def open_session(self, session_id: str, on_message: BotMessageHandler,
+                           on_batch: Optional[BotBatchHandler] = None) -> None:
+        index = self._loads.index(min(self._loads))
+
+        # the slot is taken before connecting, so sessions opened meanwhile go to the other connections
+        self.assignments[session_id] = index
+        self._loads[index] += 1
+
+        try:
+            client = await self._get_client(index)
+
+            self.handlers[session_id] = on_message
+            self.batch_handlers[session_id] = on_batch if on_batch is not None else one_by_one(on_message)
+
+            await client.call('session_request', {'session_id': session_id}, timeout=RASA_SESSION_TIMEOUT)
+        except BaseException:
+            self._forget(session_id)
+            raise
+
+    async def send(self, session_id: str, text: str, correlation_id: Optional[str] = None) -> None:
+        client = self.clients[self.assignments[session_id]]
+        await client.emit('user_uttered', user_message(text, session_id, correlation_id))
+
+    async def close_session(self, session_id: str) -> None:
+        index = self._forget(session_id)
+
+        client = self.clients[index] if index is not None else None
+        if client is not None and client.connected:
+            await client.emit('session_end', {'session_id': session_id})
+
+    async def close(self) -> None:
+        for i, client in enumerate(self.clients):
+            if client is not None and client.connected:
+                await client.disconnect()
+
+            self.clients[i] = None
+
+    def _forget(self, session_id: str) -> Optional[int]:
+        self.handlers.pop(session_id, None)
+        self.batch_handlers.pop(session_id, None)
+        index = self.assignments.pop(session_id, None)
+
+        if index is not None:
+            self._loads[index] -= 1
+
+        return index
+
+    async def _dispatch(self, data: Dict[str, Any]) -> None:
+        handler = self.handlers.get(data.pop('session_id', None))
+
+        if handler is None:
+            logger.debug('Dropping bot message for unknown session')
+            return
+
+        await handler(data)
+
+    async def _dispatch_batch(self, data: Dict[str, Any]) -> None:
+        handler = self.batch_handlers.get(data.get('session_id'))
+
+        if handler is None:
+            logger.debug('Dropping bot messages for unknown session')
+            return
+
+        await handler(data['messages'])
+
+    def _rejoin_handler(self, index: int) -> Callable[[], Awaitable[None]]:
+        async def rejoin() -> None:
+            # rooms do not survive a reconnect, so the sessions pinned to this connection join them again
+            client = self.clients[index]
+            if client is None:
+                return
+
+            for session_id, assigned in list(self.assignments.items()):
+                if assigned == index:
+                    await client.emit('session_request', {'session_id': session_id})
+
+        return rejoin
+
+
+class PooledUpstream(Upstream):
+    """
+    Session multiplexed over a ``RasaChannelPool``.
+    """
+
+    def __init__(self, pool: RasaChannelPool, session_id: Optional[str] = None):
+        super().__init__(session_id)
+        self.pool = pool
+
+    async def open(self, on_message: BotMessageHandler, on_batch: Optional[BotBatchHandler] = None) -> None:
+        await self.pool.open_session(self.session_id, on_message, on_batch)
+
+    async def send(self, text: str, correlation_id: Optional[str] = None) -> None:
+        await self.pool.send(self.session_id, text, correlation_id)
+
+    async def close(self) -> None:
+        await self.pool.close_session(self.session_id)
+
+
+class RasaRestClient:
+    """
+    Stateless path to Rasa's REST channel over pooled keep-alive HTTP connections.
+    """
+
+    def __init__(self, url: str, client: Optional[httpx.AsyncClient] = None):
+        self.url = url.rstrip('/') + '/webhooks/rest/webhook'
+        self.client = client
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=RASA_REST_TIMEOUT,
+                limits=httpx.Limits(max_connections=RASA_REST_CONNECTIONS,
+                                    max_keepalive_connections=RASA_REST_CONNECTIONS),
+            )
+
+        return self.client
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def send(self, sender: str, text: str) -> List[Dict[str, Any]]:
+        """
+        Sends one user message and returns all bot messages of the turn, shaped like ``bot_uttered`` events.
+        """
+        r = await self._get_client().post(self.url, json={'sender': sender, 'message': text})
+        r.raise_for_status()
+
+        messages = []
+        for message in r.json():
+            if 'custom' in message:
+                messages.append(message['custom'])
+            else:
+                messages.append({key: value for key, value in message.items() if key != 'recipient_id'})
+
+        return messages
@@ -0,0 +1,143 @@
+"""
+Compares DialoGPT inference modes on CPU: load time, per-reply latency and resident memory of each mode
+(measured in a fresh process), plus a parity check of the int8 model against the fp32 one.
+
+Usage:
+    python bench_dialogpt.py --model /app/models/dialogpt-ir-bot --output dialogpt.json [--threads 4]
+"""
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+BASE_PATH = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent.parent
+sys.path.insert(0, str(BASE_PATH))
+
+PROMPTS = [
+    'hi', 'thanks', 'who are you?', 'I love red roses', 'What is the meaning of life?',
+    'Do you like Amsterdam?', 'Tell me a joke', 'I am so tired today', 'What do you do for fun?',
+    'Are you a robot?',
+]
+
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+
+    return 0.0
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def measure_mode(model_path: str, mode: str, runs: int, max_new_tokens: int) -> Dict:
+    from rasa_ai.actions.dialogpt import DialoGPTBatchGenerator, load_dialogpt
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    model, tokenizer = load_dialogpt(model_path, mode=mode, quantized_path=None)
+    load_s = time.perf_counter() - start
+
+    generator = DialoGPTBatchGenerator(model, tokenizer, do_sample=False, max_new_tokens=max_new_tokens)
+    generator(['warm up'])
+
+    latencies = []
+    for _ in range(runs):
+        for prompt in PROMPTS:
+            start = time.perf_counter()
+            generator([prompt])
+            latencies.append(time.perf_counter() - start)
+
+    return {
+        'mode': mode,
+        'load_s': round(load_s, 3),
+        'rss_mb': round(rss_mb(), 1),
+        'model_rss_mb': round(rss_mb() - rss_before, 1),
+        'reply_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'reply_p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'reply_mean_ms': round(sum(latencies) / len(latencies) * 1000, 1),
+    }
+
+
+def parity(model_path: str, max_new_tokens: int) -> Dict:
+    """
+    Next-token agreement and greedy reply agreement of the int8 model with the fp32 reference.
+    """
+    import torch
+
+    from rasa_ai.actions.dialogpt import DialoGPTBatchGenerator, load_dialogpt
+
+    reference, tokenizer = load_dialogpt(model_path, mode='fp32', quantized_path=None)
+    candidate, _ = load_dialogpt(model_path, mode='int8', quantized_path=None)
+
+    top1_matches, max_logit_diff = 0, 0.0
+    for prompt in PROMPTS:
+        input_ids = tokenizer.encode(prompt + tokenizer.eos_token, return_tensors='pt')
+
+        with torch.inference_mode():
+            expected = reference(input_ids).logits[0, -1]
+            actual = candidate(input_ids).logits[0, -1]
+
+        top1_matches += int(expected.argmax() == actual.argmax())
+        max_logit_diff = max(max_logit_diff, float((expected - actual).abs().max()))
+
+    kwargs = dict(do_sample=False, max_new_tokens=max_new_tokens)
+    reference_replies = DialoGPTBatchGenerator(reference, tokenizer, **kwargs)(PROMPTS)
+    candidate_replies = DialoGPTBatchGenerator(candidate, tokenizer, **kwargs)(PROMPTS)
+
+    return {
+        'next_token_top1_agreement': top1_matches / len(PROMPTS),
+        'max_next_token_logit_diff': round(max_logit_diff, 4),
+        'greedy_reply_agreement': sum(a == b for a, b in zip(reference_replies, candidate_replies)) / len(PROMPTS),
+        'samples': [{'prompt': p, 'fp32': a, 'int8': b}
+                    for p, a, b in list(zip(PROMPTS, reference_replies, candidate_replies))[:3]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DialoGPT CPU inference benchmark')
+    parser.add_argument('--model', default='/app/models/dialogpt-ir-bot')
+    parser.add_argument('--modes', nargs='+', default=['fp32', 'int8'], choices=['fp32', 'int8'])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=0, help='torch threads, 0 keeps the default')
+    parser.add_argument('--output', default='dialogpt.json')
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        # measured in a fresh process so resident memory reflects one mode only
+        print(json.dumps(measure_mode(args.model, args.worker, args.runs, args.max_new_tokens)))
+        return
+
+    env = dict(os.environ)
+    if args.threads:
+        env['DIALOGPT_THREADS'] = str(args.threads)
+
+    results = {'model': args.model, 'threads': args.threads, 'modes': []}
+
+    for mode in args.modes:
+        output = subprocess.run([sys.executable, __file__, '--model', args.model, '--worker', mode,
+                                 '--runs', str(args.runs), '--max-new-tokens', str(args.max_new_tokens)],
+                                env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results['modes'].append(json.loads(output.strip().splitlines()[-1]))
+        print(results['modes'][-1])
+
+    if {'fp32', 'int8'} <= set(args.modes):
+        results['parity'] = parity(args.model, args.max_new_tokens)
+        print({key: value for key, value in results['parity'].items() if key != 'samples'})
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
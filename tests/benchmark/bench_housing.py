@@ -0,0 +1,171 @@
+"""
+Latency of the GetHousing search on synthetic ``housing`` tables of growing size.
+
+For every size a table with the production schema is generated, the cities weighted like the scraped data, and the
+same random form submissions are run against each backend:
+
+- ``legacy``: the former ``SELECT *`` with a dict per row, fetching every match
+- ``sqlite``: ``HousingStore``, count plus one page from ``ix_housing_search``
+- ``columnar``: ``ColumnarHousingStore`` loaded from the same table, count plus one page from NumPy columns
+
+Usage:
+    python bench_housing.py --sizes 100000 1000000 3000000 --queries 500 --output housing.json
+"""
+import argparse
+import json
+import os
+import pathlib
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+BASE_PATH = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent.parent
+sys.path.insert(0, str(BASE_PATH))
+
+from rasa_ai.actions.columnar import ColumnarHousingStore  # noqa: E402
+from rasa_ai.actions.housing import HousingQuery, HousingStore  # noqa: E402
+from scraper.schema import build_indexes  # noqa: E402
+
+CITIES = {'Amsterdam': 1012, 'Rotterdam': 618, 'Eindhoven': 238, 'Utrecht': 215, 'Haarlem': 173, 'Groningen': 120,
+          'Leiden': 110, 'Breda': 100, 'Maastricht': 90, 'Amstelveen': 80, 'Arnhem': 70, 'Almere': 60, 'Delft': 60,
+          'Tilburg': 50, 'Hilversum': 40, 'Zwolle': 40, 'Enschede': 30, 'Amersfoort': 30, 'Zaandam': 30,
+          'Heerlen': 20, 'Dordrecht': 20, 'Apeldoorn': 20, 'Bussum': 20, 'Nijmegen': 20, 'Roermond': 10,
+          'Deventer': 10, 'Leeuwarden': 10, 'Alkmaar': 10}
+
+SCHEMA = '''CREATE TABLE housing ("index" BIGINT, title TEXT, link TEXT, price BIGINT, location TEXT, area BIGINT,
+                                  rooms BIGINT, interior TEXT, city TEXT, image TEXT)'''
+
+
+def generate_database(path: str, size: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    cities, weights = list(CITIES), list(CITIES.values())
+
+    def rows():
+        for i in range(size):
+            city = rng.choices(cities, weights)[0]
+            rooms = rng.randint(1, 6)
+            yield (i, f'Apartment {i}', f'https://pararius.com/apartment-for-rent/{city.lower()}/{i:08x}',
+                   rng.randint(500, 5000), f'{rng.randint(1000, 9999)} AB {city}', rng.randint(15, 40) * rooms,
+                   rooms, rng.choice(['Upholstered', 'Furnished', 'Shell']), city, None)
+
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.execute('CREATE INDEX ix_housing_index ON housing ("index")')
+    conn.executemany('INSERT INTO housing VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows())
+    conn.commit()
+    conn.close()
+
+
+def random_queries(count: int, seed: int = 1) -> List[HousingQuery]:
+    rng = random.Random(seed)
+    queries = []
+
+    for _ in range(count):
+        min_price = rng.randint(5, 30) * 100
+        queries.append(HousingQuery(rng.choice(list(CITIES)), min_price, min_price + rng.randint(2, 20) * 100,
+                                    rng.randint(1, 4), rng.randint(2, 12) * 10))
+
+    return queries
+
+
+def legacy_backend(path: str) -> Callable[[HousingQuery], int]:
+    conn = sqlite3.connect(path)
+    conn.row_factory = lambda cursor, row: {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+    def search(query: HousingQuery) -> int:
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM housing WHERE city = ? AND price >= ? AND price <= ? AND rooms >= ? AND area >= ?',
+                    (query.city, query.min_price, query.max_price, query.min_rooms, query.min_area))
+        rows = cur.fetchall()
+        cur.close()
+
+        return len(rows)
+
+    return search
+
+
+def sqlite_backend(path: str) -> Callable[[HousingQuery], int]:
+    conn = sqlite3.connect(path)
+    build_indexes(conn)
+    conn.close()
+
+    store = HousingStore.open(path)
+
+    return lambda query: store.search(query).total
+
+
+def columnar_backend(path: str) -> Callable[[HousingQuery], int]:
+    start = time.perf_counter()
+    store = ColumnarHousingStore.from_sqlite(path, reload_interval=float('inf'))
+    print(f'columnar store loaded in {time.perf_counter() - start:.1f}s')
+
+    return lambda query: store.search(query).total
+
+
+BACKENDS: Dict[str, Callable[[str], Callable[[HousingQuery], int]]] = {
+    'legacy': legacy_backend,
+    'sqlite': sqlite_backend,
+    'columnar': columnar_backend,
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def measure(search: Callable[[HousingQuery], int], queries: List[HousingQuery]) -> Dict:
+    search(queries[0])
+
+    latencies, totals = [], []
+    start = time.perf_counter()
+
+    for query in queries:
+        query_start = time.perf_counter()
+        totals.append(search(query))
+        latencies.append(time.perf_counter() - query_start)
+
+    duration = time.perf_counter() - start
+
+    return {
+        'qps': round(len(queries) / duration, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_matches': round(sum(totals) / len(totals), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GetHousing search benchmark on synthetic data')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100000, 1000000])
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--output', default='housing.json')
+    args = parser.parse_args()
+
+    queries = random_queries(args.queries)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            path = os.path.join(directory, f'housing_{size}.db')
+
+            start = time.perf_counter()
+            generate_database(path, size)
+            print(f'{size} listings generated in {time.perf_counter() - start:.1f}s')
+
+            for name in args.backends:
+                result = dict(measure(BACKENDS[name](path), queries), backend=name, size=size)
+                results.append(result)
+                print(result)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
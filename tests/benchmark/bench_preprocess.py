@@ -0,0 +1,289 @@
+"""
+Wall-clock time and peak memory of building the DialoGPT training conversations.
+
+Each run is a fresh process, so its peak resident memory is its own:
+
+- ``legacy``: the code of ``load.ipynb``, a recursive depth-first search per customer thread and a row-by-row merge
+  per Ubuntu dialogue, pickled
+- ``vectorized``: ``text-generative-model/preprocess.py``, written as parquet shards
+
+Without ``--twitter``/``--ubuntu`` the corpora are generated with the shape of the real ones: the Twitter customer
+support corpus has 2.8M tweets, ``dialogueText_301.csv`` about 1M rows. The legacy Ubuntu merge scans the whole
+table once per dialogue, so it only runs up to ``--legacy-max-rows``.
+
+Usage:
+    python bench_preprocess.py --tweets 200000 2811774 --ubuntu-rows 200000 1000000 --output preprocess.json
+    python bench_preprocess.py --twitter twcs.csv --ubuntu Ubuntu-dialogue-corpus --output preprocess.json
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import pathlib
+import pickle
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+BASE_PATH = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent.parent
+sys.path.insert(0, str(BASE_PATH / 'text-generative-model'))
+
+import preprocess  # noqa: E402
+
+WORDS = ['my', 'phone', 'internet', 'is', 'not', 'working', 'please', 'help', 'we', 'are', 'sorry', 'to', 'hear',
+         'that', 'can', 'you', 'send', 'us', 'a', 'dm', 'thanks', 'apt-get', 'install', 'kernel', 'grub', 'sudo']
+
+
+def sentence(rng: random.Random) -> str:
+    return ' '.join(rng.choices(WORDS, k=rng.randint(4, 20)))
+
+
+def generate_twitter(path: str, size: int, seed: int = 0) -> None:
+    """
+    Support threads started by customers, and a few by companies, of 1 to 8 tweets; some tweets get two replies.
+    """
+    rng = random.Random(seed)
+    tweets = []
+
+    while len(tweets) < size:
+        inbound = rng.random() < 0.9
+        parent = None
+
+        for turn in range(rng.choice([1, 2, 3, 4, 4, 5, 6, 8])):
+            tweet = {'tweet_id': len(tweets) + 1, 'author_id': '115712' if inbound else 'sprintcare',
+                     'inbound': inbound, 'created_at': 'Tue Oct 31 22:10:47 +0000 2017',
+                     'text': f'@{"sprintcare" if inbound else "115712"} {sentence(rng)}', 'replies': [],
+                     'in_response_to_tweet_id': parent['tweet_id'] if parent is not None else ''}
+            tweets.append(tweet)
+
+            if parent is not None:
+                parent['replies'].append(tweet['tweet_id'])
+                # a second, unanswered reply
+                if rng.random() < 0.1:
+                    branch = dict(tweet, tweet_id=len(tweets) + 1, replies=[])
+                    tweets.append(branch)
+                    parent['replies'].append(branch['tweet_id'])
+
+            parent, inbound = tweet, not inbound
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['tweet_id', 'author_id', 'inbound', 'created_at', 'text', 'response_tweet_id',
+                         'in_response_to_tweet_id'])
+
+        for tweet in tweets:
+            writer.writerow([tweet['tweet_id'], tweet['author_id'], tweet['inbound'], tweet['created_at'],
+                             tweet['text'], ','.join(map(str, tweet['replies'])), tweet['in_response_to_tweet_id']])
+
+
+def generate_ubuntu(directory: str, size: int, seed: int = 0) -> None:
+    """
+    Dialogues of 2 to 20 turns between two users, a turn being 1 to 3 messages.
+    """
+    rng = random.Random(seed)
+    rows = 0
+
+    with open(os.path.join(directory, 'dialogueText_301.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['folder', 'dialogueID', 'date', 'from', 'to', 'text'])
+
+        dialogue = 0
+        while rows < size:
+            dialogue += 1
+            users = [f'user{rng.randint(0, 5000)}', f'user{rng.randint(0, 5000)}']
+
+            for turn in range(rng.randint(2, 20)):
+                sender, recipient = users[turn % 2], users[(turn + 1) % 2]
+
+                for message in range(rng.randint(1, 3)):
+                    writer.writerow([301, f'{dialogue}.tsv', f'2010-01-01T00:{turn:02d}:{message:02d}.000Z', sender,
+                                     recipient if turn else '', sentence(rng)])
+                    rows += 1
+
+
+def legacy_twitter(path: str, output: str) -> int:
+    twitter = pd.read_csv(path)
+    twitter = twitter.astype({'in_response_to_tweet_id': 'object', 'response_tweet_id': 'object'})
+    twitter.drop(columns=['created_at'], inplace=True)
+    twitter['text'] = twitter['text'].apply(
+        lambda text: re.sub(r'([^A-Za-z0-9]+@[A-Za-z0-9_]+)|(^@[A-Za-z0-9_]+)', '', text))
+    twitter['text'] = twitter['text'].apply(lambda text: text.strip())
+    twitter = twitter.set_index('tweet_id')
+
+    twitter_dict = twitter.to_dict('index')
+
+    graph, starts = {}, []
+    for idx, values in twitter_dict.items():
+        graph[idx] = ([int(i) for i in str(values['response_tweet_id']).split(',')]
+                      if not pd.isna(values['response_tweet_id']) else [])
+        if values['inbound'] and pd.isna(values['in_response_to_tweet_id']):
+            starts.append(idx)
+
+    conversations_ids = []
+    for start_id in starts:
+        visited_list = []
+
+        def depth_first(current, visited):
+            visited.append(current)
+            if current in graph:
+                for vertex in graph[current]:
+                    if vertex not in visited:
+                        depth_first(vertex, visited.copy())
+                visited_list.append(visited)
+
+        depth_first(start_id, [])
+        conversations_ids.extend([path for path in visited_list if len(path) > 1])
+
+    conversations = [[twitter_dict[idx]['text'].strip() for idx in ids] for ids in conversations_ids]
+    conversations = [c for c in conversations if len(c) == 4]
+
+    with open(os.path.join(output, 'twitter_data.pickle'), 'wb') as f:
+        pickle.dump(conversations, f)
+
+    return len(conversations)
+
+
+def legacy_ubuntu(directory: str, output: str) -> int:
+    ubuntu = pd.concat([pd.read_csv(path) for path in sorted(glob.glob(os.path.join(directory, 'dialogueText*.csv')))])
+    ubuntu = ubuntu.sort_values(['dialogueID', 'date'], ignore_index=True)
+    ubuntu['to'] = ubuntu['to'].replace({np.nan: ''})
+
+    def merge(d):
+        texts = []
+        _temp = d['text'][0]
+        last_from = d['from'][0]
+        last_to = d['to'][0]
+
+        for i in range(1, len(d['text'])):
+            if last_from == d['from'][i] and last_to == d['to'][i]:
+                _temp += ' ' + str(d['text'][i])
+            else:
+                last_from = d['from'][i]
+                last_to = d['to'][i]
+                texts.append(_temp)
+                _temp = str(d['text'][i])
+
+        return texts
+
+    total = []
+    for dialogue in ubuntu['dialogueID'].unique():
+        ubuntu_sub = ubuntu[ubuntu['dialogueID'] == dialogue]
+        total.append(merge({'text': ubuntu_sub['text'].tolist(), 'from': ubuntu_sub['from'].tolist(),
+                            'to': ubuntu_sub['to'].tolist()}))
+
+    total = [t[i:i + 4] for t in total for i in range(0, len(t), 4) if len(t[i:i + 4]) == 4]
+
+    with open(os.path.join(output, 'ubuntu_data.pickle'), 'wb') as f:
+        pickle.dump(total, f)
+
+    return len(total)
+
+
+def vectorized_twitter(path: str, output: str) -> int:
+    paths = preprocess.write_shards([preprocess.twitter_conversations(path)], output)
+    return sum(pd.read_parquet(path, columns=['response']).shape[0] for path in paths)
+
+
+def vectorized_ubuntu(directory: str, output: str) -> int:
+    csv_paths = sorted(glob.glob(os.path.join(directory, 'dialogueText*.csv')))
+    paths = preprocess.write_shards(preprocess.ubuntu_conversations(csv_paths), output)
+    return sum(pd.read_parquet(path, columns=['response']).shape[0] for path in paths)
+
+
+PIPELINES: Dict[str, Dict[str, Callable[[str, str], int]]] = {
+    'twitter': {'legacy': legacy_twitter, 'vectorized': vectorized_twitter},
+    'ubuntu': {'legacy': legacy_ubuntu, 'vectorized': vectorized_ubuntu},
+}
+
+
+def peak_rss_mb() -> float:
+    # the high-water mark of this process's own memory, ru_maxrss is inherited from the parent on Linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(corpus: str, pipeline: str, path: str) -> Dict:
+    baseline = peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as output:
+        start = time.perf_counter()
+        conversations = PIPELINES[corpus][pipeline](path, output)
+        duration = time.perf_counter() - start
+
+    return {
+        'seconds': round(duration, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'baseline_rss_mb': round(baseline, 1),
+        'conversations': conversations,
+    }
+
+
+def measure(corpus: str, pipeline: str, path: str) -> Dict:
+    # a new process per run, so that the peak memory of one run does not carry over to the next
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run, corpus, pipeline, path).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DialoGPT corpus preprocessing benchmark')
+    parser.add_argument('--twitter', default=None, help='twcs.csv, instead of generated tweets')
+    parser.add_argument('--ubuntu', default=None, help='directory with dialogueText*.csv, instead of generated rows')
+    parser.add_argument('--tweets', nargs='+', type=int, default=[200000, 1000000])
+    parser.add_argument('--ubuntu-rows', nargs='+', type=int, default=[200000, 1000000])
+    parser.add_argument('--legacy-max-rows', type=int, default=200000)
+    parser.add_argument('--output', default='preprocess.json')
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+
+    def bench(corpus: str, path: str, size) -> None:
+        for pipeline in PIPELINES[corpus]:
+            if pipeline == 'legacy' and corpus == 'ubuntu' and size is not None and size > args.legacy_max_rows:
+                continue
+
+            result = dict(measure(corpus, pipeline, path), corpus=corpus, pipeline=pipeline, size=size)
+            results.append(result)
+            print(result)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.twitter is not None:
+            bench('twitter', args.twitter, None)
+        else:
+            for size in args.tweets:
+                path = os.path.join(directory, f'twcs_{size}.csv')
+                generate_twitter(path, size)
+                bench('twitter', path, size)
+
+        if args.ubuntu is not None:
+            bench('ubuntu', args.ubuntu, None)
+        else:
+            for size in args.ubuntu_rows:
+                path = os.path.join(directory, f'ubuntu_{size}')
+                os.mkdir(path)
+                generate_ubuntu(path, size)
+                bench('ubuntu', path, size)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
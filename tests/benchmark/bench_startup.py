@@ -0,0 +1,111 @@
+"""
+Cold start and memory of the action server's DialoGPT loading.
+
+Starts ``--workers`` processes at once, each constructing ``GenerateText`` like the action server does, and
+reports per process the time until the actions can be served, the time until the model is ready, and resident
+(RSS) and proportional (PSS) memory once all of them have loaded. PSS splits shared pages between the processes
+mapping them, so memory-mapped weights show up as a drop in total PSS. Runs with and without ``DIALOGPT_MMAP``.
+
+Before lazy loading the actions were only served once the model was ready, so ``ready_s`` is the old cold start.
+
+Usage:
+    python bench_startup.py --model /app/models/dialogpt-ir-bot --workers 4 --output startup.json
+"""
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+BASE_PATH = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent.parent
+
+
+def memory_mb() -> Dict[str, float]:
+    memory = {}
+
+    for path, key in (('/proc/self/status', 'VmRSS:'), ('/proc/self/smaps_rollup', 'Pss:')):
+        with open(path) as f:
+            for line in f:
+                if line.startswith(key):
+                    memory[key.rstrip(':').lower()] = int(line.split()[1]) / 1024
+                    break
+
+    return {'rss_mb': round(memory.get('vmrss', 0.0), 1), 'pss_mb': round(memory.get('pss', 0.0), 1)}
+
+
+def run_worker(spawned_at: float) -> None:
+    sys.path.insert(0, str(BASE_PATH))
+
+    from rasa_ai.actions.actions import GenerateText
+
+    action = GenerateText()
+    serving_s = time.time() - spawned_at
+
+    generator = action.loader.get()
+    ready_s = time.time() - spawned_at
+
+    generator(['hi'])
+
+    print(json.dumps({'serving_s': round(serving_s, 3), 'ready_s': round(ready_s, 3)}), flush=True)
+
+    # memory is read once every worker has loaded, so shared pages are split between all of them
+    sys.stdin.readline()
+    print(json.dumps(memory_mb()), flush=True)
+
+
+def run_workers(model: str, workers: int, mmap: bool) -> Dict:
+    env = dict(os.environ, DIALOGPT_MODEL=model, DIALOGPT_MMAP='1' if mmap else '0', DIALOGPT_MODE='fp32')
+
+    processes = [subprocess.Popen([sys.executable, __file__, '--worker', str(time.time())], env=env,
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+                 for _ in range(workers)]
+
+    results: List[Dict] = [json.loads(process.stdout.readline()) for process in processes]
+
+    for process in processes:
+        process.stdin.write('\n')
+        process.stdin.flush()
+
+    for process, result in zip(processes, results):
+        result.update(json.loads(process.stdout.readline()))
+        process.stdin.close()
+        process.wait()
+
+    return {
+        'mmap': mmap,
+        'workers': results,
+        'serving_s': round(max(result['serving_s'] for result in results), 3),
+        'ready_s': round(max(result['ready_s'] for result in results), 3),
+        'rss_mb_per_worker': round(sum(result['rss_mb'] for result in results) / workers, 1),
+        'pss_mb_total': round(sum(result['pss_mb'] for result in results), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Action server startup benchmark')
+    parser.add_argument('--model', default='/app/models/dialogpt-ir-bot')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', default='startup.json')
+    parser.add_argument('--worker', type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run_worker(args.worker)
+        return
+
+    results = {'model': args.model, 'runs': []}
+
+    for mmap in (False, True):
+        run = run_workers(args.model, args.workers, mmap)
+        results['runs'].append(run)
+        print({key: value for key, value in run.items() if key != 'workers'})
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Load generator for the /ws pipeline: opens N concurrent websocket sessions, replays the scripted
+conversations from ``conversations.py`` and reports throughput and per-turn latency percentiles.
+
+By default a Rasa stand-in (``fake_rasa.py``) and an orchestrator with the identity translator are started
+locally so results are reproducible offline. Pass ``--url`` to benchmark a running orchestrator instead.
+
+Usage:
+    python bench_websocket.py --sessions 200 --output results.json [--baseline previous.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import websockets
+
+from conversations import CONVERSATIONS
+
+BENCHMARK_PATH = pathlib.Path(os.path.dirname(os.path.realpath(__file__)))
+BASE_PATH = BENCHMARK_PATH.parent.parent
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+
+    return ordered[index]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+async def run_session(url: str, conversations: List[str], repeat: int, timeout: float,
+                      latencies: Dict[str, List[float]], frames: List[int], errors: List[str]) -> None:
+    try:
+        async with websockets.connect(url, max_size=None) as websocket:
+            status = json.loads(await asyncio.wait_for(websocket.recv(), timeout))
+            if status.get('status') != 'Connected':
+                errors.append(f'unexpected status {status}')
+                return
+
+            for _ in range(repeat):
+                for name in conversations:
+                    for message, replies in CONVERSATIONS[name]:
+                        start = time.perf_counter()
+                        await websocket.send(json.dumps({'message': message, 'lang': 'en'}))
+
+                        received = turn_frames = 0
+                        while received < len(replies):
+                            data = json.loads(await asyncio.wait_for(websocket.recv(), timeout))
+                            # a batched turn arrives as one frame holding all of its messages
+                            received += len(data['messages']) if 'messages' in data else 1
+                            turn_frames += 1
+
+                        latencies[name].append(time.perf_counter() - start)
+                        frames.append(turn_frames)
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+        errors.append(repr(e))
+
+
+async def run_benchmark(url: str, sessions: int, conversations: List[str], repeat: int, timeout: float,
+                        ramp_up: float) -> Dict:
+    latencies = {name: [] for name in conversations}
+    frames: List[int] = []
+    errors = []
+
+    async def delayed(i):
+        await asyncio.sleep(ramp_up * i / sessions)
+        await run_session(url, conversations, repeat, timeout, latencies, frames, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(delayed(i) for i in range(sessions)))
+    duration = time.perf_counter() - start
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+
+    return {
+        'sessions': sessions,
+        'conversations': conversations,
+        'repeat': repeat,
+        'duration_s': round(duration, 3),
+        'turns': len(all_latencies),
+        'errors': len(errors),
+        'error_samples': errors[:10],
+        'throughput_turns_per_s': round(len(all_latencies) / duration, 3) if duration else 0.0,
+        'frames_per_turn': round(sum(frames) / len(frames), 3) if frames else 0.0,
+        'latency': summarize(all_latencies),
+        'per_conversation': {name: summarize(values) for name, values in latencies.items()},
+    }
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+
+    raise TimeoutError(f'Nothing is listening on port {port}')
+
+
+def spawn_stack(rasa_port: int, server_port: int, generation_delay: float, upstream: str,
+                batch: bool = False) -> List[subprocess.Popen]:
+    rasa = subprocess.Popen([sys.executable, str(BENCHMARK_PATH / 'fake_rasa.py'), '--port', str(rasa_port),
+                             '--generation-delay', str(generation_delay)] + (['--batch'] if batch else []),
+                            cwd=str(BENCHMARK_PATH))
+
+    env = dict(os.environ, RASA_HOST='127.0.0.1', RASA_PORT=str(rasa_port), RASA_UPSTREAM=upstream,
+               TRANSLATOR_BACKEND='identity', MAX_CONNECTIONS='1000000')
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'server.main:app', '--port', str(server_port),
+                               '--log-level', 'warning'], cwd=str(BASE_PATH), env=env)
+
+    wait_for_port(rasa_port)
+    wait_for_port(server_port)
+
+    return [rasa, server]
+
+
+def compare(results: Dict, baseline: Dict) -> None:
+    print('metric                     baseline      current     change')
+    rows = [('throughput_turns_per_s', baseline['throughput_turns_per_s'], results['throughput_turns_per_s'])]
+    rows += [(f'latency.{key}', baseline['latency'][key], results['latency'][key])
+             for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+
+    for name, before, after in rows:
+        change = (after - before) / before * 100 if before else 0.0
+        print(f'{name:<25} {before:>10.3f} {after:>12.3f} {change:>+9.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Websocket pipeline load generator')
+    parser.add_argument('--url', default=None, help='orchestrator websocket url, spawns a local stack if omitted')
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=1, help='times each session replays its conversations')
+    parser.add_argument('--conversations', nargs='+', default=list(CONVERSATIONS), choices=list(CONVERSATIONS))
+    parser.add_argument('--ramp-up', type=float, default=1.0, help='seconds over which sessions are opened')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--rasa-port', type=int, default=5015)
+    parser.add_argument('--server-port', type=int, default=8010)
+    parser.add_argument('--upstream', default='pool', choices=['pool', 'connection'])
+    parser.add_argument('--generation-delay', type=float, default=0.0)
+    parser.add_argument('--batch', action='store_true', help='Rasa stand-in sends the replies of a turn batched')
+    parser.add_argument('--output', default='results.json')
+    parser.add_argument('--baseline', default=None, help='previous results to compare against')
+    args = parser.parse_args()
+
+    processes = []
+    url = args.url
+
+    if url is None:
+        processes = spawn_stack(args.rasa_port, args.server_port, args.generation_delay, args.upstream, args.batch)
+        url = f'ws://127.0.0.1:{args.server_port}/ws'
+
+    try:
+        results = asyncio.run(
+            run_benchmark(url, args.sessions, args.conversations, args.repeat, args.timeout, args.ramp_up)
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    results['config'] = {'url': url, 'upstream': args.upstream if args.url is None else None,
+                         'generation_delay': args.generation_delay, 'batch': args.batch if args.url is None else None}
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(json.dumps(results['latency'], indent=2))
+    print(f"{results['turns']} turns in {results['duration_s']} s "
+          f"({results['throughput_turns_per_s']} turns/s, {results['frames_per_turn']} frames/turn), "
+          f"{results['errors']} errors")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Scripted conversations replayed by the benchmark, together with the canned replies the Rasa stand-in sends.
+Each turn is a user message and the bot messages that answer it.
+"""
+from typing import Dict, List, Tuple
+
+Turn = Tuple[str, List[Dict]]
+
+
+def _listing(i: int) -> Dict:
+    return {
+        'title': f'Apartment Benchmarkstraat {i}',
+        'text': f'Price: € {1000 + i * 50}\nArea: {40 + i} m2\nRooms: 2\nInterior: Upholstered\nLocation: Delft',
+        'link': f'https://pararius.com/apartment-for-rent/delft/{i:08x}/benchmarkstraat',
+        'image': f'https://casco.cmcdn.com/benchmark/{i}.jpg',
+    }
+
+
+GREETING: List[Turn] = [
+    ('Hello', [{'text': 'Hey! I am a bot that will help you choose your future housing!'}]),
+]
+
+HOUSING_FORM: List[Turn] = [
+    ('I want to choose housing', [{'text': 'I will ask you some questions to find the best housing.'},
+                                  {'text': 'In which city are you looking?'}]),
+    ('Delft', [{'text': 'What is your minimal price?'}]),
+    ('800', [{'text': 'What is your maximal price?'}]),
+    ('1500', [{'text': 'What is the minimal area in square meters?'}]),
+    ('40', [{'text': 'How many rooms do you need at least?'}]),
+    ('2', [{'text': 'Found 12 properties, showing first 10'}] + [_listing(i) for i in range(10)]),
+]
+
+OUT_OF_SCOPE: List[Turn] = [
+    ('I love red roses', [{'text': 'Roses are nice, but have you seen the tulips in Amsterdam?'}]),
+    ('What is the meaning of life?', [{'text': 'Finding an apartment with a balcony, obviously.'}]),
+]
+
+CONVERSATIONS: Dict[str, List[Turn]] = {
+    'greeting': GREETING,
+    'housing_form': HOUSING_FORM,
+    'out_of_scope': OUT_OF_SCOPE,
+}
+
+# user messages that are answered by DialoGPT, the stand-in delays them to simulate generation
+GENERATED = {message for message, _ in OUT_OF_SCOPE}
+
+REPLIES: Dict[str, List[Dict]] = {message: replies for turns in CONVERSATIONS.values() for message, replies in turns}
@@ -0,0 +1,71 @@
+"""
+Stand-in for the Rasa server: speaks the custom socket.io channel protocol (session persistence, replies
+tagged with ``session_id``) and answers with the canned replies from ``conversations.py``.
+
+Usage:
+    python fake_rasa.py [--port 5005] [--generation-delay 0.5] [--batch]
+"""
+import argparse
+import asyncio
+import inspect
+
+import socketio
+import uvicorn
+
+from conversations import GENERATED, REPLIES
+
+FALLBACK_REPLY = [{'text': 'Sorry, I did not get that.'}]
+
+
+async def _maybe_await(result):
+    # room helpers are coroutines only in newer python-socketio releases
+    if inspect.isawaitable(result):
+        await result
+
+
+def create_app(generation_delay: float = 0.0, batch: bool = False) -> socketio.ASGIApp:
+    sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins=[])
+
+    @sio.on('session_request')
+    async def session_request(sid, data):
+        await _maybe_await(sio.enter_room(sid, data['session_id']))
+        await sio.emit('session_confirm', data['session_id'], room=sid)
+
+    @sio.on('session_end')
+    async def session_end(sid, data):
+        await _maybe_await(sio.leave_room(sid, data['session_id']))
+
+    @sio.on('user_uttered')
+    async def user_uttered(sid, data):
+        session_id = data['session_id']
+
+        if data['message'] in GENERATED and generation_delay:
+            await asyncio.sleep(generation_delay)
+
+        replies = REPLIES.get(data['message'], FALLBACK_REPLY)
+
+        if batch:
+            # the channel's batch_messages mode
+            await sio.emit('bot_uttered_batch', {'messages': replies, 'session_id': session_id}, room=session_id)
+            return
+
+        for reply in replies:
+            await sio.emit('bot_uttered', {**reply, 'session_id': session_id}, room=session_id)
+
+    return socketio.ASGIApp(sio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rasa socket.io stand-in for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--generation-delay', type=float, default=0.0,
+                        help='seconds to wait before answering out-of-scope messages')
+    parser.add_argument('--batch', action='store_true', help='send the replies of a turn as one batch event')
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.generation_delay, args.batch), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import json
+import uuid
 
 import pytest
 import socketio
@@ -48,16 +49,20 @@ def test_rasa_to_actions_dialogpt():
 
     client.connect(RASA_SERVER_URL)
 
+    # the channel tracks conversations by session id and tags replies with it
+    session_id = uuid.uuid4().hex
+    client.call('session_request', {'session_id': session_id})
+
     def bot_uttered(data):
-        assert len(data) == 1
-        assert 'text' in data
+        assert set(data) == {'text', 'session_id'}
+        assert data['session_id'] == session_id
         assert isinstance(data['text'], str)
 
         client.disconnect()
 
     client.on('bot_uttered', bot_uttered)
 
-    client.emit('user_uttered', data={'message': 'I love red roses'})
+    client.emit('user_uttered', data={'message': 'I love red roses', 'session_id': session_id})
 
 
 def test_rasa_to_actions_forms():
@@ -65,18 +70,22 @@ def test_rasa_to_actions_forms():
 
     client.connect(RASA_SERVER_URL)
 
+    # the channel tracks conversations by session id and tags replies with it
+    session_id = uuid.uuid4().hex
+    client.call('session_request', {'session_id': session_id})
+
     responses = []
 
     def bot_uttered(data):
-        assert len(data) == 1
-        assert 'text' in data
+        assert set(data) == {'text', 'session_id'}
+        assert data['session_id'] == session_id
         assert isinstance(data['text'], str)
 
         responses.append(data['text'])
 
     client.on('bot_uttered', bot_uttered)
 
-    client.emit('user_uttered', data={'message': 'I want to choose housing'})
+    client.emit('user_uttered', data={'message': 'I want to choose housing', 'session_id': session_id})
 
     client.sleep(5) # FIX HARDCODE
 
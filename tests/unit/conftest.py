@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from scraper.schema import build_indexes
+
+
+@pytest.fixture(scope='session')
+def tiny_dialogpt():
+    """
+    Randomly initialised GPT-2 with a word-level tokenizer, small enough to generate with in unit tests.
+    """
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    words = ['<|endoftext|>', '[UNK]', 'hi', 'hello', 'thanks', 'who', 'are', 'you', 'i', 'love', 'red', 'roses',
+             'the', 'a', 'house', 'in', 'amsterdam', 'is', 'nice', 'what', 'do', 'like', '?', '!', '.']
+    tokenizer = Tokenizer(models.WordLevel({word: i for i, word in enumerate(words)}, unk_token='[UNK]'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token='<|endoftext|>', unk_token='[UNK]')
+
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=len(words), n_positions=128, n_embd=32, n_layer=2, n_head=2,
+                                       bos_token_id=0, eos_token_id=0))
+    model.eval()
+
+    return model, tokenizer
+
+
+SCHEMA = '''CREATE TABLE housing ("index" BIGINT, title TEXT, link TEXT, price BIGINT, location TEXT, area BIGINT,
+                                  rooms BIGINT, interior TEXT, city TEXT, image TEXT)'''
+
+
+@pytest.fixture
+def housing_db(tmp_path):
+    path = str(tmp_path / 'housing.db')
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.executemany('INSERT INTO housing VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        (i, f'Apartment {i}', f'https://pararius.com/{i}', 800 + 50 * i, f'{city} centre', 30 + 5 * i, 1 + i % 4,
+         'Upholstered', city, None)
+        for i, city in enumerate(['Amsterdam', 'Utrecht'] * 20)
+    ])
+    build_indexes(conn)
+    conn.close()
+
+    return path
@@ -1,13 +1,22 @@
+import json
+import threading
+import urllib.error
+import urllib.request
 from unittest.mock import Mock, MagicMock
 
 import pytest
 
 from rasa_ai.actions.actions import GenerateText, GetHousing, ValidateHousingForm
+from rasa_ai.actions.dialogpt import DialoGPTBatchGenerator
+from rasa_ai.actions.inference import ModelLoadError, ModelLoader
+from rasa_ai.actions.response_cache import ResponseCache
+from rasa_ai.actions.tracing import STAGE_LATENCY, get_correlation_id, register_readiness, span, start_metrics_server
 
 
 @pytest.mark.asyncio
 async def test_generate_text():
     generate_text = GenerateText()
+    generate_text.loader.get()
 
     mock_dispatcher = Mock()
     mock_tracker = Mock()
@@ -22,6 +31,119 @@ async def test_generate_text():
     assert run == []
 
 
+@pytest.mark.asyncio
+async def test_generate_text_while_loading(monkeypatch, tiny_dialogpt):
+    release = threading.Event()
+
+    def load_generator():
+        release.wait()
+        return DialoGPTBatchGenerator(*tiny_dialogpt, max_new_tokens=8, min_length=4)
+
+    monkeypatch.setattr(GenerateText, 'load_generator', staticmethod(load_generator))
+    generate_text = GenerateText()
+
+    tracker = Mock()
+    tracker.latest_message = {'text': 'i love red roses'}
+
+    # the action is constructed without waiting for the model and answers right away
+    dispatcher = Mock()
+    await generate_text.run(dispatcher, tracker, {})
+    dispatcher.utter_message.assert_called_once_with(text='I am still waking up, give me a moment and try again.')
+
+    release.set()
+    generate_text.loader.get(timeout=5)
+
+    dispatcher = Mock()
+    await generate_text.run(dispatcher, tracker, {})
+    dispatcher.utter_message.assert_called_once()
+    assert 'waking up' not in dispatcher.utter_message.call_args.kwargs['text']
+
+
+@pytest.mark.asyncio
+async def test_generate_text_load_failed(monkeypatch):
+    def load_generator():
+        raise OSError('no weights')
+
+    monkeypatch.setattr(GenerateText, 'load_generator', staticmethod(load_generator))
+    generate_text = GenerateText()
+    generate_text.loader = ModelLoader(load_generator, retries=0).start()
+
+    with pytest.raises(ModelLoadError):
+        generate_text.loader.get(timeout=5)
+
+    tracker = Mock()
+    tracker.latest_message = {'text': 'i love red roses'}
+    dispatcher = Mock()
+    await generate_text.run(dispatcher, tracker, {})
+
+    # a clear answer instead of waking up forever
+    dispatcher.utter_message.assert_called_once_with(
+        text='Sorry, I cannot chat right now, but I can still help you find a home.')
+
+
+@pytest.mark.asyncio
+async def test_generate_text_cached(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(GenerateText, 'load_generator', staticmethod(release.wait))
+
+    generate_text = GenerateText()
+    generate_text.cache = ResponseCache(maxsize=10, pool_size=2)
+    generate_text.cache.add('hi', 'Hello!')
+    generate_text.cache.add('hi', 'Hey there')
+
+    tracker = Mock()
+    tracker.latest_message = {'text': 'Hi!'}
+    dispatcher = Mock()
+
+    # pre-generated replies are served even before the model is loaded
+    await generate_text.run(dispatcher, tracker, {})
+
+    assert dispatcher.utter_message.call_args.kwargs['text'] in ('Hello!', 'Hey there')
+    release.set()
+
+
+@pytest.mark.asyncio
+async def test_generate_text_cache_skips_conversations(monkeypatch):
+    class Generator:
+        # replies to a sender with history are shaped by it
+        def __init__(self):
+            self.senders = {'alice'}
+
+        def has_history(self, sender_id):
+            return sender_id in self.senders
+
+        def remember(self, sender_id, texts):
+            self.senders.add(sender_id)
+
+        def __call__(self, texts, sender_ids=None, **kwargs):
+            self.senders.update(sender_ids)
+            return [f'Hi {sender_id}' for sender_id in sender_ids]
+
+    monkeypatch.setattr(GenerateText, 'load_generator', staticmethod(Generator))
+
+    generate_text = GenerateText()
+    generate_text.cache = ResponseCache(maxsize=10, pool_size=1)
+    generate_text.loader.get(timeout=5)
+
+    async def reply(sender_id):
+        tracker = Mock()
+        tracker.sender_id = sender_id
+        tracker.latest_message = {'text': 'hi'}
+        dispatcher = Mock()
+
+        await generate_text.run(dispatcher, tracker, {})
+        return dispatcher.utter_message.call_args.kwargs['text']
+
+    # a reply within a conversation is not shared with other users
+    assert await reply('alice') == 'Hi alice'
+    assert generate_text.cache.get('hi') is None
+
+    # an opening message is, and the cached reply becomes part of the new conversation
+    assert await reply('bob') == 'Hi bob'
+    assert await reply('carol') == 'Hi bob'
+    assert await reply('carol') == 'Hi carol'
+
+
 @pytest.mark.asyncio
 async def test_get_housing_none_result():
     mock_conn = Mock()
@@ -29,7 +151,7 @@ async def test_get_housing_none_result():
 
     mock_conn.cursor.return_value = mock_cur
 
-    mock_cur.fetchall = Mock(return_value=[])
+    mock_cur.fetchone = Mock(return_value=(0,))
 
     get_housing = GetHousing(conn=mock_conn)
 
@@ -44,13 +166,14 @@ async def test_get_housing_none_result():
         'min_area': 100
     }
 
-    mock_tracker.get_slot.side_effect = lambda x: slots[x]
+    mock_tracker.get_slot.side_effect = lambda x: slots.get(x)
 
     run = await get_housing.run(mock_dispatcher, mock_tracker, Mock())
 
+    # nothing matched, so only the count query runs
     mock_conn.cursor.assert_called_once()
     mock_cur.execute.assert_called_once()
-    mock_cur.fetchall.assert_called_once()
+    mock_cur.fetchall.assert_not_called()
     mock_cur.close.assert_called_once()
 
     mock_dispatcher.utter_message.assert_called_once()
@@ -59,11 +182,11 @@ async def test_get_housing_none_result():
         assert mock_tracker.get_slot.called_once_with(s)
 
     assert isinstance(run, list)
-    assert len(run) == 5
+    assert len(run) == 6
 
     for r in run:
         assert r['event'] == 'slot'
-        assert r['name'] in slots.keys()
+        assert r['name'] in list(slots.keys()) + ['housing_cursor']
         assert r['value'] is None
 
 
@@ -74,6 +197,7 @@ async def test_get_housing_five_results():
 
     mock_conn.cursor.return_value = mock_cur
 
+    mock_cur.fetchone = Mock(return_value=(5,))
     mock_cur.fetchall = Mock(return_value=[MagicMock() for _ in range(5)])
 
     get_housing = GetHousing(conn=mock_conn)
@@ -91,12 +215,13 @@ async def test_get_housing_five_results():
         'min_area': 100
     }
 
-    mock_tracker.get_slot.side_effect = lambda x: slots[x]
+    mock_tracker.get_slot.side_effect = lambda x: slots.get(x)
 
     run = await get_housing.run(mock_dispatcher, mock_tracker, Mock())
 
+    # one count and one page query
     mock_conn.cursor.assert_called_once()
-    mock_cur.execute.assert_called_once()
+    assert mock_cur.execute.call_count == 2
     mock_cur.fetchall.assert_called_once()
     mock_cur.close.assert_called_once()
 
@@ -106,13 +231,18 @@ async def test_get_housing_five_results():
         assert mock_tracker.get_slot.called_once_with(s)
 
     assert isinstance(run, list)
-    assert len(run) == 5
+    assert len(run) == 6
 
-    for r in run:
+    for r in run[:5]:
         assert r['event'] == 'slot'
         assert r['name'] in slots.keys()
         assert r['value'] is None
 
+    # the search is kept for sorting it differently, there is no next page
+    assert run[5]['name'] == 'housing_cursor'
+    assert run[5]['value']['query'] == ['Tilburg', '1000', '1500', 1, 100]
+    assert run[5]['value']['after'] is None
+
 
 def test_validate_housing_form_city_1():
     validate_housing_form = ValidateHousingForm()
@@ -219,3 +349,72 @@ def test_validate_max_price_pass():
     validate_housing_form.validate_max_price(2000, mock_dispatcher, mock_tracker, mock_domain)
 
     mock_dispatcher.utter_message.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_housing_precomputed_image():
+    mock_conn = Mock()
+    mock_cur = Mock()
+
+    mock_conn.cursor.return_value = mock_cur
+
+    row = {'title': 'Apartment Singel', 'link': 'https://pararius.com/a', 'price': 1400, 'area': 50, 'rooms': 2,
+           'interior': 'Upholstered', 'location': 'Amsterdam', 'image': 'https://casco.cmcdn.com/a.jpg'}
+    mock_cur.fetchone = Mock(return_value=(2,))
+    mock_cur.fetchall = Mock(return_value=[row, dict(row, image=None)])
+
+    get_housing = GetHousing(conn=mock_conn)
+
+    mock_dispatcher = Mock()
+    mock_tracker = Mock()
+    mock_tracker.get_slot.return_value = 1
+
+    await get_housing.run(mock_dispatcher, mock_tracker, Mock())
+
+    listings = [c.kwargs['json_message'] for c in mock_dispatcher.utter_message.call_args_list[1:]]
+
+    assert listings[0]['image'] == 'https://casco.cmcdn.com/a.jpg'
+    assert 'image' not in listings[1]
+
+
+def test_tracing_span():
+    tracker = Mock()
+    tracker.events = [
+        {'event': 'user', 'text': 'hi', 'metadata': {'correlation_id': 'old'}},
+        {'event': 'bot', 'text': 'hello'},
+        {'event': 'user', 'text': 'I love red roses', 'metadata': {'correlation_id': 'abc'}},
+        {'event': 'action', 'name': 'action_dialogpt'},
+    ]
+
+    assert get_correlation_id(tracker) == 'abc'
+    assert get_correlation_id(Mock()) is None
+
+    before = STAGE_LATENCY.count('test_stage')
+    with span('test_stage', 'abc'):
+        pass
+
+    assert STAGE_LATENCY.count('test_stage') == before + 1
+    assert 'actions_stage_seconds_count{stage="test_stage"}' in STAGE_LATENCY.render()
+
+
+def test_readiness_endpoint(monkeypatch):
+    monkeypatch.setattr('rasa_ai.actions.tracing.READINESS_CHECKS', {})
+    ready = [False]
+    register_readiness('dialogpt', lambda: ready[0])
+
+    server = start_metrics_server(0)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    try:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f'{url}/ready')
+
+        assert e.value.code == 503
+        assert json.loads(e.value.read()) == {'dialogpt': False}
+
+        ready[0] = True
+        with urllib.request.urlopen(f'{url}/ready') as response:
+            assert json.loads(response.read()) == {'dialogpt': True}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from rasa_ai.actions.cities import CityResolver, edit_distance, normalize
+
+CITIES = ['Amsterdam'] * 3 + ['Rotterdam'] * 2 + ['Eindhoven', 'Leiden', 'Breda', 'Den Haag', "'s-Hertogenbosch"]
+
+
+@pytest.fixture
+def cities_db(tmp_path):
+    path = str(tmp_path / 'housing.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE housing (title TEXT, city TEXT)')
+    conn.executemany('INSERT INTO housing VALUES (?, ?)', [('Apartment', city) for city in CITIES + [None]])
+    conn.commit()
+    conn.close()
+
+    return path
+
+
+def test_normalize():
+    assert normalize("'s-Hertogenbosch") == normalize(' S HERTOGENBOSCH ') == 's hertogenbosch'
+    assert normalize('Zürich') == 'zurich'
+
+
+def test_edit_distance():
+    assert edit_distance('amsterdm', 'amsterdam', 2) == 1
+    assert edit_distance('london', 'leiden', 1) == 2
+    assert edit_distance('a', 'amsterdam', 2) == 3
+
+
+def test_resolve(cities_db):
+    resolver = CityResolver.open(cities_db)
+
+    assert resolver.resolve('amsterdam') == 'Amsterdam'
+    assert resolver.resolve('  ROTTERDAM!') == 'Rotterdam'
+
+    # typos
+    assert resolver.resolve('Amsterdm') == 'Amsterdam'
+    assert resolver.resolve('Eindhovven') == 'Eindhoven'
+    assert resolver.resolve('Brda') == 'Breda'
+
+    # Dutch and English names
+    assert resolver.resolve('The Hague') == 'Den Haag'
+    assert resolver.resolve('den bosch') == "'s-Hertogenbosch"
+
+    for text in ['london', 'Prague', 'Berlin', 'Nimwegen', '']:
+        assert resolver.resolve(text) is None
+
+    # most listings first
+    assert resolver.message == ("City should be one of the following: Amsterdam, Rotterdam, 's-Hertogenbosch, Breda, "
+                                'Den Haag, Eindhoven, Leiden')
+
+
+def test_refresh_on_change(cities_db):
+    resolver = CityResolver.open(cities_db)
+    assert resolver.resolve('Tilburg') is None
+
+    conn = sqlite3.connect(cities_db)
+    conn.execute("INSERT INTO housing VALUES ('Apartment', 'Tilburg')")
+    conn.commit()
+    conn.close()
+
+    assert resolver.resolve('tilburg') == 'Tilburg'
+    assert 'Tilburg' in resolver.message
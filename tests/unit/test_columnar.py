@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from rasa_ai.actions.columnar import ColumnarHousingStore
+from rasa_ai.actions.housing import SORT_ORDERS, HousingQuery, HousingStore
+from scraper.scrape import export_parquet
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# the slots of the test_actions cases arrive as strings and floats
+QUERIES = [
+    HousingQuery('Amsterdam', '1000', '2500', 2, 40),
+    HousingQuery('Utrecht', 0, 10000, 2.0, 0),
+    HousingQuery('Utrecht', 1000, 1000, 0, 0),
+    HousingQuery('Tilburg', '1000', '1500', 1, 100),
+]
+
+
+def all_pages(store, query, sort, limit=3):
+    total, listings, after = store.search(query, sort, limit=limit)
+    pages = [(total, [dict(listing) for listing in listings], after)]
+
+    while after is not None:
+        total, listings, after = store.search(query, sort, after, limit=limit)
+        pages.append((total, [dict(listing) for listing in listings], after))
+
+    return pages
+
+
+@pytest.mark.parametrize('sort', list(SORT_ORDERS))
+def test_matches_sqlite(housing_db, sort):
+    sqlite_store = HousingStore.open(housing_db)
+    columnar_store = ColumnarHousingStore.from_sqlite(housing_db)
+
+    for query in QUERIES:
+        assert all_pages(columnar_store, query, sort) == all_pages(sqlite_store, query, sort)
+
+    # keysets are interchangeable between the two
+    after = sqlite_store.search(QUERIES[1], sort, limit=4).after
+    listings = sqlite_store.search(QUERIES[1], sort, after).listings
+    assert columnar_store.search(QUERIES[1], sort, after).listings == [dict(listing) for listing in listings]
+
+    assert columnar_store.search(HousingQuery('Amsterdam', None, 2000, 1, 0)) == (0, [], None)
+
+
+def test_matches_sqlite_without_area(housing_db, tmp_path):
+    pytest.importorskip('pyarrow')
+
+    # the scraper stores listings without an area or rooms with NULL there
+    conn = sqlite3.connect(housing_db)
+    conn.executemany('INSERT INTO housing VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        (40, 'No area', 'https://pararius.com/40', 1000, 'Utrecht centre', None, 2, 'Upholstered', 'Utrecht', None),
+        (41, 'No rooms', 'https://pararius.com/41', 1100, 'Utrecht centre', 60, None, 'Upholstered', 'Utrecht', None),
+    ])
+    conn.commit()
+
+    parquet_path = str(tmp_path / 'housing.parquet')
+    export_parquet(conn, parquet_path)
+    conn.close()
+
+    sqlite_store = HousingStore.open(housing_db)
+    query = HousingQuery('Utrecht', 0, 10000, 0, 0)
+
+    for columnar_store in (ColumnarHousingStore.from_sqlite(housing_db), ColumnarHousingStore.open(parquet_path)):
+        for sort in SORT_ORDERS:
+            assert all_pages(columnar_store, query, sort) == all_pages(sqlite_store, query, sort)
+
+
+def test_matches_shipped_database():
+    pytest.importorskip('pyarrow')
+
+    sqlite_store = HousingStore.open(os.path.join(BASE_PATH, 'rasa_ai', 'actions', 'data', 'housing.db'))
+    columnar_store = ColumnarHousingStore.open()
+
+    for query in QUERIES + [HousingQuery('Amsterdam', 0, 100000, 0, 0)]:
+        for sort in SORT_ORDERS:
+            assert all_pages(columnar_store, query, sort, limit=10) == all_pages(sqlite_store, query, sort, limit=10)
+
+
+def test_hot_reload(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    path = str(tmp_path / 'housing.parquet')
+
+    def write(prices):
+        pq.write_table(pa.table({
+            'title': [f'Apartment {price}' for price in prices], 'link': ['https://pararius.com'] * len(prices),
+            'price': prices, 'location': ['Delft'] * len(prices), 'area': [50] * len(prices),
+            'rooms': [2] * len(prices), 'interior': ['Furnished'] * len(prices), 'city': ['Delft'] * len(prices),
+        }), path)
+
+    write([1200, 900])
+    store = ColumnarHousingStore.open(path, reload_interval=0)
+    query = HousingQuery('Delft', 0, 5000, 1, 0)
+
+    total, listings, _ = store.search(query)
+    assert total == 2
+    assert [listing['price'] for listing in listings] == [900, 1200]
+    assert 'image' in listings[0]
+
+    time.sleep(0.01)
+    write([1500, 700, 1100])
+
+    total, listings, _ = store.search(query)
+    assert total == 3
+    assert [listing['price'] for listing in listings] == [700, 1100, 1500]
@@ -0,0 +1,116 @@
+import asyncio
+
+import httpx
+import pytest
+
+from server.cache import TTLCache
+from server.enrichment import ImageEnricher, extract_image
+
+LISTING_HTML = """\
+<html><body>
+<div class="carrousel__viewport">
+    <picture><img class="picture__image" src="https://casco.cmcdn.com/listing.jpg"></picture>
+</div>
+<div class="listing-detail-summary">...</div>
+</body></html>
+"""
+
+
+def make_enricher(handler, **kwargs) -> ImageEnricher:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return ImageEnricher(client=client, **kwargs)
+
+
+def test_extract_image_1():
+    assert extract_image(LISTING_HTML) == 'https://casco.cmcdn.com/listing.jpg'
+
+
+def test_extract_image_2():
+    assert extract_image('<html><body><p>Not found</p></body></html>') is None
+
+
+def test_ttl_cache_expiry_and_eviction():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+
+    now[0] = 11
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+
+
+@pytest.mark.asyncio
+async def test_enricher_caches_results():
+    calls = []
+
+    def handler(request):
+        calls.append(str(request.url))
+        return httpx.Response(200, text=LISTING_HTML)
+
+    enricher = make_enricher(handler)
+
+    assert await enricher.get_image('https://pararius.com/a') == 'https://casco.cmcdn.com/listing.jpg'
+    assert await enricher.get_image('https://pararius.com/a') == 'https://casco.cmcdn.com/listing.jpg'
+    assert len(calls) == 1
+
+    await enricher.close()
+
+
+@pytest.mark.asyncio
+async def test_enricher_shares_concurrent_fetches():
+    calls = []
+
+    def handler(request):
+        calls.append(str(request.url))
+        return httpx.Response(200, text=LISTING_HTML)
+
+    enricher = make_enricher(handler, max_concurrency=2)
+
+    links = ['https://pararius.com/a'] * 5 + ['https://pararius.com/b'] * 5
+    images = await asyncio.gather(*(enricher.get_image(link) for link in links))
+
+    assert set(images) == {'https://casco.cmcdn.com/listing.jpg'}
+    assert sorted(calls) == ['https://pararius.com/a', 'https://pararius.com/b']
+
+    await enricher.close()
+
+
+@pytest.mark.asyncio
+async def test_enricher_http_error():
+    enricher = make_enricher(lambda request: httpx.Response(503), negative_ttl=0)
+
+    assert await enricher.get_image('https://pararius.com/a') is None
+    assert 'https://pararius.com/a' not in enricher.cache
+
+    await enricher.close()
+
+
+@pytest.mark.asyncio
+async def test_enricher_caches_failures_briefly():
+    now = [0.0]
+    calls = []
+
+    def handler(request):
+        calls.append(str(request.url))
+        return httpx.Response(404)
+
+    cache = TTLCache(maxsize=8, ttl=3600, timer=lambda: now[0])
+    enricher = make_enricher(handler, cache=cache, negative_ttl=60)
+
+    assert await enricher.get_image('https://pararius.com/a') is None
+    assert await enricher.get_image('https://pararius.com/a') is None
+    assert len(calls) == 1
+
+    # tried again once the failure expired
+    now[0] = 61
+    assert await enricher.get_image('https://pararius.com/a') is None
+    assert len(calls) == 2
+
+    await enricher.close()
@@ -0,0 +1,64 @@
+from rasa_ai.actions.history import ConversationHistory, trim
+
+
+def test_trim_within_limits():
+    turns = [[1, 0], [2, 0], [3, 0]]
+
+    assert trim(turns, max_turns=4, max_tokens=10) is turns
+
+
+def test_trim_to_half_the_limits():
+    turns = [[1, 0], [2, 0], [3, 3, 0], [4, 0], [5, 0]]
+
+    assert trim(turns, max_turns=4, max_tokens=100) == [[4, 0], [5, 0]]
+    assert trim(turns, max_turns=10, max_tokens=9) == [[4, 0], [5, 0]]
+
+
+def test_trim_long_message_from_the_left():
+    assert trim([[1, 0], [2, 3, 4, 5, 6, 0]], max_turns=4, max_tokens=4) == [[4, 5, 6, 0]]
+
+
+def test_history_prompt_continues_conversation():
+    history = ConversationHistory(max_turns=6, max_tokens=100, max_senders=10, max_cached=1)
+
+    prompt = history.prompt('alice', [1, 0])
+    assert prompt.input_ids == [1, 0] and prompt.past is None
+    assert not history.has_turns('alice')
+    history.add_reply(prompt, [2, 0], past='past', past_length=3)
+    assert history.has_turns('alice')
+
+    prompt = history.prompt('alice', [3, 0])
+    assert prompt.input_ids == [1, 0, 2, 0, 3, 0]
+    assert (prompt.past, prompt.past_length) == ('past', 3)
+
+    # the keys/values were handed over with the prompt
+    assert history.prompt('alice', [3, 0]).past is None
+    assert history.prompt('bob', [3, 0]).input_ids == [3, 0]
+    assert not history.has_turns('bob')
+
+
+def test_history_drops_past_when_trimmed():
+    history = ConversationHistory(max_turns=4, max_tokens=100, max_senders=10, max_cached=1)
+
+    prompt = history.prompt('alice', [1, 0])
+    history.add_reply(prompt, [2, 0], past='past', past_length=3)
+    history.add_turns('alice', [[3, 0], [4, 0]])
+
+    prompt = history.prompt('alice', [5, 0])
+    assert prompt.input_ids == [4, 0, 5, 0]
+    assert prompt.past is None
+
+
+def test_history_evicts_least_recent():
+    history = ConversationHistory(max_turns=6, max_tokens=100, max_senders=2, max_cached=1)
+
+    for sender_id in ('alice', 'bob'):
+        history.add_reply(history.prompt(sender_id, [1, 0]), [2, 0], past=sender_id, past_length=3)
+
+    # only the most recent sender keeps keys/values
+    assert history.prompt('alice', [3, 0]).past is None
+    assert history.prompt('bob', [3, 0]).past == 'bob'
+
+    history.prompt('carol', [1, 0])
+    assert len(history) == 2
+    assert history.prompt('alice', [3, 0]).input_ids == [3, 0]
@@ -0,0 +1,104 @@
+import sqlite3
+from unittest.mock import Mock
+
+import pytest
+
+from rasa_ai.actions.actions import GetHousing, ShowMoreHousing
+from rasa_ai.actions.housing import (COUNT_QUERY, PAGE_QUERIES, SORT_INDEXES, SORT_ORDERS, HousingQuery, HousingStore,
+                                     connect_readonly)
+
+
+def test_search(housing_db):
+    store = HousingStore.open(housing_db)
+
+    total, listings, after = store.search(HousingQuery('Amsterdam', 1000, 2500, 2, 40), limit=3)
+
+    assert total == 8
+    assert [listing['price'] for listing in listings] == [1100, 1300, 1500]
+    assert set(listings[0].keys()) == {'title', 'link', 'price', 'area', 'rooms', 'interior', 'location', 'image',
+                                       'id'}
+    assert after == [1500, 3, 100, listings[-1]['id']]
+
+    assert store.search(HousingQuery('Delft', 0, 10000, 0, 0)) == (0, [], None)
+
+    store.close()
+
+
+@pytest.mark.parametrize('sort', list(SORT_ORDERS))
+def test_pages(housing_db, sort):
+    store = HousingStore.open(housing_db)
+    query = HousingQuery('Utrecht', 0, 10000, 2, 0)
+
+    total, listings, after = store.search(query, sort, limit=6)
+    pages = [listings]
+
+    while after is not None:
+        total_after, listings, after = store.search(query, sort, after, limit=6)
+        assert total_after is None
+        pages.append(listings)
+
+    key, descending = SORT_ORDERS[sort]
+    seen = [tuple(listing[column] for column in key) for page in pages for listing in page]
+
+    assert total == 20
+    assert [len(page) for page in pages] == [6, 6, 6, 2]
+    assert seen == sorted(seen, reverse=descending)
+    assert len({listing['id'] for page in pages for listing in page}) == total
+
+    store.close()
+
+
+def test_search_uses_index(housing_db):
+    conn = connect_readonly(housing_db)
+    params = ('Amsterdam', 1000, 2500, 2, 40)
+
+    count_plan = ' '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {COUNT_QUERY}', params))
+    assert 'COVERING INDEX ix_housing_search' in count_plan
+
+    for sort, (first, following) in PAGE_QUERIES.items():
+        for query, args in ((first, params), (following, params + (1, 1, 1, 1))):
+            plan = ' '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', args + (10,)))
+
+            assert SORT_INDEXES[sort] in plan
+            # rows come out of the index in sort order, no sort step before the limit
+            assert 'TEMP B-TREE' not in plan
+
+        # the next page starts where the keyset points in the index
+        seek_plan = ' '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {following}',
+                                                             params + (1, 1, 1, 1, 10)))
+        assert f'({",".join(SORT_ORDERS[sort][0])})' in seek_plan
+
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute('DELETE FROM housing')
+
+
+@pytest.mark.asyncio
+async def test_show_more(housing_db):
+    # the actions search on a pool thread
+    get_housing = GetHousing(conn=connect_readonly(housing_db, check_same_thread=False))
+    show_more = ShowMoreHousing(conn=connect_readonly(housing_db, check_same_thread=False))
+
+    slots = {'housing_city': 'Amsterdam', 'min_price': 0, 'max_price': 10000, 'min_rooms': 1, 'min_area': 0,
+             'housing_sort': 'largest'}
+    tracker = Mock()
+    tracker.get_slot.side_effect = lambda x: slots.get(x)
+
+    dispatcher = Mock()
+    events = await get_housing.run(dispatcher, tracker, Mock())
+    slots = {'housing_cursor': events[-1]['value']}
+
+    areas = [c.kwargs['json_message']['text'].split('Area: ')[1].split(' ')[0]
+             for c in dispatcher.utter_message.call_args_list[1:]]
+    assert areas == [str(220 - 10 * i) for i in range(10)]
+
+    dispatcher = Mock()
+    events = await show_more.run(dispatcher, tracker, Mock())
+    slots = {'housing_cursor': events[-1]['value']}
+
+    dispatcher.utter_message.assert_any_call(text='Properties 11 to 20 of 20')
+    assert dispatcher.utter_message.call_count == 11
+    assert slots['housing_cursor']['after'] is None
+
+    dispatcher = Mock()
+    assert await show_more.run(dispatcher, tracker, Mock()) == []
+    dispatcher.utter_message.assert_called_once()
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rasa_ai.actions.housing import HousingQuery, HousingStore, SearchResult
+from rasa_ai.actions.housing_pool import HousingPool
+
+QUERY = HousingQuery('Amsterdam', 1000, 2500, 2, 40)
+
+
+@pytest.mark.asyncio
+async def test_parallel_searches(housing_db):
+    pool = HousingPool.open(housing_db, threads=4)
+    expected = HousingStore.open(housing_db).search(QUERY)
+
+    results = await asyncio.gather(*(pool.search(QUERY) for _ in range(50)))
+
+    assert all(result.total == expected.total for result in results)
+    assert all([dict(row) for row in result.listings] == [dict(row) for row in expected.listings]
+               for result in results)
+
+    # one connection per worker thread
+    assert 1 <= len(pool._stores) <= 4
+    assert len({id(store.conn) for store in pool._stores}) == len(pool._stores)
+
+    pool.close()
+
+    assert pool._stores == []
+
+
+@pytest.mark.asyncio
+async def test_search_does_not_block_loop():
+    class SlowStore:
+        def search(self, query):
+            time.sleep(0.2)
+            return SearchResult(0, [])
+
+    pool = HousingPool(SlowStore, threads=2)
+    ticks = []
+
+    async def tick():
+        for _ in range(5):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.02)
+
+    start = time.perf_counter()
+    results, _ = await asyncio.gather(asyncio.gather(pool.search(QUERY), pool.search(QUERY)), tick())
+
+    assert results == [(0, [], None)] * 2
+    # the event loop kept running while the two searches slept side by side
+    assert len(ticks) == 5 and ticks[-1] - start < 0.2
+    assert time.perf_counter() - start < 0.35
+
+
+def test_healthy(housing_db, tmp_path):
+    pool = HousingPool.open(housing_db, threads=1)
+    assert pool.healthy()
+    pool.close()
+
+    missing = HousingPool.open(str(tmp_path / 'missing.db'), threads=1)
+    assert not missing.healthy()
+    missing.close()
+
+    blocked = threading.Event()
+    busy = HousingPool.open(housing_db, threads=1)
+    busy.executor.submit(blocked.wait)
+
+    # a pool with every thread stuck is not ready
+    assert not busy.healthy(timeout=0.05)
+
+    blocked.set()
+    busy.close()
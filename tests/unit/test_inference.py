@@ -0,0 +1,256 @@
+import asyncio
+import copy
+import threading
+import time
+
+import pytest
+import torch
+
+from rasa_ai.actions.dialogpt import (DialoGPTBatchGenerator, conv1d_to_linear, load_mmap, load_quantized, quantize,
+                                      save_quantized)
+from rasa_ai.actions.history import ConversationHistory
+from rasa_ai.actions.inference import (GenerationRejected, GenerationTimeout, GenerationWorker, ModelLoadError,
+                                       ModelLoader)
+
+
+@pytest.mark.asyncio
+async def test_worker_batches_requests():
+    worker = GenerationWorker(lambda texts: [text.upper() for text in texts], max_batch_size=4, batch_window=0.2)
+
+    replies = await asyncio.gather(*(worker.generate(text) for text in ['a', 'b', 'c', 'd', 'e']))
+
+    assert replies == ['A', 'B', 'C', 'D', 'E']
+    assert worker.batch_sizes == [4, 1]
+
+
+@pytest.mark.asyncio
+async def test_worker_sheds_load():
+    release = threading.Event()
+
+    def slow_batch(texts):
+        release.wait()
+        return texts
+
+    worker = GenerationWorker(slow_batch, max_batch_size=1, batch_window=0, max_queue_size=1, timeout=5)
+
+    first = asyncio.ensure_future(worker.generate('busy'))
+    await asyncio.sleep(0.1)
+    second = asyncio.ensure_future(worker.generate('queued'))
+    await asyncio.sleep(0.1)
+
+    with pytest.raises(GenerationRejected):
+        await worker.generate('shed')
+
+    release.set()
+    assert await first == 'busy'
+    assert await second == 'queued'
+
+
+@pytest.mark.asyncio
+async def test_worker_timeout():
+    release = threading.Event()
+    worker = GenerationWorker(lambda texts: release.wait() and texts, timeout=0.1)
+
+    with pytest.raises(GenerationTimeout):
+        await worker.generate('slow')
+
+    release.set()
+
+
+def test_batch_generator(tiny_dialogpt):
+    model, tokenizer = tiny_dialogpt
+    generator = DialoGPTBatchGenerator(model, tokenizer, max_length=40, min_length=8)
+
+    replies = generator(['hi', 'who are you ?', 'i love red roses'])
+
+    assert len(replies) == 3
+    assert all(isinstance(reply, str) for reply in replies)
+
+
+def test_batch_generator_streams(tiny_dialogpt):
+    model, tokenizer = tiny_dialogpt
+    generator = DialoGPTBatchGenerator(model, tokenizer, max_new_tokens=12, min_length=8, do_sample=False)
+
+    pieces = []
+    replies = generator(['hi', 'i love red roses'], on_text=[None, pieces.append])
+
+    assert len(pieces) > 1
+    assert ''.join(pieces).strip() == replies[1]
+
+
+@pytest.mark.asyncio
+async def test_worker_streams_on_caller_loop():
+    threads = []
+
+    def batch_fn(texts, on_text=None):
+        for word in texts[0].split():
+            on_text[0](word + ' ')
+        return texts
+
+    def on_text(piece):
+        threads.append((threading.current_thread(), piece))
+
+    worker = GenerationWorker(batch_fn, batch_window=0)
+    reply = await worker.generate('a streamed reply', on_text=on_text)
+    await asyncio.sleep(0)
+
+    assert reply == 'a streamed reply'
+    assert [piece for _, piece in threads] == ['a ', 'streamed ', 'reply ']
+    assert all(thread is threading.main_thread() for thread, _ in threads)
+
+
+@pytest.mark.asyncio
+async def test_worker_stops_streaming_after_timeout():
+    release = threading.Event()
+    pieces = []
+
+    def batch_fn(texts, on_text=None):
+        on_text[0]('in time ')
+        release.wait()
+        on_text[0]('too late')
+        return texts
+
+    worker = GenerationWorker(batch_fn, batch_window=0, timeout=0.1)
+
+    with pytest.raises(GenerationTimeout):
+        await worker.generate('slow', on_text=pieces.append)
+
+    release.set()
+    await asyncio.sleep(0.05)
+
+    assert pieces == ['in time ']
+
+
+def test_batch_generator_reuses_past(tiny_dialogpt):
+    model, tokenizer = tiny_dialogpt
+    messages = ['hi', 'who are you ?', 'what do you like ?', 'i love red roses']
+
+    def converse(max_cached):
+        history = ConversationHistory(max_turns=10, max_tokens=64, max_cached=max_cached)
+        generator = DialoGPTBatchGenerator(model, tokenizer, history=history, max_new_tokens=6, min_length=0,
+                                           do_sample=False)
+        return [generator([message], sender_ids=['alice'])[0] for message in messages], history
+
+    replies, history = converse(max_cached=1)
+    expected, _ = converse(max_cached=0)
+
+    # generating only the new tokens gives the replies of generating the whole conversation
+    assert replies == expected
+    assert history.prompt('alice', [0]).past_length > 0
+
+
+def test_batch_generator_keeps_conversations_apart(tiny_dialogpt):
+    model, tokenizer = tiny_dialogpt
+    history = ConversationHistory(max_turns=6, max_tokens=64)
+    generator = DialoGPTBatchGenerator(model, tokenizer, history=history, max_new_tokens=6, do_sample=False)
+
+    generator(['hi', 'i love red roses'], sender_ids=['alice', 'bob'])
+    generator(['thanks'], sender_ids=['alice'])
+
+    eos = tokenizer.eos_token_id
+    alice = history.prompt('alice', [eos]).turns
+    assert [turn[-1] for turn in alice] == [eos] * 5
+    assert alice[0] == tokenizer('hi')['input_ids'] + [eos]
+    assert history.prompt('bob', [eos]).turns[0] == tokenizer('i love red roses')['input_ids'] + [eos]
+
+
+@pytest.mark.asyncio
+async def test_worker_passes_sender_ids():
+    batches = []
+
+    def batch_fn(texts, sender_ids=None):
+        batches.append(sender_ids)
+        return texts
+
+    worker = GenerationWorker(batch_fn, batch_window=0)
+    await worker.generate('a')
+    await worker.generate('b', sender_id='alice')
+
+    assert batches == [None, ['alice']]
+
+
+def test_conv1d_to_linear_is_exact(tiny_dialogpt):
+    model, tokenizer = tiny_dialogpt
+    converted = conv1d_to_linear(copy.deepcopy(model))
+
+    input_ids = tokenizer('i love red roses', return_tensors='pt')['input_ids']
+
+    with torch.inference_mode():
+        assert torch.allclose(model(input_ids).logits, converted(input_ids).logits, atol=1e-5)
+
+
+def test_quantized_roundtrip(tiny_dialogpt, tmp_path):
+    model, tokenizer = tiny_dialogpt
+    quantized = quantize(copy.deepcopy(model))
+
+    assert not any(isinstance(module, torch.nn.Linear) and not hasattr(module, '_packed_params')
+                   for module in quantized.transformer.h.modules())
+
+    save_quantized(quantized, tokenizer, str(tmp_path))
+    loaded, loaded_tokenizer = load_quantized(str(tmp_path))
+
+    input_ids = tokenizer('who are you ?', return_tensors='pt')['input_ids']
+
+    with torch.inference_mode():
+        expected = quantized(input_ids).logits
+        assert torch.equal(expected, loaded(input_ids).logits)
+
+        # int8 weights stay close to the fp32 model
+        assert torch.allclose(model(input_ids).logits, expected, atol=0.1)
+
+    assert loaded_tokenizer.encode('who are you ?') == tokenizer.encode('who are you ?')
+
+
+def test_model_loader():
+    release = threading.Event()
+    loader = ModelLoader(lambda: release.wait() and 'model', name='test').start()
+
+    assert not loader.ready
+    with pytest.raises(ModelLoadError):
+        loader.get(timeout=0.01)
+
+    release.set()
+    assert loader.get(timeout=5) == 'model'
+    assert loader.ready
+
+    def fail():
+        raise OSError('no weights')
+
+    failed = ModelLoader(fail, retries=2, backoff=0).start()
+    with pytest.raises(ModelLoadError):
+        failed.get(timeout=5)
+
+    assert not failed.ready and failed.failed
+    assert isinstance(failed.error, OSError)
+
+
+def test_model_loader_retries():
+    attempts = []
+
+    def flaky():
+        attempts.append(time.perf_counter())
+        if len(attempts) < 3:
+            raise OSError('download timed out')
+        return 'model'
+
+    loader = ModelLoader(flaky, retries=3, backoff=0.01).start()
+
+    assert loader.get(timeout=5) == 'model'
+    assert loader.ready and not loader.failed and loader.error is None
+    # the backoff doubles between attempts
+    assert attempts[2] - attempts[1] >= 0.02
+
+
+def test_load_mmap(tiny_dialogpt, tmp_path):
+    model, tokenizer = tiny_dialogpt
+    model.save_pretrained(str(tmp_path))
+
+    mapped = load_mmap(str(tmp_path), str(tmp_path / 'model.safetensors'))
+
+    # the tied head points at the mapped embedding instead of a private copy
+    assert mapped.lm_head.weight.data_ptr() == mapped.transformer.wte.weight.data_ptr()
+
+    input_ids = tokenizer('i love red roses', return_tensors='pt')['input_ids']
+
+    with torch.inference_mode():
+        assert torch.equal(model(input_ids).logits, mapped(input_ids).logits)
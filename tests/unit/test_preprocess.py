@@ -0,0 +1,134 @@
+import pathlib
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).parents[2] / 'text-generative-model'))
+
+from preprocess import (reply_chains, twitter_conversations, ubuntu_conversations,  # noqa: E402
+                        ubuntu_windows, write_shards)
+
+
+def depth_first_conversations(graph, starts, turns=4):
+    """
+    The conversations of ``load.ipynb``: every path from a start, kept if it is ``turns`` tweets long.
+    """
+    conversations = []
+
+    for start_id in starts:
+        visited_list = []
+
+        def depth_first(current, visited):
+            visited.append(current)
+            if current in graph:
+                for vertex in graph[current]:
+                    if vertex not in visited:
+                        depth_first(vertex, visited.copy())
+                visited_list.append(visited)
+
+        depth_first(start_id, [])
+        conversations.extend(path for path in visited_list if len(path) == turns)
+
+    return conversations
+
+
+def test_reply_chains_match_depth_first_search():
+    rng = random.Random(0)
+
+    # ids are shuffled and some tweets reply to tweets missing from the corpus
+    ids = rng.sample(range(1, 10000), 500)
+    parents = [-1 if i < 40 or rng.random() < 0.1 else rng.choice(ids[:i] + [99999]) for i in range(len(ids))]
+    inbound = [rng.random() < 0.8 for _ in ids]
+
+    graph = {tweet: [] for tweet in ids}
+    for tweet, parent in zip(ids, parents):
+        if parent in graph:
+            graph[parent].append(tweet)
+    starts = [tweet for tweet, parent, is_inbound in zip(ids, parents, inbound) if is_inbound and parent < 0]
+
+    ids, parents = np.array(ids), np.array(parents)
+    chains = reply_chains(ids, parents, np.array(inbound) & (parents < 0))
+
+    expected = depth_first_conversations(graph, starts)
+    assert len(expected) > 50
+    assert sorted(map(tuple, ids[chains].tolist())) == sorted(map(tuple, expected))
+
+
+def test_twitter_conversations(tmp_path):
+    path = tmp_path / 'twcs.csv'
+    pd.DataFrame([
+        (1, 'customer', True, '@sprintcare my phone is broken', None),
+        (2, 'sprintcare', False, '@115712 Sorry to hear that! @Sprint_Help can help', 1),
+        (3, 'customer', True, '@sprintcare @Sprint_Help thanks', 2),
+        (4, 'sprintcare', False, '@115712 You are welcome', 3),
+        (5, 'sprintcare', False, '@115712 Anything else?', 3),
+        (6, 'sprintcare', False, 'An outbound tweet', None),
+        (7, 'customer', True, 'reply', 6),
+        (8, 'customer', True, 'reply', 7),
+        (9, 'customer', True, 'reply', 8),
+    ], columns=['tweet_id', 'author_id', 'inbound', 'text', 'in_response_to_tweet_id']).to_csv(path, index=False)
+
+    conversations = twitter_conversations(str(path))
+
+    assert conversations.to_dict('records') == [
+        {'response': 'You are welcome', 'context-0': 'thanks', 'context-1': 'Sorry to hear that can help',
+         'context-2': 'my phone is broken'},
+        {'response': 'Anything else?', 'context-0': 'thanks', 'context-1': 'Sorry to hear that can help',
+         'context-2': 'my phone is broken'},
+    ]
+
+
+def ubuntu_rows():
+    rows = []
+
+    for folder, dialogue, turns in (('3', '1.tsv', 9), ('3', '2.tsv', 4), ('4', '1.tsv', 5), ('4', '7.tsv', 2)):
+        for turn in range(turns):
+            sender, recipient = ('alice', 'bob') if turn % 2 == 0 else ('bob', 'alice')
+            # two messages in a row make one turn
+            for part in range(2 if turn == 1 else 1):
+                rows.append((folder, dialogue, f'2010-01-01T00:{turn:02d}:{part:02d}.000Z', sender,
+                             recipient if turn else None, f'{folder}/{dialogue} turn {turn}.{part}'))
+
+    return pd.DataFrame(rows, columns=['folder', 'dialogueID', 'date', 'from', 'to', 'text'])
+
+
+def test_ubuntu_windows():
+    rows = ubuntu_rows().sample(frac=1, random_state=0)
+
+    conversations = ubuntu_windows(rows)
+
+    # 9 turns make two conversations, 5 one and 2 none
+    assert conversations['response'].tolist() == [
+        '3/1.tsv turn 3.0', '3/1.tsv turn 7.0', '3/2.tsv turn 3.0', '4/1.tsv turn 3.0',
+    ]
+    assert conversations.iloc[0].tolist() == [
+        '3/1.tsv turn 3.0', '3/1.tsv turn 2.0', '3/1.tsv turn 1.0 3/1.tsv turn 1.1', '3/1.tsv turn 0.0',
+    ]
+
+
+def test_ubuntu_conversations_chunks(tmp_path):
+    rows = ubuntu_rows()
+    paths = [str(tmp_path / 'dialogueText_3.csv'), str(tmp_path / 'dialogueText_4.csv')]
+    rows[rows['folder'] == '3'].to_csv(paths[0], index=False)
+    rows[rows['folder'] == '4'].to_csv(paths[1], index=False)
+
+    expected = ubuntu_windows(rows)
+
+    for chunk_size in (1, 3, 7, 1000):
+        conversations = pd.concat(list(ubuntu_conversations(paths, chunk_size=chunk_size)), ignore_index=True)
+        pd.testing.assert_frame_equal(conversations, expected, check_dtype=False)
+
+
+def test_write_shards(tmp_path):
+    frames = [pd.DataFrame({'response': [f'r{i}' for i in range(start, start + size)]})
+              for start, size in ((0, 3), (3, 4), (7, 0), (7, 2))]
+    output = tmp_path / 'twitter'
+    output.mkdir()
+    (output / 'part-00009.parquet').write_bytes(b'stale')
+
+    paths = write_shards(frames, str(output), shard_size=4)
+
+    assert [pd.read_parquet(path).shape[0] for path in paths] == [4, 4, 1]
+    assert pd.read_parquet(output)['response'].tolist() == [f'r{i}' for i in range(9)]
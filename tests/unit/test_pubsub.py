@@ -0,0 +1,46 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+import socketio
+
+from rasa_ai.connectors.pubsub import LocalPubSubManager, create_client_manager
+
+
+def test_create_client_manager():
+    assert create_client_manager(None) is None
+
+    manager = create_client_manager({'type': 'local', 'channel': 'workers'}, write_only=True)
+    assert isinstance(manager, LocalPubSubManager)
+    assert (manager.channel, manager.write_only) == ('workers', True)
+
+    manager = create_client_manager({'type': 'rasa_ai.connectors.pubsub.LocalPubSubManager'})
+    assert isinstance(manager, LocalPubSubManager)
+
+
+@pytest.mark.asyncio
+async def test_local_pubsub_reaches_other_worker():
+    # the worker holding the user's socket, in the room of its session
+    manager = LocalPubSubManager(channel='test-workers')
+    worker = socketio.AsyncServer(async_mode='asgi', client_manager=manager)
+    worker._send_eio_packet = AsyncMock()
+    manager.initialize()
+
+    sid = await manager.connect('eio-1', '/')
+    await manager.enter_room(sid, '/', 'session-1')
+
+    # another worker, or a process that only emits
+    other = socketio.AsyncServer(async_mode='asgi', client_manager=LocalPubSubManager(channel='test-workers',
+                                                                                     write_only=True))
+    await other.emit('bot_uttered', {'text': 'hi'}, room='session-1')
+    await other.emit('bot_uttered', {'text': 'elsewhere'}, room='session-2')
+
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+
+    manager.close()
+
+    sent = [call.args for call in worker._send_eio_packet.call_args_list]
+    assert len(sent) == 1
+    assert sent[0][0] == 'eio-1'
+    assert '"text":"hi"' in sent[0][1].data.replace(' ', '')
@@ -0,0 +1,66 @@
+import json
+import random
+
+from rasa_ai.actions.response_cache import ResponseCache, create_response_cache, normalize
+
+
+def test_normalize():
+    assert normalize('Hi!!') == normalize(' hi ') == normalize('HI') == 'hi'
+    assert normalize('Who are   you?') == 'who are you'
+
+
+def test_pool_fills_before_serving():
+    cache = ResponseCache(maxsize=10, pool_size=3, rng=random.Random(0))
+
+    for reply in ['Hello!', 'Hello!', 'Hey there', '']:
+        assert cache.get('hi') is None
+        cache.add('hi', reply)
+
+    # duplicates and empty replies do not count towards the pool
+    assert cache.get('Hi!') is None
+
+    cache.add('hi', 'Good morning')
+    replies = {cache.get('HI') for _ in range(50)}
+
+    assert replies == {'Hello!', 'Hey there', 'Good morning'}
+    assert cache.hits == 50
+    assert cache.misses == 5
+
+
+def test_lru_eviction():
+    cache = ResponseCache(maxsize=2, pool_size=1)
+
+    cache.add('hi', 'Hello')
+    cache.add('thanks', 'You are welcome')
+    assert cache.get('hi') == 'Hello'
+
+    cache.add('who are you', 'A bot')
+
+    assert len(cache) == 2
+    assert cache.get('thanks') is None
+    assert cache.get('hi') == 'Hello'
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'responses.json')
+
+    with open(path, 'w') as f:
+        json.dump({'hi': ['Hello', 'Hey'], 'thanks': ['Sure', 'Any time'], 'bye': ['Bye', 'See you']}, f)
+
+    cache = create_response_cache(maxsize=2, path=path)
+
+    # the file lists the most frequent inputs first, those survive the size cap
+    assert len(cache) == 2
+    assert cache.get('hi') in ('Hello', 'Hey')
+    assert cache.get('bye') is None
+
+    cache.save(path)
+    reloaded = ResponseCache(maxsize=2)
+    reloaded.load(path)
+
+    assert reloaded.get('hi') in ('Hello', 'Hey')
+    assert reloaded.get('thanks') in ('Sure', 'Any time')
+
+
+def test_cache_disabled():
+    assert create_response_cache(maxsize=0) is None
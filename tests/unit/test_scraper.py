@@ -0,0 +1,247 @@
+import pathlib
+import sqlite3
+import time
+
+import pytest
+import requests
+
+from scraper.enrich_images import enrich, ensure_image_column, pending_links, store_images
+from scraper.schema import ensure_schema
+from scraper.scrape import HostRateLimiter, city_url, parse_page, publish, scrape
+
+
+def test_enrich_images_store():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE housing (title TEXT, link TEXT, city TEXT)')
+    conn.executemany('INSERT INTO housing VALUES (?, ?, ?)', [('A', 'l1', 'Delft'), ('B', 'l2', 'Delft')])
+
+    ensure_image_column(conn)
+    ensure_image_column(conn)
+
+    assert pending_links(conn) == ['l1', 'l2']
+
+    stored = store_images(conn, [('l1', 'a.jpg'), ('l2', None)])
+
+    assert stored == 1
+    assert pending_links(conn) == ['l2']
+    assert sorted(pending_links(conn, refresh=True)) == ['l1', 'l2']
+
+
+def test_enrich_images_keeps_progress(tmp_path):
+    db_path = str(tmp_path / 'housing.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE housing (title TEXT, link TEXT, city TEXT, image TEXT)')
+    conn.executemany('INSERT INTO housing VALUES (?, ?, ?, NULL)', [(f'T{i}', f'l{i}', 'Delft') for i in range(5)])
+    conn.commit()
+
+    def fetched():
+        yield from [('l0', 'a.jpg'), ('l1', 'b.jpg'), ('l2', 'c.jpg')]
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        store_images(conn, fetched(), batch_size=2)
+    conn.close()
+
+    # the committed batches survive the interrupted run, the next run continues after them
+    assert pending_links(sqlite3.connect(db_path)) == ['l2', 'l3', 'l4']
+
+
+FIXTURES = pathlib.Path(__file__).parent / 'fixtures' / 'pararius'
+PAGE_1 = 'https://www.pararius.com/apartments/amsterdam'
+PAGE_2 = 'https://www.pararius.com/apartments/amsterdam/page-2'
+SINGEL = 'https://pararius.com/apartment-for-rent/amsterdam/d89222fe/singel'
+OUDEZIJDS = 'https://pararius.com/apartment-for-rent/amsterdam/2297df1b/oudezijds-achterburgwal'
+HAPARANDAWEG = 'https://pararius.com/apartment-for-rent/amsterdam/91c4e7aa/haparandaweg'
+
+
+class FixtureSession(requests.Session):
+    """
+    Serves saved pages by URL, answers 304 to a request with the page's current ETag and 404 for other URLs.
+    """
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+        self.requested = []
+
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+    def get(self, url, headers=None, **kwargs):
+        html, etag = self.pages.get(url, ('', None))
+        not_modified = etag is not None and (headers or {}).get('If-None-Match') == etag
+        self.requested.append((url, not_modified))
+
+        r = requests.Response()
+        r.status_code = 404 if etag is None else 304 if not_modified else 200
+        r._content = b'' if not_modified else html.encode()
+        r.encoding = 'utf-8'
+        if etag is not None:
+            r.headers['ETag'] = etag
+        r.url = url
+
+        return r
+
+
+def read_fixture(name):
+    return (FIXTURES / name).read_text(encoding='utf-8')
+
+
+def listings(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute('SELECT link, price, city, image FROM housing ORDER BY link').fetchall()
+    conn.close()
+
+    return rows
+
+
+def test_parse_page():
+    page, next_url = parse_page(read_fixture('amsterdam_page_1.html'), 'Amsterdam')
+
+    # the listing without a price and the ad are skipped
+    assert [listing['link'] for listing in page] == [SINGEL, OUDEZIJDS]
+    assert page[0] == {
+        'title': 'Apartment Singel',
+        'link': SINGEL,
+        'price': 3000,
+        'location': '1016 AA Amsterdam (Grachtengordel-West)',
+        'area': 125,
+        'rooms': 3,
+        'interior': 'Upholstered',
+        'city': 'Amsterdam',
+    }
+    assert next_url == PAGE_2
+
+    page, next_url = parse_page(read_fixture('amsterdam_page_2.html'), 'Amsterdam')
+
+    assert [(listing['link'], listing['area'], listing['rooms']) for listing in page] == [
+        (SINGEL, 125, 3), (HAPARANDAWEG, None, 1),
+    ]
+    assert next_url is None
+
+
+def test_city_url():
+    assert city_url('Den Haag') == 'https://www.pararius.com/apartments/den-haag'
+
+
+def test_scrape_incremental(tmp_path):
+    db_path = str(tmp_path / 'housing.db')
+
+    # a database written by the notebook, with a repeated listing and one no longer on the site
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE housing ("index" BIGINT, title TEXT, link TEXT, price BIGINT, location TEXT, '
+                 'area BIGINT, rooms BIGINT, interior TEXT, city TEXT, image TEXT)')
+    conn.executemany('INSERT INTO housing (title, link, price, city, image) VALUES (?, ?, ?, ?, ?)', [
+        ('Apartment Singel', SINGEL, 2900, 'Amsterdam', 'singel.jpg'),
+        ('Apartment Singel', SINGEL, 2900, 'Amsterdam', None),
+        ('Apartment Gone', 'https://pararius.com/gone', 1000, 'Amsterdam', None),
+        ('Apartment Delft', 'https://pararius.com/delft', 1200, 'Delft', None),
+    ])
+    conn.commit()
+    conn.close()
+
+    pages = {
+        PAGE_1: (read_fixture('amsterdam_page_1.html'), '"p1"'),
+        PAGE_2: (read_fixture('amsterdam_page_2.html'), '"p2"'),
+    }
+
+    session = FixtureSession(pages)
+    totals = scrape(db_path, cities=['Amsterdam'], interval=0, session=session)
+
+    assert totals == {'inserted': 2, 'updated': 1, 'deleted': 1}
+    # updated in place, so the image is kept
+    assert listings(db_path) == [
+        (OUDEZIJDS, 1395, 'Amsterdam', None),
+        (HAPARANDAWEG, 1550, 'Amsterdam', None),
+        (SINGEL, 3000, 'Amsterdam', 'singel.jpg'),
+        ('https://pararius.com/delft', 1200, 'Delft', None),
+    ]
+
+    # nothing changed: both pages answer 304 and every listing stays
+    session = FixtureSession(pages)
+    totals = scrape(db_path, cities=['Amsterdam'], interval=0, session=session)
+
+    assert session.requested == [(PAGE_1, True), (PAGE_2, True)]
+    assert totals == {'inserted': 0, 'updated': 0, 'deleted': 0}
+    assert len(listings(db_path)) == 4
+    # the session is the caller's to close
+    assert not session.closed
+
+    # the second page is gone
+    pages[PAGE_1] = (pages[PAGE_1][0].replace('pagination__link--next', 'pagination__link--last'), '"p1-2"')
+    session = FixtureSession(pages)
+    totals = scrape(db_path, cities=['Amsterdam'], interval=0, session=session)
+
+    assert session.requested == [(PAGE_1, False)]
+    assert totals == {'inserted': 0, 'updated': 2, 'deleted': 1}
+    assert HAPARANDAWEG not in [row[0] for row in listings(db_path)]
+
+
+def test_scrape_keeps_listings_of_incomplete_cities(tmp_path):
+    db_path = str(tmp_path / 'housing.db')
+    pages = {PAGE_1: (read_fixture('amsterdam_page_1.html'), '"p1"')}
+
+    scrape(db_path, cities=['Amsterdam'], interval=0, session=FixtureSession({**pages, PAGE_2: ('', '"p2"')}))
+    assert len(listings(db_path)) == 2
+
+    # page 2 fails, the listings only on it may still be on the site
+    scrape(db_path, cities=['Amsterdam'], interval=0, session=FixtureSession(pages))
+    assert len(listings(db_path)) == 2
+
+
+def test_host_rate_limiter():
+    limiter = HostRateLimiter(0.05)
+
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.wait('https://www.pararius.com/apartments/delft')
+    limiter.wait('https://example.com/')
+
+    elapsed = time.monotonic() - start
+    assert 0.1 <= elapsed < 0.15
+
+
+def test_publish(tmp_path):
+    db_path, live_path = str(tmp_path / 'housing.db'), str(tmp_path / 'live.db')
+
+    for path, count in ((db_path, 3), (live_path, 1)):
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE housing (link TEXT)')
+        conn.executemany('INSERT INTO housing VALUES (?)', [(f'l{i}',) for i in range(count)])
+        conn.commit()
+        conn.close()
+
+    reader = sqlite3.connect(f'file:{live_path}?mode=ro', uri=True)
+    assert reader.execute('SELECT COUNT(*) FROM housing').fetchone() == (1,)
+
+    publish(db_path, live_path)
+
+    # an open connection sees the new listings on its next query
+    assert reader.execute('SELECT COUNT(*) FROM housing').fetchone() == (3,)
+    reader.close()
+
+
+def test_enrich_images_publishes(tmp_path):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+
+    db_path, live_path = str(tmp_path / 'housing.db'), str(tmp_path / 'live.db')
+    parquet_path = str(tmp_path / 'dutch_housing.parquet')
+
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    conn.execute("INSERT INTO housing (title, link, price, city) VALUES ('Singel', ?, 3000, 'Amsterdam')", (SINGEL,))
+    conn.commit()
+    conn.close()
+
+    page = ('<div class="carrousel__viewport"><picture><img class="picture__image" src="singel.jpg"></picture>'
+            '</div>')
+    enrich(db_path, live_path=live_path, parquet_path=parquet_path,
+           session=FixtureSession({SINGEL: (page, '"s"')}))
+
+    # the action server sees the images without waiting for the next scrape
+    assert sqlite3.connect(live_path).execute('SELECT image FROM housing').fetchall() == [('singel.jpg',)]
+    assert pd.read_parquet(parquet_path)['image'].tolist() == ['singel.jpg']
@@ -1,8 +1,18 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 from starlette.websockets import WebSocketDisconnect
 
-from server.main import app, Connection, ConnectionManager
+import server.main
+from server.main import (app, Connection, ConnectionManager, connection_manager, rasa_rest, WS_SERVER_BUSY,
+                         WS_SESSION_RESUMED)
+from server.tracing import STAGE_LATENCY
+from server.upstream import Upstream
+from server.translation import DictionaryTranslator, TranslationService
 import pathlib
 import os
 
@@ -14,11 +24,11 @@ client = TestClient(app)
 def test_websocket_1():
     """
     Test connection to orchestrator through WebSocket connection.
-    Should respond with { "status": "connected" } and successful disconnect code (1000).
+    Should respond with { "status": "connected" } and a session token, and successful disconnect code (1000).
     """
     with client.websocket_connect('/ws') as websocket:
         data = websocket.receive_json()
-        assert data == {'status': 'Connected'}
+        assert data == {'status': 'Connected', 'session': data['session']}
 
         response = websocket.receive()
         assert response['code'] == 1000
@@ -42,10 +52,372 @@ def test_index_1():
     assert response.status_code == 200
 
 
+def test_metrics():
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert 'translation_cache_hit_ratio' in response.text
+
+
+def test_chat_stage_metrics(monkeypatch):
+    fake_rasa_rest(monkeypatch, [])
+
+    client.post('/chat', json={'text': 'hi', 'sender': 'u1'})
+    response = client.get('/metrics')
+
+    for stage in ('translate_user', 'rasa', 'translate_bot', 'enrich', 'turn'):
+        assert f'orchestrator_stage_seconds_count{{stage="{stage}"}}' in response.text
+
+
 def test_index_2():
     with pytest.raises(WebSocketDisconnect):
         with client.websocket_connect('/') as websocket:
             websocket.receive_json()
 
-# TODO: Test class Connection
-# TODO: Test class ConnectionManager
+
+class SlowEnricher:
+    async def get_image(self, link):
+        await asyncio.sleep(0.05)
+        return link + '.jpg'
+
+
+@pytest.mark.asyncio
+async def test_connection_bot_uttered_order():
+    """
+    Replies must reach the websocket in the order Rasa sent them, even when enrichment is slower than plain text.
+    """
+    websocket = Mock()
+    websocket.send_json = AsyncMock()
+
+    connection = Connection(websocket=websocket, upstream=Mock(), enricher=SlowEnricher())
+
+    await asyncio.gather(
+        asyncio.ensure_future(connection.bot_uttered({'title': 'Listing', 'text': 'Price', 'link': 'l1'})),
+        asyncio.ensure_future(connection.bot_uttered({'text': 'Anything else?'})),
+    )
+
+    sent = [call.args[0] for call in websocket.send_json.call_args_list]
+    assert sent == [
+        {'title': 'Listing', 'text': 'Price', 'link': 'l1', 'image': 'l1.jpg'},
+        {'text': 'Anything else?'},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_connection_bot_uttered_batch():
+    """
+    The messages of a batch are enriched concurrently and sent in one frame, after the replies before them.
+    """
+    websocket = Mock()
+    websocket.send_json = AsyncMock()
+
+    connection = Connection(websocket=websocket, upstream=Mock(), enricher=SlowEnricher())
+    listings = [{'title': f'Listing {i}', 'text': 'Price', 'link': f'l{i}'} for i in range(10)]
+
+    start = asyncio.get_event_loop().time()
+    await asyncio.gather(
+        asyncio.ensure_future(connection.bot_uttered({'title': 'First', 'text': 'Price', 'link': 'l'})),
+        asyncio.ensure_future(connection.bot_uttered_batch([{'text': 'Found 10 properties'}] + listings)),
+    )
+
+    # ten enrichments of 50ms each, run one after another they would take 500ms
+    assert asyncio.get_event_loop().time() - start < 0.3
+
+    sent = [call.args[0] for call in websocket.send_json.call_args_list]
+    assert sent[0] == {'title': 'First', 'text': 'Price', 'link': 'l', 'image': 'l.jpg'}
+    assert sent[1] == {'messages': [{'text': 'Found 10 properties'}] + [dict(listing, image=listing['link'] + '.jpg')
+                                                                       for listing in listings]}
+    assert len(sent) == 2
+
+
+@pytest.mark.asyncio
+async def test_connection_turn_ends_with_delivery():
+    websocket = Mock()
+    websocket.send_json = AsyncMock()
+
+    connection = Connection(websocket=websocket, upstream=Mock())
+    turns = STAGE_LATENCY.count('turn')
+
+    trace = connection.start_turn()
+    await connection.bot_uttered({'text': 'Hello'})
+    assert trace.delivered is not None and connection.trace is trace
+
+    # replies sent one by one are timed until the last of them, not until the user's next message
+    await asyncio.sleep(0.05)
+    connection.start_turn()
+    assert STAGE_LATENCY.count('turn') == turns + 1
+    assert trace.stages[-1] == ('turn', trace.delivered - trace.start)
+
+    # a batch holds all replies of its turn
+    await connection.bot_uttered_batch([{'text': 'Bye'}])
+    assert connection.trace is None
+    assert STAGE_LATENCY.count('turn') == turns + 2
+
+
+@pytest.mark.asyncio
+async def test_connection_precomputed_image():
+    websocket = Mock()
+    websocket.send_json = AsyncMock()
+    enricher = Mock()
+    enricher.get_image = AsyncMock()
+
+    connection = Connection(websocket=websocket, upstream=Mock(), enricher=enricher)
+    await connection.bot_uttered({'text': 'Price', 'link': 'l1', 'image': 'stored.jpg'})
+
+    enricher.get_image.assert_not_called()
+    websocket.send_json.assert_called_once_with({'text': 'Price', 'link': 'l1', 'image': 'stored.jpg'})
+
+
+@pytest.mark.asyncio
+async def test_connection_streamed_reply():
+    websocket = Mock()
+    websocket.send_json = AsyncMock()
+    translation = TranslationService(translator=DictionaryTranslator({'en-nl': {'Hello there': 'Hallo daar'}}))
+
+    connection = Connection(websocket=websocket, upstream=Mock(), translation=translation)
+
+    for lang in ('en', 'nl'):
+        connection.lang = lang
+        await connection.bot_uttered({'text': 'Hello', 'message_id': lang, 'partial': True})
+        await connection.bot_uttered({'text': ' there', 'message_id': lang, 'partial': True})
+        await connection.bot_uttered({'text': 'Hello there', 'message_id': lang, 'final': True})
+
+    translation.close()
+
+    sent = [call.args[0] for call in websocket.send_json.call_args_list]
+    assert sent == [
+        {'text': 'Hello', 'message_id': 'en', 'partial': True},
+        {'text': ' there', 'message_id': 'en', 'partial': True},
+        {'text': 'Hello there', 'message_id': 'en', 'final': True},
+        # pieces are not translated one by one, a translated reply only arrives complete
+        {'text': 'Hallo daar', 'message_id': 'nl', 'final': True},
+    ]
+
+
+def test_websocket_server_busy(monkeypatch):
+    create_upstream = Mock()
+    monkeypatch.setattr(server.main, 'create_upstream', create_upstream)
+    monkeypatch.setattr(connection_manager, 'max_connections', 0)
+
+    with client.websocket_connect('/ws') as websocket:
+        assert websocket.receive_json() == {'status': 'Server busy'}
+
+        response = websocket.receive()
+        assert response['code'] == WS_SERVER_BUSY
+
+    create_upstream.assert_not_called()
+
+
+def test_websocket_connection_removed():
+    with client.websocket_connect('/ws') as websocket:
+        websocket.receive_json()
+        websocket.receive()
+
+    assert len(connection_manager) == 0
+
+
+@pytest.mark.asyncio
+async def test_connection_manager():
+    manager = ConnectionManager(max_connections=2)
+
+    first = await manager.add_connection(Mock(), Mock())
+    second = await manager.add_connection(Mock(), Mock())
+
+    assert first != second
+    assert manager.full
+
+    # a refused connection gets no upstream
+    create_upstream = Mock()
+    assert await manager.add_connection(Mock(), create_upstream) is None
+    assert manager.rejected == 1
+    create_upstream.assert_not_called()
+
+    upstream = manager.get(first).upstream
+    upstream.close = AsyncMock()
+
+    await manager.remove_connection(first)
+    await manager.remove_connection(first)
+
+    upstream.close.assert_called_once()
+    assert len(manager) == 1
+    assert not manager.full
+
+
+
+@pytest.mark.asyncio
+async def test_connection_buffers_while_detached():
+    websocket = Mock()
+    websocket.send_json = AsyncMock()
+
+    connection = Connection(websocket=websocket, upstream=Mock(), token='t1', buffer_size=2)
+    await connection.bot_uttered({'text': 'Hello'})
+
+    connection.detach()
+    for text in ('one', 'two', 'three'):
+        await connection.bot_uttered({'text': text})
+
+    resumed = Mock()
+    resumed.accept = AsyncMock()
+    resumed.send_json = AsyncMock()
+
+    await connection.resume(resumed)
+    await connection.bot_uttered({'text': 'four'})
+
+    assert [call.args[0] for call in websocket.send_json.call_args_list] == [{'text': 'Hello'}]
+    # the oldest missed message did not fit the buffer
+    assert [call.args[0] for call in resumed.send_json.call_args_list] == [
+        {'status': 'Connected', 'session': 't1', 'resumed': True}, {'text': 'two'}, {'text': 'three'},
+        {'text': 'four'},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_connection_manager_resume():
+    manager = ConnectionManager(resume_timeout=0.05)
+
+    websocket = Mock()
+    connection_id = await manager.add_connection(websocket, Mock())
+    connection = manager.get(connection_id)
+    connection.upstream.close = AsyncMock()
+
+    await manager.detach(connection_id, websocket)
+    assert manager.detached == 1
+
+    resumed = Mock()
+    resumed.accept = AsyncMock()
+    resumed.send_json = AsyncMock()
+    assert await manager.resume(connection_id, resumed)
+    assert manager.detached == 0
+
+    # a session resumed elsewhere is not ended by its old websocket closing
+    await manager.detach(connection_id, websocket)
+    assert manager.detached == 0
+
+    # taken over by yet another websocket, the previous one is closed
+    newest = Mock()
+    newest.accept = AsyncMock()
+    newest.send_json = AsyncMock()
+    resumed.close = AsyncMock()
+    assert await manager.resume(connection_id, newest)
+    resumed.close.assert_called_once_with(code=WS_SESSION_RESUMED)
+
+    await manager.detach(connection_id, newest)
+    await asyncio.sleep(0.1)
+
+    connection.upstream.close.assert_called_once()
+    assert len(manager) == 0
+    assert not await manager.resume(connection_id, Mock())
+
+
+
+@pytest.mark.asyncio
+async def test_connection_manager_failed_resume_expires():
+    manager = ConnectionManager(max_connections=1, resume_timeout=0.05)
+
+    websocket = Mock()
+    connection_id = await manager.add_connection(websocket, Mock())
+    connection = manager.get(connection_id)
+    connection.upstream.close = AsyncMock()
+
+    await manager.detach(connection_id, websocket)
+
+    # the browser is gone again before the resumed websocket is accepted
+    vanished = Mock()
+    vanished.accept = AsyncMock(side_effect=OSError('connection reset'))
+    with pytest.raises(OSError):
+        await manager.resume(connection_id, vanished)
+
+    assert manager.detached == 1
+
+    await asyncio.sleep(0.1)
+
+    connection.upstream.close.assert_called_once()
+    assert len(manager) == 0
+    assert not manager.full
+
+class EchoUpstream(Upstream):
+    async def open(self, on_message, on_batch=None):
+        self.on_message = on_message
+
+    async def send(self, text, correlation_id=None):
+        await self.on_message({'text': f'{self.session_id}: {text}'})
+
+    async def close(self):
+        pass
+
+
+def test_websocket_resume(monkeypatch):
+    monkeypatch.setattr(server.main, 'create_upstream', EchoUpstream)
+    # the sessions left waiting for their browser stay out of the shared manager
+    monkeypatch.setattr(server.main, 'connection_manager', ConnectionManager())
+
+    with client.websocket_connect('/ws') as websocket:
+        session = websocket.receive_json()['session']
+        websocket.send_json({'message': 'hi', 'lang': 'en'})
+        first = websocket.receive_json()['text']
+
+    with client.websocket_connect(f'/ws?session={session}') as websocket:
+        assert websocket.receive_json() == {'status': 'Connected', 'session': session, 'resumed': True}
+        websocket.send_json({'message': 'again', 'lang': 'en'})
+
+        # the same upstream session, so the same Rasa tracker
+        assert websocket.receive_json()['text'] == first.replace('hi', 'again')
+
+    with client.websocket_connect('/ws?session=unknown') as websocket:
+        assert websocket.receive_json()['session'] != session
+
+
+def fake_rasa_rest(monkeypatch, calls):
+    def handler(request):
+        body = json.loads(request.content)
+        calls.append(body)
+
+        return httpx.Response(200, json=[
+            {'recipient_id': body['sender'], 'text': 'You said ' + body['message']},
+            {'recipient_id': body['sender'], 'custom': {'title': 'Listing', 'text': 'Price', 'link': 'l1',
+                                                        'image': 'l1.jpg'}},
+        ])
+
+    monkeypatch.setattr(rasa_rest, 'client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+def test_chat(monkeypatch):
+    calls = []
+    fake_rasa_rest(monkeypatch, calls)
+
+    response = client.post('/chat', json={'text': 'hi', 'sender': 'u1'})
+
+    assert response.status_code == 200
+    assert response.json() == {'sender': 'u1', 'messages': [
+        {'text': 'You said hi'},
+        {'title': 'Listing', 'text': 'Price', 'link': 'l1', 'image': 'l1.jpg'},
+    ]}
+    assert calls == [{'sender': 'u1', 'message': 'hi'}]
+
+
+def test_chat_batch(monkeypatch):
+    calls = []
+    fake_rasa_rest(monkeypatch, calls)
+
+    response = client.post('/chat/batch', json=[
+        {'text': 'one', 'sender': 'u1'},
+        {'text': 'two', 'sender': 'u2'},
+        {'text': 'three', 'sender': 'u1'},
+    ])
+
+    assert response.status_code == 200
+    assert [r['sender'] for r in response.json()] == ['u1', 'u2', 'u1']
+    assert [r['messages'][0]['text'] for r in response.json()] == ['You said one', 'You said two', 'You said three']
+
+    u1_calls = [c['message'] for c in calls if c['sender'] == 'u1']
+    assert u1_calls == ['one', 'three']
+
+
+def test_chat_rasa_unavailable(monkeypatch):
+    def handler(request):
+        raise httpx.ConnectError('connection refused')
+
+    monkeypatch.setattr(rasa_rest, 'client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    response = client.post('/chat', json={'text': 'hi', 'sender': 'u1'})
+    assert response.status_code == 502
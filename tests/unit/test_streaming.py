@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from rasa_ai.actions.streaming import ReplyStream
+
+
+@pytest.mark.asyncio
+async def test_reply_stream_coalesces():
+    requests = []
+
+    async def handler(request):
+        assert request.headers['Authorization'] == 'Bearer secret'
+        requests.append(json.loads(request.content))
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={'status': 'ok'})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    stream = ReplyStream(client, 'http://rasa/webhooks/custom_socketio/stream', 'session', message_id='m1',
+                         token='secret')
+
+    stream.push('Hello')
+    await asyncio.sleep(0.01)
+    stream.push(' there')
+    stream.push(' friend')
+    await stream.close()
+    await client.aclose()
+
+    # pieces arriving while a push is in flight go out together
+    assert requests == [
+        {'session_id': 'session', 'message_id': 'm1', 'text': 'Hello'},
+        {'session_id': 'session', 'message_id': 'm1', 'text': ' there friend'},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_reply_stream_gives_up_on_error():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        # the connector's answer to a missing or wrong token
+        return httpx.Response(401)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    stream = ReplyStream(client, 'http://rasa/stream', 'session')
+
+    stream.push('Hello')
+    await stream.close()
+    stream.push(' there')
+    await stream.close()
+    await client.aclose()
+
+    assert len(calls) == 1
+    assert stream.pushed == 0
+
+
+@pytest.mark.asyncio
+async def test_reply_stream_ignores_pushes_after_close():
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={'status': 'ok'})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    stream = ReplyStream(client, 'http://rasa/stream', 'session', message_id='m1')
+
+    stream.push('Hello')
+    await stream.close()
+    # e.g. a generation that went on after its action timed out
+    stream.push(' there')
+    await asyncio.sleep(0.01)
+    await client.aclose()
+
+    assert [request['text'] for request in requests] == ['Hello']
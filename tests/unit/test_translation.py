@@ -0,0 +1,96 @@
+import os
+import pathlib
+
+import pytest
+
+from server.translation import (BATCH_SEPARATOR, DictionaryTranslator, MTranslateTranslator, TranslationService,
+                                Translator, create_translator, load_domain_responses)
+
+BASE_PATH = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent.parent
+DOMAIN_YAML_PATH = os.path.join(BASE_PATH, 'rasa_ai', 'domain.yml')
+FIXTURES_PATH = os.path.join(BASE_PATH, 'tests', 'unit', 'fixtures', 'translations.yml')
+
+
+class FakeTranslator(Translator):
+    def __init__(self):
+        self.calls = []
+
+    def translate(self, text, src, dst):
+        self.calls.append(text)
+        return text.upper()
+
+
+@pytest.mark.asyncio
+async def test_translation_cache():
+    fake = FakeTranslator()
+    service = TranslationService(translator=fake)
+
+    assert await service.translate('hello', 'en', 'nl') == 'HELLO'
+    assert await service.translate('hello', 'en', 'nl') == 'HELLO'
+    assert await service.translate('hello', 'en', 'en') == 'hello'
+
+    assert fake.calls == ['hello']
+    assert service.cache.hits == 1
+
+    service.close()
+
+
+def test_mtranslate_batch_single_round_trip(monkeypatch):
+    calls = []
+
+    def fake_translate(text, to_language, from_language):
+        calls.append((text, to_language, from_language))
+        return text.upper()
+
+    monkeypatch.setattr('server.translation.translate', fake_translate)
+
+    assert MTranslateTranslator().translate_batch(['title', 'text'], 'en', 'nl') == ['TITLE', 'TEXT']
+    assert calls == [(BATCH_SEPARATOR.join(['title', 'text']), 'nl', 'en')]
+
+
+def test_mtranslate_batch_fallback(monkeypatch):
+    calls = []
+
+    def fake_translate(text, to_language, from_language):
+        calls.append(text)
+        return text.replace(BATCH_SEPARATOR, '\n').upper()
+
+    monkeypatch.setattr('server.translation.translate', fake_translate)
+
+    assert MTranslateTranslator().translate_batch(['title', 'text'], 'en', 'nl') == ['TITLE', 'TEXT']
+    assert len(calls) == 3
+
+
+def test_create_translator():
+    assert isinstance(create_translator('mtranslate'), MTranslateTranslator)
+    assert create_translator('identity').translate('hallo', 'nl', 'en') == 'hallo'
+
+    dictionary = create_translator('dictionary', FIXTURES_PATH)
+    assert dictionary.translate('Bye', 'en', 'nl') == 'Doei'
+    assert dictionary.translate('Doei', 'nl', 'en') == 'Bye'
+    assert dictionary.translate('Unknown', 'en', 'nl') == 'Unknown'
+
+    with pytest.raises(ValueError):
+        create_translator('babelfish')
+
+
+@pytest.mark.asyncio
+async def test_translation_dictionary_backend():
+    service = TranslationService(translator=DictionaryTranslator.from_file(FIXTURES_PATH))
+
+    assert await service.translate_many(['Bye', 'See you!'], 'en', 'nl') == ['Doei', 'Tot ziens!']
+
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_translation_warm():
+    service = TranslationService(translator=FakeTranslator())
+
+    responses = load_domain_responses(DOMAIN_YAML_PATH)
+    await service.warm(responses, languages=['nl', 'ru'])
+
+    assert len(service.cache) == 2 * len(responses)
+    assert await service.translate(responses[0], 'en', 'ru') == responses[0].upper()
+
+    service.close()
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from server.upstream import RasaChannelPool
+
+
+class FakeClient:
+    """
+    Stands in for socketio.AsyncClient talking to the custom socket.io channel with session persistence.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.emitted = []
+        self.connected = False
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    async def connect(self, url, transports=None):
+        self.connected = True
+        await self.handlers['connect']()
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def call(self, event, data, timeout=None):
+        self.emitted.append((event, data))
+
+    async def emit(self, event, data):
+        self.emitted.append((event, data))
+
+    async def reply(self, session_id, text):
+        await self.handlers['bot_uttered']({'text': text, 'session_id': session_id})
+
+    async def reply_batch(self, session_id, texts):
+        await self.handlers['bot_uttered_batch']({'messages': [{'text': text} for text in texts],
+                                                  'session_id': session_id})
+
+
+@pytest.mark.asyncio
+async def test_pool_routes_by_session():
+    clients = []
+
+    def factory():
+        clients.append(FakeClient())
+        return clients[-1]
+
+    pool = RasaChannelPool('http://rasa:5005/', size=2, client_factory=factory)
+
+    received = {'a': [], 'b': [], 'c': []}
+
+    sessions = {}
+    for session_id in received:
+        async def handler(data, session_id=session_id):
+            received[session_id].append(data)
+
+        sessions[session_id] = pool.session(session_id)
+        await sessions[session_id].open(handler)
+
+    assert len(clients) == 2
+    assert pool.assignments == {'a': 0, 'b': 1, 'c': 0}
+
+    await sessions['b'].send('hello')
+    assert clients[1].emitted[-1] == ('user_uttered', {'message': 'hello', 'session_id': 'b'})
+
+    await clients[0].reply('c', 'hi c')
+    await clients[1].reply('b', 'hi b')
+    await clients[1].reply('unknown', 'dropped')
+
+    assert received == {'a': [], 'b': [{'text': 'hi b'}], 'c': [{'text': 'hi c'}]}
+
+    await sessions['c'].close()
+    assert clients[0].emitted[-1] == ('session_end', {'session_id': 'c'})
+    assert 'c' not in pool.handlers
+
+    await pool.close()
+    assert not any(client.connected for client in clients)
+
+
+@pytest.mark.asyncio
+async def test_pool_spreads_sessions_while_connecting():
+    connected = asyncio.Event()
+
+    class SlowClient(FakeClient):
+        async def connect(self, url, transports=None):
+            await connected.wait()
+            await super().connect(url, transports)
+
+    pool = RasaChannelPool('http://rasa:5005/', size=2, client_factory=SlowClient)
+
+    async def handler(data):
+        pass
+
+    opening = [asyncio.ensure_future(pool.session(session_id).open(handler)) for session_id in 'abcd']
+    await asyncio.sleep(0)
+    connected.set()
+    await asyncio.gather(*opening)
+
+    assert pool.assignments == {'a': 0, 'b': 1, 'c': 0, 'd': 1}
+
+
+@pytest.mark.asyncio
+async def test_pool_releases_slot_when_connect_fails():
+    class FailingClient(FakeClient):
+        async def connect(self, url, transports=None):
+            raise ConnectionError('rasa is down')
+
+    pool = RasaChannelPool('http://rasa:5005/', size=1, client_factory=FailingClient)
+
+    async def handler(data):
+        pass
+
+    with pytest.raises(ConnectionError):
+        await pool.session('a').open(handler)
+
+    assert pool.assignments == {} and pool._loads == [0]
+
+
+@pytest.mark.asyncio
+async def test_pool_rejoins_after_reconnect():
+    client = FakeClient()
+    pool = RasaChannelPool('http://rasa:5005/', size=1, client_factory=lambda: client)
+
+    async def handler(data):
+        pass
+
+    await pool.session('a').open(handler)
+    await pool.session('b').open(handler)
+    client.emitted.clear()
+
+    await client.handlers['connect']()
+
+    assert client.emitted == [('session_request', {'session_id': 'a'}), ('session_request', {'session_id': 'b'})]
+
+
+@pytest.mark.asyncio
+async def test_pool_routes_batches():
+    client = FakeClient()
+    pool = RasaChannelPool('http://rasa:5005/', size=1, client_factory=lambda: client)
+
+    received = []
+    batches = []
+
+    async def on_message(data):
+        received.append(data)
+
+    async def on_batch(messages):
+        batches.append(messages)
+
+    await pool.session('a').open(on_message, on_batch)
+    await pool.session('b').open(on_message)
+
+    await client.reply_batch('a', ['one', 'two'])
+    await client.reply_batch('b', ['three', 'four'])
+    await client.reply_batch('unknown', ['dropped'])
+
+    assert batches == [[{'text': 'one'}, {'text': 'two'}]]
+    # a session without a batch handler gets the messages one by one
+    assert received == [{'text': 'three'}, {'text': 'four'}]
@@ -0,0 +1,228 @@
+"""
+Builds the DialoGPT training conversations from the raw corpora, the script version of the Twitter and Ubuntu parts
+of ``load.ipynb``.
+
+Every conversation is ``TURNS`` turns, written with the latest turn first in the columns ``response``,
+``context-0``, ``context-1`` and ``context-2`` that ``train_dialogpt.ipynb`` reads, as parquet shards of
+``--shard-size`` rows. ``pd.read_parquet(output)`` reads all shards of a corpus back.
+
+Usage:
+    python preprocess.py twitter --input data/customer-support/twcs/twcs.csv --output data/twitter
+    python preprocess.py ubuntu --input data/ubuntu-dialogue/Ubuntu-dialogue-corpus --output data/ubuntu
+"""
+import argparse
+import glob
+import logging
+import os
+import time
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+TURNS = 4
+COLUMNS = ['response'] + [f'context-{i}' for i in range(TURNS - 1)]
+
+SHARD_SIZE = 100000
+# rows of the Ubuntu CSVs read at a time
+CHUNK_SIZE = 200000
+
+MENTION_PATTERN = r'[^A-Za-z0-9]+@[A-Za-z0-9_]+|^@[A-Za-z0-9_]+'
+
+TWITTER_COLUMNS = ['tweet_id', 'inbound', 'text', 'in_response_to_tweet_id']
+UBUNTU_COLUMNS = ['folder', 'dialogueID', 'date', 'from', 'to', 'text']
+
+logger = logging.getLogger(__name__)
+
+
+def clean_tweets(text: pd.Series) -> pd.Series:
+    """
+    Removes the @mentions, which every tweet of a support thread starts with.
+    """
+    return text.str.replace(MENTION_PATTERN, '', regex=True).str.strip()
+
+
+def conversation_frame(turns: np.ndarray) -> pd.DataFrame:
+    """
+    Conversations from a matrix of turns in the order they were said.
+    """
+    return pd.DataFrame(turns[:, ::-1], columns=COLUMNS[:turns.shape[1]])
+
+
+def reply_chains(tweet_ids: np.ndarray, parent_ids: np.ndarray, is_start: np.ndarray,
+                 turns: int = TURNS) -> np.ndarray:
+    """
+    Every chain of ``turns`` tweets that begins at a tweet of ``is_start`` and goes on with a reply to the previous
+    one, as rows of positions in ``tweet_ids``. ``parent_ids`` is the tweet each tweet replies to, or -1.
+
+    The chains are extended one turn at a time for all of them at once: the replies of a tweet are a slice of the
+    tweets grouped by parent, so each step is a few array operations however many chains there are.
+    """
+    if not len(tweet_ids):
+        return np.empty((0, turns), dtype=np.int64)
+
+    order = np.argsort(tweet_ids, kind='stable')
+    sorted_ids = tweet_ids[order]
+
+    # position of the parent, -1 for tweets that reply to nothing or to a tweet missing from the corpus
+    found = np.minimum(np.searchsorted(sorted_ids, parent_ids), len(sorted_ids) - 1)
+    parents = np.where((parent_ids >= 0) & (sorted_ids[found] == parent_ids), order[found], -1)
+
+    replies = np.flatnonzero(parents >= 0)
+    replies = replies[np.argsort(parents[replies], kind='stable')]
+    # the replies of the tweet at position i are replies[offsets[i]:offsets[i + 1]]
+    offsets = np.searchsorted(parents[replies], np.arange(len(tweet_ids) + 1))
+
+    chains = np.flatnonzero(is_start)[:, None]
+
+    for _ in range(turns - 1):
+        last = chains[:, -1]
+        counts = offsets[last + 1] - offsets[last]
+
+        rows = np.repeat(np.arange(len(chains)), counts)
+        nth = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        chains = np.column_stack([chains[rows], replies[offsets[last][rows] + nth]])
+
+    return chains
+
+
+def twitter_conversations(path: str, turns: int = TURNS) -> pd.DataFrame:
+    """
+    The threads of the Twitter customer support corpus that a customer started, ``turns`` tweets from the start.
+    """
+    tweets = pd.read_csv(path, usecols=TWITTER_COLUMNS,
+                         dtype={'tweet_id': np.int64, 'inbound': bool, 'text': object,
+                                'in_response_to_tweet_id': np.float64})
+
+    parent_ids = tweets['in_response_to_tweet_id'].fillna(-1).to_numpy(np.int64)
+    is_start = tweets['inbound'].to_numpy() & (parent_ids < 0)
+    chains = reply_chains(tweets['tweet_id'].to_numpy(), parent_ids, is_start, turns)
+
+    # only the tweets in a conversation are cleaned, and each of them once
+    used = np.unique(chains)
+    text = np.empty(len(tweets), dtype=object)
+    text[used] = clean_tweets(tweets['text'].iloc[used].fillna('')).to_numpy()
+
+    return conversation_frame(text[chains])
+
+
+def ubuntu_windows(rows: pd.DataFrame, turns: int = TURNS) -> pd.DataFrame:
+    """
+    The conversations of complete dialogues: consecutive messages from the same sender to the same recipient are one
+    turn, and each dialogue is cut into consecutive groups of ``turns`` turns.
+    """
+    rows = rows.dropna(subset=['text']).fillna({'from': '', 'to': ''})
+    rows = rows.sort_values(['folder', 'dialogueID', 'date'], kind='stable', ignore_index=True)
+
+    # dialogue ids are file names, unique within a folder only
+    dialogue = (rows['folder'] + '/' + rows['dialogueID']).to_numpy()
+    sender, recipient = rows['from'].to_numpy(), rows['to'].to_numpy()
+
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = (dialogue[1:] != dialogue[:-1]) | (sender[1:] != sender[:-1]) | (recipient[1:] != recipient[:-1])
+    turn = np.cumsum(starts) - 1
+
+    text = rows['text'].astype(str).groupby(turn, sort=False).agg(' '.join).to_numpy()
+    turn_dialogue = pd.Series(dialogue[starts])
+
+    position = turn_dialogue.groupby(turn_dialogue, sort=False).cumcount().to_numpy()
+    length = turn_dialogue.groupby(turn_dialogue, sort=False).transform('size').to_numpy()
+    complete = position // turns < length // turns
+
+    return conversation_frame(text[complete].reshape(-1, turns))
+
+
+def ubuntu_conversations(paths: Iterable[str], chunk_size: int = CHUNK_SIZE,
+                         turns: int = TURNS) -> Iterator[pd.DataFrame]:
+    """
+    The conversations of the Ubuntu dialogue CSVs, read ``chunk_size`` rows at a time.
+
+    The rows of a dialogue are consecutive in the files, so only the last dialogue of a chunk can go on in the next
+    one; its rows are held back and processed with that chunk.
+    """
+    held: Optional[pd.DataFrame] = None
+
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=UBUNTU_COLUMNS, dtype=str, chunksize=chunk_size):
+            if held is not None:
+                chunk = pd.concat([held, chunk], ignore_index=True)
+
+            dialogue = chunk['folder'] + '/' + chunk['dialogueID']
+            last = (dialogue == dialogue.iloc[-1]).to_numpy()
+            held = chunk[last]
+
+            yield ubuntu_windows(chunk[~last], turns)
+
+    if held is not None:
+        yield ubuntu_windows(held, turns)
+
+
+def write_shards(conversations: Iterable[pd.DataFrame], output: str, shard_size: int = SHARD_SIZE) -> List[str]:
+    """
+    Writes the conversations as ``part-00000.parquet``, ``part-00001.parquet``, ... of ``shard_size`` rows, replacing
+    the shards of a previous run.
+    """
+    os.makedirs(output, exist_ok=True)
+    for path in glob.glob(os.path.join(output, 'part-*.parquet')):
+        os.remove(path)
+
+    paths: List[str] = []
+    pending: List[pd.DataFrame] = []
+    pending_rows = 0
+
+    def write(frame: pd.DataFrame) -> None:
+        path = os.path.join(output, f'part-{len(paths):05d}.parquet')
+        frame.to_parquet(path, index=False)
+        paths.append(path)
+
+    for frame in conversations:
+        pending.append(frame)
+        pending_rows += len(frame)
+
+        if pending_rows >= shard_size:
+            frame = pd.concat(pending, ignore_index=True)
+            full = len(frame) - len(frame) % shard_size
+
+            for start in range(0, full, shard_size):
+                write(frame.iloc[start:start + shard_size])
+
+            pending, pending_rows = [frame.iloc[full:]], len(frame) - full
+
+    # the last shard, or an empty one so that the output always reads back as a table
+    if pending_rows or not paths:
+        write(pd.concat(pending, ignore_index=True) if pending else pd.DataFrame(columns=COLUMNS))
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build DialoGPT training conversations from the raw corpora')
+    parser.add_argument('corpus', choices=['twitter', 'ubuntu'])
+    parser.add_argument('--input', help='twcs.csv, or the directory with the dialogueText*.csv files')
+    parser.add_argument('--output', help='directory of the parquet shards, data/<corpus> by default')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+
+    if args.corpus == 'twitter':
+        path = args.input or os.path.join(BASE_PATH, 'data', 'customer-support', 'twcs', 'twcs.csv')
+        conversations: Iterable[pd.DataFrame] = [twitter_conversations(path)]
+    else:
+        directory = args.input or os.path.join(BASE_PATH, 'data', 'ubuntu-dialogue', 'Ubuntu-dialogue-corpus')
+        conversations = ubuntu_conversations(sorted(glob.glob(os.path.join(directory, 'dialogueText*.csv'))),
+                                             chunk_size=args.chunk_size)
+
+    output = args.output or os.path.join(BASE_PATH, 'data', args.corpus)
+    paths = write_shards(conversations, output, shard_size=args.shard_size)
+
+    logger.info(f'Wrote {len(paths)} shards to {output} in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()